@@ -0,0 +1,369 @@
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from MyGPT import AssistantRunWaiterClass
+
+# Statuses after which the thread of a run accepts a new run. Threads of runs in other
+# statuses, as 'requires_action', still hold an active run and are deleted instead of reused.
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled', 'expired', 'incomplete')
+
+class AssistantRun:
+    """
+    Handle of a single assistant run, with its own thread, status and result.
+
+    Attributes:
+        thread_id (str): ID of the thread the run belongs to.
+        run_id (str): ID of the run, None until a streamed run is created.
+        future: Future of a streamed run, or None when it is polled.
+        status (str): Last known status of the run.
+        result (str): Content of the assistant answer, once read.
+        released (bool): Whether the thread was already released by this run.
+    """
+    __slots__ = ('thread_id', 'run_id', 'future', 'status', 'result', 'released')
+
+    def __init__(self, thread_id, run_id=None):
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.future = None
+        self.status = None
+        self.result = None
+        self.released = False
+
+    def set_run_id(self, run_id):
+        self.run_id = run_id
+
+class AssistantRunManager:
+    """
+    Starts and tracks many assistant runs at once, each one on its own thread.
+
+    A thread accepts a single active run, so every run takes a thread of its own from
+    a pool. The thread stays with its run until the result is read by `get_result`,
+    including for failed runs and runs requiring action, so a finished run never loses
+    its answer to a full pool. It then goes back to the pool to be reused by later runs
+    (`reuse_threads=True`), keeping at most `max_idle_threads` idle ones, or is deleted
+    (`reuse_threads=False`, or the pool is full), so runs never share context. Results
+    are fetched by run ID with `limit=1`, so concurrent runs never read each other's
+    answers.
+
+    Attributes:
+        reuse_threads (bool): Whether finished threads are reused by later runs.
+        max_idle_threads (int): Maximum number of idle threads kept for reuse.
+        __client: OpenAI client used for the Assistants API.
+        __run_waiter: AssistantRunWaiter used to wait for the runs.
+        __idle_threads (list): IDs of the threads available for new runs.
+        __active_runs (int): Number of runs started whose result was not read yet.
+        __stats (dict): Counters of the created and deleted threads.
+        __lock: Lock protecting the threads pool and the counters.
+    """
+
+    def __init__(self, client, run_waiter=None, reuse_threads=True, max_idle_threads=4):
+        """
+        Initializes an instance of the AssistantRunManager class.
+
+        Args:
+            client: OpenAI client, synchronous or asynchronous.
+            run_waiter (AssistantRunWaiter, optional): Waiter for the runs (default: AssistantRunWaiter()).
+            reuse_threads (bool, optional): Whether finished threads are reused by later runs (default: True).
+            max_idle_threads (int, optional): Maximum number of idle threads kept for reuse (default: 4).
+        """
+        self.reuse_threads = reuse_threads
+        self.max_idle_threads = max_idle_threads
+        self.__client = client
+        self.__run_waiter = run_waiter or AssistantRunWaiterClass.AssistantRunWaiter()
+        self.__idle_threads = []
+        self.__active_runs = 0
+        self.__stats = {'threads_created': 0, 'threads_deleted': 0}
+        self.__lock = threading.Lock()
+
+    def __take_idle_thread(self):
+        with self.__lock:
+            self.__active_runs += 1
+            return self.__idle_threads.pop() if self.__idle_threads else None
+
+    def __count(self, stat):
+        with self.__lock:
+            self.__stats[stat] += 1
+
+    def __finish(self, run, deleting):
+        """
+        Releases the thread of a run, at most once, after its result was read.
+
+        Args:
+            run (AssistantRun): Run whose result was read.
+            deleting (bool): Whether the thread is going to be deleted instead of reused. Threads of
+                runs that did not finish, as runs requiring action, are always deleted.
+
+        Returns:
+            str: ID of the thread to delete, or None.
+        """
+        with self.__lock:
+            if run.released:
+                return None
+            run.released = True
+            self.__active_runs -= 1
+            if (not deleting and run.status in FINISHED_STATUSES and
+                    len(self.__idle_threads) < self.max_idle_threads):
+                self.__idle_threads.append(run.thread_id)
+                return None
+            return run.thread_id
+
+    def __stream_done(self, run, future):
+        """
+        Records the final status of a streamed run as soon as its stream ends.
+        """
+        if future.cancelled() or future.exception() is not None:
+            run.status = 'failed'
+        else:
+            run.status = future.result()
+
+    def __run_params(self, run, assistant_id, instructions):
+        return {'thread_id': run.thread_id, 'assistant_id': assistant_id, 'instructions': instructions}
+
+    def __create_run(self, run, assistant_id, instructions, stream):
+        params = self.__run_params(run, assistant_id, instructions)
+        if stream:
+            manager = self.__client.beta.threads.runs.stream(**params)
+            run.future = self.__run_waiter.submit(self.__run_waiter.follow_stream, manager, on_run=run.set_run_id)
+            run.future.add_done_callback(lambda future: self.__stream_done(run, future))
+        else:
+            run.run_id = self.__client.beta.threads.runs.create(**params).id
+
+    def start(self, assistant_id, content, instructions='', stream=False, refresh_assistant=None):
+        """
+        Sends a user message to the assistant on a free thread and starts a run.
+
+        Args:
+            assistant_id (str): ID of the assistant.
+            content (str): Content of the user's message.
+            instructions (str, optional): Instructions for the run.
+            stream (bool, optional): Whether to follow the run through the streaming API (default: False).
+            refresh_assistant (function, optional): Called when the assistant is not found, returning a
+                new assistant ID to retry once with.
+
+        Returns:
+            AssistantRun: Handle of the new run.
+        """
+        import openai
+
+        thread_id = self.__take_idle_thread()
+        try:
+            if thread_id is None:
+                thread_id = self.__client.beta.threads.create().id
+                self.__count('threads_created')
+            run = AssistantRun(thread_id)
+            self.__client.beta.threads.messages.create(thread_id=thread_id, role='user', content=content)
+            try:
+                self.__create_run(run, assistant_id, instructions, stream)
+            except openai.NotFoundError:
+                if refresh_assistant is None:
+                    raise
+                self.__create_run(run, refresh_assistant(), instructions, stream)
+        except Exception:
+            with self.__lock:
+                self.__active_runs -= 1
+                if thread_id is not None:
+                    self.__idle_threads.append(thread_id)
+            raise
+        return run
+
+    async def async_start(self, assistant_id, content, instructions='', refresh_assistant=None):
+        """
+        Sends a user message to the assistant on a free thread and starts a run, with an async client.
+
+        Args:
+            assistant_id (str): ID of the assistant.
+            content (str): Content of the user's message.
+            instructions (str, optional): Instructions for the run.
+            refresh_assistant (function, optional): Coroutine function called when the assistant is not
+                found, returning a new assistant ID to retry once with.
+
+        Returns:
+            AssistantRun: Handle of the new run.
+        """
+        import openai
+
+        thread_id = self.__take_idle_thread()
+        try:
+            if thread_id is None:
+                thread_id = (await self.__client.beta.threads.create()).id
+                self.__count('threads_created')
+            run = AssistantRun(thread_id)
+            await self.__client.beta.threads.messages.create(thread_id=thread_id, role='user', content=content)
+            try:
+                created = await self.__client.beta.threads.runs.create(**self.__run_params(run, assistant_id,
+                                                                                          instructions))
+            except openai.NotFoundError:
+                if refresh_assistant is None:
+                    raise
+                created = await self.__client.beta.threads.runs.create(
+                    **self.__run_params(run, await refresh_assistant(), instructions))
+            run.run_id = created.id
+        except Exception:
+            with self.__lock:
+                self.__active_runs -= 1
+                if thread_id is not None:
+                    self.__idle_threads.append(thread_id)
+            raise
+        return run
+
+    def __delete_thread(self, thread_id):
+        if thread_id is not None:
+            self.__client.beta.threads.delete(thread_id)
+            self.__count('threads_deleted')
+
+    async def __async_delete_thread(self, thread_id):
+        if thread_id is not None:
+            await self.__client.beta.threads.delete(thread_id)
+            self.__count('threads_deleted')
+
+    def check_status(self, run):
+        """
+        Checks the status of a run.
+
+        Args:
+            run (AssistantRun): Handle of the run.
+
+        Returns:
+            str: Status of the run.
+        """
+        run.status = self.__client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.run_id).status
+        return run.status
+
+    async def async_check_status(self, run):
+        """
+        Checks the status of a run, with an async client.
+
+        Args:
+            run (AssistantRun): Handle of the run.
+
+        Returns:
+            str: Status of the run.
+        """
+        run.status = (await self.__client.beta.threads.runs.retrieve(thread_id=run.thread_id,
+                                                                     run_id=run.run_id)).status
+        return run.status
+
+    def wait(self, run, timeout=None, on_status=None):
+        """
+        Waits for a run to finish. Streamed runs finish on their completion event; other
+        runs are polled with exponential backoff and jitter.
+
+        Args:
+            run (AssistantRun): Handle of the run.
+            timeout (float, optional): Deadline in seconds (default: the run waiter timeout).
+            on_status (function, optional): Called with each new status of a polled run.
+
+        Returns:
+            str: Final status of the run.
+
+        Raises:
+            TimeoutError: If the run does not finish before the deadline.
+        """
+        if run.future is None:
+            return self.__run_waiter.poll(lambda: self.check_status(run), timeout=timeout, on_status=on_status)
+        timeout = self.__run_waiter.timeout if timeout is None else timeout
+        try:
+            return run.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError('Assistant run did not finish before the deadline')
+
+    async def async_wait(self, run, timeout=None, on_status=None):
+        """
+        Waits for a run to finish without blocking the event loop.
+
+        Args:
+            run (AssistantRun): Handle of the run.
+            timeout (float, optional): Deadline in seconds (default: the run waiter timeout).
+            on_status (function, optional): Called with each new status.
+
+        Returns:
+            str: Final status of the run.
+
+        Raises:
+            TimeoutError: If the run does not finish before the deadline.
+        """
+        return await self.__run_waiter.async_poll(lambda: self.async_check_status(run), timeout=timeout,
+                                                  on_status=on_status)
+
+    def wait_async(self, run, timeout=None, on_status=None, callback=None):
+        """
+        Waits for a run in background.
+
+        Args:
+            run (AssistantRun): Handle of the run.
+            timeout (float, optional): Deadline in seconds (default: the run waiter timeout).
+            on_status (function, optional): Called with each new status of a polled run.
+            callback (function, optional): Called with the future once the run finishes.
+
+        Returns:
+            Future: Future resolved with the final status of the run.
+        """
+        return self.__run_waiter.submit(self.wait, run, timeout=timeout, on_status=on_status, callback=callback)
+
+    def __read_result(self, run, page):
+        run.result = page.data[0].content[0].text.value if page.data else None
+        return run.result
+
+    def get_result(self, run):
+        """
+        Reads the answer of a finished run, by run ID, then releases its thread.
+
+        Args:
+            run (AssistantRun): Handle of the run.
+
+        Returns:
+            str: Content of the assistant answer.
+        """
+        if run.result is None and not run.released:
+            page = self.__client.beta.threads.messages.list(thread_id=run.thread_id, run_id=run.run_id, limit=1,
+                                                            order='desc')
+            self.__read_result(run, page)
+        self.__delete_thread(self.__finish(run, deleting=not self.reuse_threads))
+        return run.result
+
+    async def async_get_result(self, run):
+        """
+        Reads the answer of a finished run, by run ID, with an async client, then releases its thread.
+
+        Args:
+            run (AssistantRun): Handle of the run.
+
+        Returns:
+            str: Content of the assistant answer.
+        """
+        if run.result is None and not run.released:
+            page = await self.__client.beta.threads.messages.list(thread_id=run.thread_id, run_id=run.run_id,
+                                                                  limit=1, order='desc')
+            self.__read_result(run, page)
+        await self.__async_delete_thread(self.__finish(run, deleting=not self.reuse_threads))
+        return run.result
+
+    def __take_idle_threads(self):
+        with self.__lock:
+            thread_ids, self.__idle_threads = self.__idle_threads, []
+        return thread_ids
+
+    def close(self):
+        """
+        Deletes the idle threads. Threads of runs still in progress are left untouched.
+        """
+        for thread_id in self.__take_idle_threads():
+            self.__delete_thread(thread_id)
+
+    async def async_close(self):
+        """
+        Deletes the idle threads, with an async client.
+        """
+        for thread_id in self.__take_idle_threads():
+            await self.__async_delete_thread(thread_id)
+
+    def get_stats(self):
+        """
+        Returns the state of the threads pool.
+
+        Returns:
+            dict: Runs in progress ('active_runs'), idle threads ('idle_threads') and the numbers
+                of threads created ('threads_created') and deleted ('threads_deleted').
+        """
+        with self.__lock:
+            return {'active_runs': self.__active_runs, 'idle_threads': len(self.__idle_threads), **self.__stats}
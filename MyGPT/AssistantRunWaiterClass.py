@@ -0,0 +1,169 @@
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PENDING_STATUSES = ('queued', 'in_progress', 'cancelling')
+
+class AssistantRunWaiter:
+    """
+    Waits for assistant runs to finish without a fixed polling interval.
+
+    Polling starts fast and backs off exponentially with jitter up to a maximum
+    interval, so short runs are noticed quickly and long runs do not spend API calls
+    on status checks. Runs can also be followed through the Assistants streaming API,
+    and waits can be submitted to a background thread, returning a future.
+
+    Attributes:
+        initial_interval (float): Seconds before the first status check.
+        max_interval (float): Maximum seconds between status checks.
+        multiplier (float): Growth factor of the interval after each check.
+        jitter (float): Fraction of the interval randomly added or removed.
+        timeout (float): Default deadline in seconds for a run (None waits forever).
+        __executor: Thread pool used by `submit`, created on first use.
+        __executor_lock: Lock making sure a single thread pool is created.
+    """
+
+    def __init__(self, initial_interval=0.25, max_interval=4.0, multiplier=1.6, jitter=0.2, timeout=None):
+        """
+        Initializes an instance of the AssistantRunWaiter class.
+
+        Args:
+            initial_interval (float, optional): Seconds before the first status check (default: 0.25).
+            max_interval (float, optional): Maximum seconds between status checks (default: 4.0).
+            multiplier (float, optional): Growth factor of the interval (default: 1.6).
+            jitter (float, optional): Fraction of the interval randomly added or removed (default: 0.2).
+            timeout (float, optional): Default deadline in seconds for a run (default: None).
+        """
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+        self.__executor = None
+        self.__executor_lock = threading.Lock()
+
+    def intervals(self):
+        """
+        Yields the sleep intervals between status checks.
+
+        Yields:
+            float: Seconds to sleep before the next check.
+        """
+        interval = self.initial_interval
+        while True:
+            yield max(0, interval * (1 + random.uniform(-self.jitter, self.jitter)))
+            interval = min(self.max_interval, interval * self.multiplier)
+
+    def __sleep_time(self, interval, deadline):
+        """
+        Limits a sleep interval to the deadline, raising TimeoutError if it has passed.
+        """
+        if deadline is None:
+            return interval
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('Assistant run did not finish before the deadline')
+        return min(interval, remaining)
+
+    def poll(self, check_status, timeout=None, on_status=None):
+        """
+        Polls a run until it leaves the pending statuses.
+
+        Args:
+            check_status (function): Function returning the current run status.
+            timeout (float, optional): Deadline in seconds (default: the waiter timeout).
+            on_status (function, optional): Called with each new status.
+
+        Returns:
+            str: Final status of the run.
+
+        Raises:
+            TimeoutError: If the run is still pending at the deadline.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        last_status = None
+        for interval in self.intervals():
+            status = check_status()
+            if on_status and status != last_status:
+                on_status(status)
+            last_status = status
+            if status not in PENDING_STATUSES:
+                return status
+            time.sleep(self.__sleep_time(interval, deadline))
+
+    async def async_poll(self, check_status, timeout=None, on_status=None):
+        """
+        Polls a run until it leaves the pending statuses, without blocking the event loop.
+
+        Args:
+            check_status (function): Coroutine function returning the current run status.
+            timeout (float, optional): Deadline in seconds (default: the waiter timeout).
+            on_status (function, optional): Called with each new status.
+
+        Returns:
+            str: Final status of the run.
+
+        Raises:
+            TimeoutError: If the run is still pending at the deadline.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        last_status = None
+        for interval in self.intervals():
+            status = await check_status()
+            if on_status and status != last_status:
+                on_status(status)
+            last_status = status
+            if status not in PENDING_STATUSES:
+                return status
+            await asyncio.sleep(self.__sleep_time(interval, deadline))
+
+    def follow_stream(self, stream_manager, on_run=None, on_status=None):
+        """
+        Consumes the events of a streamed run until it ends.
+
+        Args:
+            stream_manager: Manager returned by `client.beta.threads.runs.stream`.
+            on_run (function, optional): Called with the run ID as soon as it is known.
+            on_status (function, optional): Called with each new status.
+
+        Returns:
+            str: Final status of the run.
+        """
+        last_status = None
+        with stream_manager as stream:
+            for event in stream:
+                if not event.event.startswith('thread.run.') or event.event.startswith('thread.run.step'):
+                    continue
+                if last_status is None and on_run:
+                    on_run(event.data.id)
+                status = event.data.status
+                if on_status and status != last_status:
+                    on_status(status)
+                last_status = status
+        return last_status
+
+    def submit(self, function, *args, callback=None, **kwargs):
+        """
+        Runs a wait in a background thread.
+
+        Args:
+            function (function): Function to run, usually a bound `poll` or `follow_stream`.
+            *args: Positional arguments of the function.
+            callback (function, optional): Called with the finished future.
+            **kwargs: Keyword arguments of the function.
+
+        Returns:
+            Future: Future resolved with the function result.
+        """
+        if self.__executor is None:
+            with self.__executor_lock:
+                if self.__executor is None:
+                    self.__executor = ThreadPoolExecutor(thread_name_prefix='mygpt-run')
+        future = self.__executor.submit(function, *args, **kwargs)
+        if callback:
+            future.add_done_callback(callback)
+        return future
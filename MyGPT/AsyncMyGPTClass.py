@@ -0,0 +1,652 @@
+import asyncio
+import hashlib
+import functools
+
+from MyGPT import gpt_constants as c
+from MyGPT import auxiliar_functions as af
+from MyGPT import ToolDispatcherClass
+from MyGPT import ToolRegistryClass
+from MyGPT import SingleFlightClass
+from MyGPT import ConversationMemoryClass
+from MyGPT import ConversationStoreClass
+from MyGPT import AssistantRunWaiterClass
+from MyGPT import AssistantRunManagerClass
+from MyGPT import MetricsRecorderClass
+from MyGPT import OutputSinkClass
+from MyGPT import ChatCoreClass
+from MyGPT import ClientPoolClass
+
+class AsyncMyGPT:
+    """
+    Asyncio counterpart of MyGPT, built on OpenAI's asynchronous client.
+
+    Every network call is a coroutine, so a single event loop can serve many
+    conversations at once. Coroutine tools are awaited and regular tools run in
+    a worker thread. The assistant is resolved on the first `call_assistant`,
+    since the constructor cannot await.
+
+    Attributes:
+        model (str): Model ID to use for GPT.
+        max_tokens (int): Maximum number of tokens per request.
+        temperature (float): Sampling temperature for text generation.
+        __conversation: ConversationStore holding the conversation history.
+        __responses (list): List to store GPT responses.
+        __usages (list): List to store internal usage statistics.
+        __client: OpenAI AsyncClient instance.
+        __assistant_name (str): Name of the assistant.
+        __printf: Output sink receiving the streamed tokens.
+        __tools: ToolRegistry of the registered tools, with their schemas prepared once.
+        __tool_dispatcher: Dispatcher that runs the tool calls of a turn concurrently.
+        __memory: ConversationMemory that keeps each request under the token budget.
+        __cache: ResponseCache of completions and tool results, or None.
+        __assistants_cache_path (str): File where resolved assistant IDs are persisted.
+        __code_interpreter_assistent: ID of the code interpreter assistant.
+        __assistant_lock: Lock serializing the resolution of the code interpreter assistant.
+        __assistant_run: Handle of the last assistant run started, used when no run is given.
+        __run_waiter: AssistantRunWaiter used to wait for assistant runs.
+        __run_manager: AssistantRunManager running each assistant call on a thread of its own.
+        __router: ModelRouter picking the model of each request, or None to always use `model`.
+        __semantic_cache: SemanticCache answering questions similar to previous ones, or None.
+        __single_flight: SingleFlight sharing identical completions and image descriptions in flight.
+        __metrics: MetricsRecorder of the spans of model calls, tools, assistant runs and images.
+        __core: ChatCore building the requests and resolving the tool rounds, shared with MyGPT.
+    """
+
+    def __init__(self, assistant_name=None, model='gpt-3.5-turbo-0125', max_tokens=1000, temperature=0, printf=None,
+                 max_tool_workers=4, tool_timeout=None, max_tool_rounds=5, token_budget=None, time_budget=None,
+                 memory=None, cache=None, assistants_cache_path=c.ASSISTANTS_CACHE_PATH,
+                 run_waiter=None, client=None, tool_dispatcher=None, metrics=None, conversation_store=None,
+                 tool_registry=None, run_manager=None, model_router=None,
+                 semantic_cache=None, single_flight=None):
+        """
+        Initializes an instance of the AsyncMyGPT class.
+
+        Args:
+            assistant_name (str, optional): Name of the assistant.
+            model (str, optional): Model ID to use for GPT (default: 'gpt-3.5-turbo-0125').
+            max_tokens (int, optional): Maximum number of tokens per request (default: 1000).
+            temperature (float, optional): Sampling temperature for text generation (default: 0).
+            printf (optional): Output sink receiving the streamed tokens, or a print-like function
+                (default: the default sink of OutputSinkClass).
+            max_tool_workers (int, optional): Maximum number of threads for synchronous tools (default: 4).
+            tool_timeout (float, optional): Default timeout in seconds for each tool (default: None).
+            max_tool_rounds (int, optional): Maximum number of tool rounds per `chat` call (default: 5).
+            token_budget (int, optional): Total tokens after which no more tool rounds are started (default: None).
+            time_budget (float, optional): Seconds after which no more tool rounds are started (default: None).
+            memory (ConversationMemory, optional): Memory that trims the phrases sent in each request
+                (default: sliding window sized per model).
+            cache (ResponseCache, optional): Cache of completions and tool results (default: None).
+            assistants_cache_path (str, optional): File where resolved assistant IDs are persisted,
+                or None to always list the assistants (default: ~/.mygpt/assistants.json).
+            run_waiter (AssistantRunWaiter, optional): Waiter for assistant runs (default: AssistantRunWaiter()).
+            client (optional): OpenAI AsyncClient (default: the client of the default ClientPool for the running
+                event loop, shared by the instances on that loop, with pooled connections and rate-limit scheduling).
+            tool_dispatcher (ToolDispatcher, optional): Dispatcher shared with other instances. When given,
+                `max_tool_workers`, `tool_timeout`, the tool results cache and its metrics are taken from it.
+            metrics (MetricsRecorder, optional): Recorder of the spans of model calls, tools, assistant
+                runs and image descriptions (default: None, records nothing).
+            conversation_store (ConversationStore, optional): Store of the conversation phrases, which may
+                persist and resume the session (default: in-memory store).
+            tool_registry (ToolRegistry, optional): Registry of the tools of this instance, which may send
+                only the tools relevant to each turn (default: ToolRegistry(), sends all tools).
+            run_manager (AssistantRunManager, optional): Manager of the assistant runs and of their threads
+                pool (default: AssistantRunManager() on this client and run waiter, reusing threads).
+            model_router (ModelRouter, optional): Router picking the model of each request from the prompt
+                size, the tools and the past latencies, and escalating or hedging it to a stronger model
+                (default: None, every request goes to `model`).
+            semantic_cache (SemanticCache, optional): Cache returning the answer of a previous similar
+                question instead of calling the model (default: None).
+            single_flight (SingleFlight, optional): Coalescer of identical deterministic completions and
+                image descriptions requested at the same moment (default: the SingleFlight shared by the process).
+        """
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.max_tool_rounds = max_tool_rounds
+        self.token_budget = token_budget
+        self.time_budget = time_budget
+        self.__conversation = conversation_store or ConversationStoreClass.ConversationStore()
+        self.__responses = []
+        self.__usages = []
+        self.__client = client or ClientPoolClass.get_default_pool().get_async_client()
+        self.__assistant_name = assistant_name
+        self.__printf = OutputSinkClass.as_sink(printf)
+        self.__tools = tool_registry or ToolRegistryClass.ToolRegistry()
+        self.__metrics = metrics or MetricsRecorderClass.NullMetrics()
+        self.__tool_dispatcher = tool_dispatcher or ToolDispatcherClass.ToolDispatcher(
+            max_workers=max_tool_workers, timeout=tool_timeout, cache=cache, metrics=metrics)
+        self.__memory = memory or ConversationMemoryClass.ConversationMemory()
+        self.__cache = cache
+        self.__assistants_cache_path = assistants_cache_path
+        self.__code_interpreter_assistent = None
+        self.__assistant_lock = asyncio.Lock()
+        self.__assistant_run = None
+        self.__run_waiter = run_waiter or AssistantRunWaiterClass.AssistantRunWaiter()
+        self.__run_manager = run_manager or AssistantRunManagerClass.AssistantRunManager(self.__client,
+                                                                                        self.__run_waiter)
+        self.__router = model_router
+        self.__semantic_cache = semantic_cache
+        self.__single_flight = single_flight or SingleFlightClass.get_default_single_flight()
+        self.__core = ChatCoreClass.ChatCore(self, self.__conversation, self.__tools, self.__memory, self.__metrics,
+                                             cache=cache, router=model_router, semantic_cache=semantic_cache)
+
+    async def __add_code_interpreter_assistant(self, name, instructions, refresh=False):
+        """
+        Recovers the code interpreter assistant by name, creating it if needed.
+
+        The resolved ID is persisted in the assistant IDs cache file, scoped by API key,
+        so later processes do not list the assistants again.
+
+        Args:
+            name (str): Name of the assistant.
+            instructions (str): Instructions for the assistant.
+            refresh (bool, optional): Whether to ignore the cached ID (default: False).
+        """
+        fingerprint = hashlib.sha256((self.__client.api_key or '').encode('utf-8')).hexdigest()[:16]
+        key = f'{fingerprint}:{name}'
+        assistant_id = None if refresh else af.load_assistant_ids(self.__assistants_cache_path).get(key)
+        if assistant_id:
+            self.__code_interpreter_assistent = assistant_id
+            return
+        await self.__find_or_create_assistant(name, instructions)
+        af.save_assistant_id(self.__assistants_cache_path, key, self.__code_interpreter_assistent)
+
+    async def __find_or_create_assistant(self, name, instructions):
+        """
+        Lists the assistants to find one by name, creating it if needed.
+
+        Args:
+            name (str): Name of the assistant.
+            instructions (str): Instructions for the assistant.
+        """
+        async for assistant in self.__client.beta.assistants.list():
+            if assistant.name == name:
+                self.__code_interpreter_assistent = assistant.id
+                return
+        assistant = await self.__client.beta.assistants.create(
+            name=name,
+            instructions=instructions,
+            tools=[{'type': 'code_interpreter'}],
+            model='gpt-3.5-turbo-0125'
+        )
+        self.__code_interpreter_assistent = assistant.id
+
+    async def __refresh_code_interpreter_assistant(self):
+        """
+        Resolves the code interpreter assistant again, after the cached one was deleted.
+
+        Returns:
+            str: ID of the code interpreter assistant.
+        """
+        async with self.__assistant_lock:
+            await self.__add_code_interpreter_assistant(name=c.CODE_ASSISTANT_NAME,
+                                                        instructions=c.CODE_ASSISTANT_INSTRUCTIONS, refresh=True)
+            return self.__code_interpreter_assistent
+
+    async def call_assistant(self, message_content, assistant_instructions=''):
+        """
+        Calls the assistant with a user message and optional instructions.
+
+        Each call starts a run on a thread of its own, so many runs may be in progress at once.
+
+        Args:
+            message_content (str): Content of the user's message.
+            assistant_instructions (str, optional): Instructions for the assistant.
+
+        Returns:
+            AssistantRun: Handle of the new run, also kept as the current run.
+        """
+        with self.__metrics.span('call_assistant', request_bytes=len(message_content)):
+            async with self.__assistant_lock:
+                if self.__code_interpreter_assistent is None:
+                    await self.__add_code_interpreter_assistant(name=c.CODE_ASSISTANT_NAME,
+                                                                instructions=c.CODE_ASSISTANT_INSTRUCTIONS)
+            run = await self.__run_manager.async_start(self.__code_interpreter_assistent, message_content,
+                                                       assistant_instructions,
+                                                       refresh_assistant=self.__refresh_code_interpreter_assistant)
+            self.__assistant_run = run
+            return run
+
+    async def check_assistant_status(self, run=None):
+        """
+        Checks the status of an assistant run.
+
+        Args:
+            run (AssistantRun, optional): Run to check (default: the current run).
+
+        Returns:
+            str: Status of the assistant run.
+        """
+        return await self.__run_manager.async_check_status(run or self.__assistant_run)
+
+    async def wait_assistant_run(self, timeout=None, on_status=None, run=None):
+        """
+        Waits for an assistant run to finish, polling its status with
+        exponential backoff and jitter.
+
+        Args:
+            timeout (float, optional): Deadline in seconds (default: the run waiter timeout).
+            on_status (function, optional): Called with each new status.
+            run (AssistantRun, optional): Run to wait for (default: the current run).
+
+        Returns:
+            str: Final status of the run.
+
+        Raises:
+            TimeoutError: If the run does not finish before the deadline.
+        """
+        with self.__metrics.span('assistant_run') as span:
+            status = await self.__run_manager.async_wait(run or self.__assistant_run, timeout=timeout,
+                                                         on_status=on_status)
+            span.set(status=status)
+            return status
+
+    async def get_assistant_result(self, run=None):
+        """
+        Retrieves the answer of an assistant run, by run ID.
+
+        Args:
+            run (AssistantRun, optional): Finished run (default: the current run).
+
+        Returns:
+            str: Content of the assistant's response.
+        """
+        return await self.__run_manager.async_get_result(run or self.__assistant_run)
+
+    def get_assistant_run_manager(self):
+        """
+        Returns the AssistantRunManager that starts and tracks the assistant runs.
+
+        Returns:
+            AssistantRunManager: Manager of the assistant runs.
+        """
+        return self.__run_manager
+
+    def get_semantic_cache(self):
+        """
+        Returns the SemanticCache answering questions similar to previous ones.
+
+        Returns:
+            SemanticCache: Semantic cache, or None.
+        """
+        return self.__semantic_cache
+
+    def get_model_router(self):
+        """
+        Returns the ModelRouter that picks the model of each request.
+
+        Returns:
+            ModelRouter: Model router, or None when every request goes to `model`.
+        """
+        return self.__router
+
+    def add_tool(self, name, registration_info):
+        """
+        Adds a new callable tool to the assistant.
+
+        Args:
+            name (str): Name of the tool.
+            registration_info (dict): Registration information for the tool. 'func' may be
+                a coroutine function. An optional 'timeout' key overrides the default tool timeout, and
+                an optional 'keywords' list is used by the tool routing of the registry.
+
+        Raises:
+            ValueError: If the registration schema is not valid.
+        """
+        self.__tools.register(name, registration_info['registration_info'], registration_info['func'],
+                              keywords=registration_info.get('keywords'))
+        if 'timeout' in registration_info:
+            self.__tool_dispatcher.set_timeout(name, registration_info['timeout'])
+
+    def add_tools(self, *functions):
+        """
+        Adds functions decorated with `ToolRegistryClass.tool` as tools.
+
+        Args:
+            *functions: Decorated functions or bound methods.
+        """
+        for function in functions:
+            self.add_tool(function.tool_info['name'], {**function.tool_info, 'func': function})
+
+    def add_phrase(self, content=None, role='user', phrase=None):
+        """
+        Adds a phrase or content to the conversation.
+
+        Args:
+            content (str, optional): Content to add.
+            role (str, optional): Role of the speaker ('user' or 'assistant').
+            phrase (dict, optional): Complete phrase object.
+        """
+        if not content and not phrase:
+            Exception('Need a content or full phrase')
+        new_conversation = phrase or {
+            'role': role,
+            'content': content
+        }
+        self.__conversation.append(new_conversation)
+
+    async def get_image_description(self, content, path, max_tokens=None, temperature=None):
+        """
+        Generates a description of an image using GPT.
+
+        Args:
+            content (str): Text prompt for the image description.
+            path (str): URL of the image.
+            max_tokens (int, optional): Maximum tokens for completion.
+            temperature (float, optional): Sampling temperature.
+
+        Returns:
+            str: Description of the image.
+        """
+        if not path.startswith('data:image') and not path.startswith('http'):
+            return ''
+        params = {
+            'messages': [{
+                    'role': 'user',
+                    'content': [
+                        {'type': 'text', 'text': content},
+                        {'type': 'image_url', 'image_url':
+                        {'url': path}}
+                    ]
+                }],
+            'model': self.__router.vision_model if self.__router else c.VISION_MODEL,
+            'max_tokens': max_tokens or self.max_tokens,
+            'temperature': temperature or self.temperature
+        }
+        with self.__metrics.span('image_description', model=params['model'],
+                                 request_bytes=len(path) + len(content)) as span:
+            response = await self.__share_flight('image_description', params, self.__call_client)
+            self.__core.record_usage(span, response)
+        return response.choices[0].message.content
+
+    def __summarize(self, loop, text):
+        """
+        Summarizes old conversation turns dropped by the memory strategy.
+
+        Called from the worker thread building the request, so the request is sent on
+        the event loop and waited for.
+
+        Args:
+            loop: Event loop of the call.
+            text (str): Rendered conversation turns, optionally with the previous summary.
+
+        Returns:
+            str: Summary of the turns.
+        """
+        request = self.__client.chat.completions.create(**self.__core.summary_params(text))
+        response = asyncio.run_coroutine_threadsafe(request, loop).result()
+        return response.choices[0].message.content
+
+    async def talk_to_gpt(self, model=None, max_tokens=None, temperature=None):
+        """
+        Initiates a conversation with the GPT model.
+
+        Tool calls are resolved iteratively, one model round at a time. Once
+        `max_tool_rounds`, `token_budget` or `time_budget` is reached, the model is
+        asked for a final answer with `tool_choice='none'` instead of more tools.
+
+        Args:
+            model (str, optional): Model ID to use.
+            max_tokens (int, optional): Maximum tokens for completion.
+            temperature (float, optional): Sampling temperature.
+
+        Returns:
+            ChatCompletion: Last GPT response.
+        """
+        with self.__metrics.span('talk_to_gpt', model=model or self.model) as span:
+            response = await self.__drive(self.__core.talk_rounds(model, max_tokens, temperature))
+            span.set(rounds=len(self.__core.round_timings),
+                     total_tokens=sum(timing['total_tokens'] for timing in self.__core.round_timings))
+            return response
+
+    async def __call_client(self, params):
+        return await self.__client.chat.completions.create(**params)
+
+    async def __call_model(self, params):
+        """
+        Requests a chat completion, through the model router when there is one.
+        """
+        if self.__router:
+            return await self.__router.async_request(self.__client.chat.completions.create, params)
+        return await self.__call_client(params)
+
+    async def __share_flight(self, kind, params, call_model):
+        """
+        Requests a completion, or awaits the identical request in flight.
+
+        Args:
+            kind (str): Kind of the request ('chat_completion' or 'image_description').
+            params (dict): Parameters of `chat.completions.create`.
+            call_model (function): Coroutine function requesting the completion from the parameters.
+
+        Returns:
+            ChatCompletion: GPT response.
+        """
+        response, shared = await self.__single_flight.async_do(kind, SingleFlightClass.request_key(params),
+                                                               call_model, params)
+        if shared:
+            self.__metrics.increment('coalesced_requests', kind=kind, model=params['model'])
+        return response
+
+    async def __run_step(self, step, argument):
+        """
+        Performs a step of the rounds of a call, other than streaming.
+
+        Requests are built in a worker thread, as counting their tokens and summarizing
+        old turns would block the event loop.
+
+        Args:
+            step (str): Kind of the step, one of the ChatCoreClass steps.
+            argument: Argument of the step.
+
+        Returns:
+            Result of the step.
+        """
+        if step == ChatCoreClass.BUILD_PARAMS:
+            summarize = functools.partial(self.__summarize, asyncio.get_running_loop())
+            return await asyncio.to_thread(functools.partial(self.__core.build_params, **argument,
+                                                             summarize=summarize))
+        if step == ChatCoreClass.COMPLETION:
+            return await self.__call_model(argument)
+        if step == ChatCoreClass.SHARED_COMPLETION:
+            return await self.__share_flight('chat_completion', argument, self.__call_model)
+        if step == ChatCoreClass.TOOLS:
+            # The notices of the tools go to the sink of this instance
+            with OutputSinkClass.using_sink(self.__printf):
+                return await self.__tool_dispatcher.async_dispatch(argument, self.__tools.get_functions(),
+                                                                   self.__tools.get_validators())
+        if step == ChatCoreClass.LOOKUP:
+            query = await self.__semantic_cache.async_query(**argument)
+            return query, await self.__semantic_cache.async_get(query) if query else None
+        if step == ChatCoreClass.STORE:
+            query, content, tools = argument
+            return await self.__semantic_cache.async_set(query, content, tools=tools)
+        raise ValueError(f'Unknown step: {step}')
+
+    async def __drive(self, steps):
+        """
+        Performs the steps of the rounds of a call until they return.
+
+        Errors of a step are raised inside the rounds, so their spans record them.
+
+        Args:
+            steps (generator): Rounds of the call, from ChatCore.
+
+        Returns:
+            Value returned by the rounds.
+        """
+        send, value = steps.send, None
+        while True:
+            try:
+                step, argument = send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                send, value = steps.send, await self.__run_step(step, argument)
+            except Exception as error:
+                send, value = steps.throw, error
+
+    async def stream_chat(self, model=None, max_tokens=None, temperature=None):
+        """
+        Streams a chat session with GPT, yielding the text tokens as they arrive.
+
+        Streamed tool calls are reassembled, run and the stream is resumed with their
+        results, following the same round and budget limits as `talk_to_gpt`. Streamed
+        responses carry no usage, so tokens are counted locally.
+
+        Args:
+            model (str, optional): Model ID to use.
+            max_tokens (int, optional): Maximum tokens for completion.
+            temperature (float, optional): Sampling temperature.
+
+        Yields:
+            str: Text tokens of the response.
+        """
+        steps = self.__core.stream_rounds(model, max_tokens, temperature)
+        send, value = steps.send, None
+        while True:
+            try:
+                step, argument = send(value)
+            except StopIteration as stop:
+                self.__responses.append(stop.value)
+                return
+            send, value = steps.send, None
+            try:
+                if step == ChatCoreClass.TEXT:
+                    yield argument
+                elif step == ChatCoreClass.STREAM:
+                    async for chunk in await self.__client.chat.completions.create(**argument):
+                        text = self.__core.add_chunk(chunk)
+                        if text:
+                            yield text
+                else:
+                    value = await self.__run_step(step, argument)
+            except Exception as error:
+                send, value = steps.throw, error
+
+    def get_time_to_first_token(self):
+        """
+        Returns the time to the first token of the last streamed call, the latency seen by users.
+
+        Returns:
+            float: Seconds from the call to the first text token, or None if no token was streamed.
+        """
+        return self.__core.time_to_first_token
+
+    def get_metrics(self):
+        """
+        Returns the recorder of the spans of this instance.
+
+        Returns:
+            MetricsRecorder: Metrics recorder, or a NullMetrics if none was given.
+        """
+        return self.__metrics
+
+    def get_round_timings(self):
+        """
+        Returns the timings of each model round of the last `talk_to_gpt` call.
+
+        Each entry holds the round number, the seconds spent waiting for the model
+        ('model_time') and running its tools ('tools_time'), the names of the tools
+        called and the total tokens of the round.
+
+        Returns:
+            list: List of round timings.
+        """
+        return self.__core.round_timings
+
+    async def chat(self, model=None, max_tokens=None, temperature=None):
+        """
+        Runs a chat session using GPT.
+
+        Args:
+            model (str, optional): Model ID to use.
+            max_tokens (int, optional): Maximum tokens for completion.
+            temperature (float, optional): Sampling temperature.
+
+        Returns:
+            str: Content of the GPT response.
+        """
+        response = await self.talk_to_gpt(model=model, max_tokens=max_tokens, temperature=temperature)
+        response_content = response.choices[0].message.content
+        usage = {
+            'completion_tokens': response.usage.completion_tokens,
+            'prompt_tokens': response.usage.prompt_tokens,
+            'total_tokens': response.usage.total_tokens
+        }
+        self.__usages.append(usage)
+        self.__responses.append(response_content)
+        return response_content
+
+    def get_output(self):
+        """
+        Returns the sink receiving the streamed tokens.
+
+        Returns:
+            Output sink.
+        """
+        return self.__printf
+
+    def get_memory(self):
+        """
+        Returns the conversation memory that trims each request.
+
+        Returns:
+            ConversationMemory: Conversation memory.
+        """
+        return self.__memory
+
+    def get_conversation(self):
+        """
+        Returns the conversation history kept in memory.
+
+        Turns paged out by the conversation store are read with its `get_history` method.
+
+        Returns:
+            list: List of conversation objects.
+        """
+        return self.__conversation.get_messages()
+
+    def get_tool_registry(self):
+        """
+        Returns the registry of the tools of this instance.
+
+        Returns:
+            ToolRegistry: Tool registry.
+        """
+        return self.__tools
+
+    def get_conversation_store(self):
+        """
+        Returns the store of the conversation phrases.
+
+        Returns:
+            ConversationStore: Conversation store.
+        """
+        return self.__conversation
+
+    def get_responses(self):
+        """
+        Returns all responses received from GPT.
+
+        Returns:
+            list: List of GPT responses.
+        """
+        return self.__responses
+
+    def get_usage(self):
+        """
+        Returns internal usage statistics.
+
+        Returns:
+            list: List of usage statistics.
+        """
+        return self.__usages
+
+    def reset_chat(self):
+        """
+        Resets the conversation history.
+        """
+        self.__conversation.reset()
+        self.__responses = []
+        self.__memory.reset()
@@ -1,115 +1,82 @@
-import time
 import json
-from termcolor import colored
 
 from MyGPT import auxiliar_functions as af
 from MyGPT import MyGPTClass
+from MyGPT import AsyncMyGPTClass
+from MyGPT import ToolRegistryClass
+from MyGPT import OutputSinkClass
 from MyGPT import gpt_constants as c
 
+# Words that make each tool relevant to a user phrase, used when the tool registry routes tools
+MATH_KEYWORDS = ['matemática', 'calcule', 'calcular', 'cálculo', 'probabilidade', 'equação', 'resolva', 'quanto',
+                 'math']
+IMAGE_KEYWORDS = ['imagem', 'imagens', 'foto', 'figura', 'descreva', 'http', 'png', 'jpg', 'jpeg', 'image']
+
 class Bot:
-    def __init__(self, bot_name='Tião') -> None:
+    def __init__(self, bot_name='Tião', asynchronous=False, output=None, **gpt_options) -> None:
         """
         Initializes an instance of the Bot class.
 
         Args:
             bot_name (str, optional): Name of the bot (default is 'Tião').
+            asynchronous (bool, optional): Whether to use AsyncMyGPT and the `async_*` methods (default is False).
+            output (optional): Sink receiving the answers, notices and streamed tokens of the bot, as a
+                BufferedConsoleSink, LoggingSink or NullSink (default: the default sink, printing to the console).
+            **gpt_options: Additional arguments for MyGPT or AsyncMyGPT, such as a shared `client`.
         """
         self.__bot_name = bot_name
-        self.gpt = MyGPTClass.MyGPT(assistant_name=bot_name, printf=af.print_assistant)
-        
-        self.__available_tools = {
-            'get_stock_price': {
-                'func': af.get_stock_price,
-                'registration_info': {
-                    "type": "function",
-                    "function": {
-                        "name": "get_stock_price",
-                        "description": "Retrieve current brazilian companies stock prices",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "stock_name": {
-                                    "type": "string",
-                                    "description": "Company name",
-                                },
-                                'period': {
-                                    'type': 'string',
-                                    'description': 'Historical period that will be returned with historical data \
-                                                    as "1mo representing a month, "1d representing a day and \
-                                                        "1y" representing a year',
-                                    'enum': ["1d","5d","1mo","6mo","1y","5y","10y","ytd","max"]
-                                }
-                            },
-                            "required": ["stock_name"],
-                        },
-                    },
-                }
-            },
-            'get_math_assistance': {
-                'func': self.call_math_assistent,
-                'registration_info': {
-                    "type": "function",
-                    "function": {
-                        "name": "get_math_assistance",
-                        "description": "Get math assistance for a math problem",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "content": {
-                                    "type": "string",
-                                    "description": "Content informed by user to solve a math problem",
-                                }
-                            },
-                            "required": ["content"],
-                        },
-                    },
-                }
-            },
-            'get_image_description': {
-                'func': self.get_image_description,
-                'registration_info': {
-                    "type": "function",
-                    "function": {
-                        "name": "get_image_description",
-                        "description": "Get a description of an imagem from a url or path",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "content": {
-                                    "type": "string",
-                                    "description": "Content informed by user to be described from image",
-                                },
-                                "path": {
-                                    "type": "string",
-                                    "description": "Path or URL to get image content",
-                                }
-                            },
-                            "required": ["content", "path"],
-                        },
-                    },
-                }
-            },
-            'get_capabilities': {
-                'func': self.get_capabilities,
-                'registration_info': {
-                    "type": "function",
-                    "function": {
-                        "name": "get_capabilities",
-                        "description": "Get a list of current custom capabilities of this bot",
-                        "parameters": {},
-                    },
-                }
-            }
-        }
+        self.__user = None
+        self.__output = OutputSinkClass.as_sink(output)
+        if asynchronous:
+            self.gpt = AsyncMyGPTClass.AsyncMyGPT(assistant_name=bot_name, printf=self.__output, **gpt_options)
+        else:
+            self.gpt = MyGPTClass.MyGPT(assistant_name=bot_name, printf=self.__output, **gpt_options)
+
+        # Schemas are derived once by the @tool decorator, only the methods are bound to this bot
+        self.__available_tools = [
+            af.get_stock_price,
+            af.get_stock_prices,
+            self.async_call_math_assistent if asynchronous else self.call_math_assistent,
+            self.async_get_image_description if asynchronous else self.get_image_description,
+            self.get_capabilities
+        ]
         # Register all available tools with the GPT instance
-        for available_tool_name in self.__available_tools:
-            self.gpt.add_tool(available_tool_name, self.__available_tools[available_tool_name])
-    
+        self.gpt.add_tools(*self.__available_tools)
+
+    def __say(self, text, kind=OutputSinkClass.ASSISTANT):
+        self.__output.emit(kind, f"{self.__bot_name}: {text}", bot=self.__bot_name)
+
+    def __warn(self, text):
+        self.__output.emit(OutputSinkClass.WARN, text, bot=self.__bot_name)
+
+    def __input(self, text):
+        """
+        Reads the user input once the pending output is written.
+        """
+        self.__output.flush()
+        return af.input_user(text)
+
+    def get_output(self):
+        """
+        Returns the sink receiving the output of the bot.
+
+        Returns:
+            Output sink.
+        """
+        return self.__output
+
+    @ToolRegistryClass.tool()
     def get_capabilities(self):
-        af.print_warn(f"Redirecionando para a função")
-        l = [{'name': v['registration_info']['function']['name'], 
-            'description': v['registration_info']['function']['description'],
-            'type': 'tool',}for k,v in self.__available_tools.items()]
+        """
+        Get a list of current custom capabilities of this bot.
+
+        Returns:
+            str: JSON with the tools and assistants available.
+        """
+        self.__warn("Redirecionando para a função")
+        l = [{'name': f.tool_info['registration_info']['function']['name'],
+            'description': f.tool_info['registration_info']['function']['description'],
+            'type': 'tool',}for f in self.__available_tools]
         l.append({
             'name': c.CODE_ASSISTANT_NAME,
             'description': c.CODE_ASSISTANT_INSTRUCTIONS,
@@ -125,11 +92,39 @@ class Bot:
         Args:
             content (str): Content of the user's message.
         """
-        af.print_assistant(f"{self.__bot_name}: Certo {self.__user}! Deixe-me pensar...")
-        self.gpt.add_phrase(content=content)
-        content = self.gpt.chat(asynchronous=False)
-        af.print_assistant(f"{self.__bot_name}: {content}")
+        self.__say(f"Certo {self.__user}! Deixe-me pensar...")
+        content = self.answer(content=content)
+        self.__say(content)
         # self.gpt.print_stream()
+
+    def answer(self, content):
+        """
+        Answers a user message without any console interaction.
+
+        Args:
+            content (str): Content of the user's message.
+
+        Returns:
+            str: Bot answer.
+        """
+        self.gpt.add_phrase(content=content)
+        return self.gpt.chat(asynchronous=False)
+
+    async def async_talk_to_me(self, content):
+        """
+        Initiates a conversation with the bot when it runs on AsyncMyGPT.
+
+        Args:
+            content (str): Content of the user's message.
+
+        Returns:
+            str: Bot answer.
+        """
+        self.__say(f"Certo {self.__user}! Deixe-me pensar...")
+        self.gpt.add_phrase(content=content)
+        content = await self.gpt.chat()
+        self.__say(content)
+        return content
         
     def set_user(self, name):
         """
@@ -155,8 +150,8 @@ class Bot:
                                          assistant_instructions=f"O nome do usuário é {self.__user} e ele é um usuário expert.")             
         else:
             self.talk_to_me(content=message)
-        af.print_assistant(f"{self.__bot_name}: Te ajudo em algo mais {self.__user}?")
-        return af.input_user("> ")
+        self.__say(f"Te ajudo em algo mais {self.__user}?")
+        return self.__input("> ")
     
     def welcome_chat(self):
         """
@@ -165,10 +160,10 @@ class Bot:
         Returns:
             str: User's name.
         """
-        af.print_assistant('Olá, seja bem vindo. A qualquer momento que desejar sair, digite "Finalizei"')
-        af.print_assistant('')
-        af.print_assistant('Para começar, me informe seu nome. ')
-        name=af.input_user('> ')
+        self.__output.emit(OutputSinkClass.ASSISTANT, 'Olá, seja bem vindo. A qualquer momento que desejar sair, digite "Finalizei"')
+        self.__output.emit(OutputSinkClass.ASSISTANT, '')
+        self.__output.emit(OutputSinkClass.ASSISTANT, 'Para começar, me informe seu nome. ')
+        name=self.__input('> ')
         
         self.set_user(name=name)
         return name
@@ -177,19 +172,19 @@ class Bot:
         """
         Starts a chat session with the user.
         """
-        af.print_assistant(f"{self.__bot_name}: Tudo bem, {self.__user}? Em que posso te ajudar?")
-        message=af.input_user("> ")
+        self.__say(f"Tudo bem, {self.__user}? Em que posso te ajudar?")
+        message=self.__input("> ")
         
         while message.lower() not in ['finalizei', 'não', 'fim', 'chega', 'nao']:
             message = self.iterate_with_chat(message=message)
-        af.print_assistant(f"{self.__bot_name}: Ok, até uma próxima vez!")
+        self.__say("Ok, até uma próxima vez!")
     
     def run_chat(self):
         """
         Runs the chat session based on user input.
         """
         if self.welcome_chat() == 'Finalizei':
-            af.print_assistant(f"{self.__bot_name}: Ok, quem sabe uma próxima vez...")
+            self.__say("Ok, quem sabe uma próxima vez...")
         else:
             self.chat()
             
@@ -200,35 +195,52 @@ class Bot:
         Args:
             content (str): Content to be processed by the assistant.
             assistant_instructions (str): Instructions for the assistant.
+
+        Returns:
+            AssistantRun: Handle of the assistant run.
         """
-        self.gpt.call_assistant(message_content=content, assistant_instructions=assistant_instructions)
+        return self.gpt.call_assistant(message_content=content, assistant_instructions=assistant_instructions,
+                                       stream=True)
     
-    def check_assistant_status(self):
+    def __print_status(self, status):
+        self.__say(status, OutputSinkClass.STATUS)
+
+    def check_assistant_status(self, run=None):
+        """
+        Waits for the assistant's operation to finish, printing its status changes.
+
+        Args:
+            run (AssistantRun, optional): Run to wait for (default: the last run started).
         """
-        Checks the status of the assistant's operation.
+        self.gpt.wait_assistant_run(on_status=self.__print_status, run=run)
+
+    async def async_check_assistant_status(self, run=None):
         """
-        status = self.gpt.check_assistant_status()
-        while status in ['queued', 'in_progress', 'cancelling']:
-            af.print_assistant(f"{self.__bot_name}: {status}")
-            time.sleep(1)
-            status = self.gpt.check_assistant_status()
+        Waits for the assistant's operation without blocking the event loop.
+
+        Args:
+            run (AssistantRun, optional): Run to wait for (default: the last run started).
+        """
+        await self.gpt.wait_assistant_run(on_status=self.__print_status, run=run)
         
-    def get_assistant_result(self, print_result=True):
+    def get_assistant_result(self, print_result=True, run=None):
         """
         Retrieves the result from the assistant.
 
         Args:
             print_result (bool, optional): Whether to print the result (default is True).
+            run (AssistantRun, optional): Finished run (default: the last run started).
 
         Returns:
             str: Result from the assistant.
         """
-        result = self.gpt.get_assistant_result()
+        result = self.gpt.get_assistant_result(run=run)
         if print_result:
-            af.print_assistant(f"{self.__bot_name}: {result}")
+            self.__say(result)
         return result
     
-    def call_math_assistent(self, content, **args):
+    @ToolRegistryClass.tool(name='get_math_assistance', keywords=MATH_KEYWORDS)
+    def call_math_assistent(self, content: str, **args):
         """
         Calls the math assistant to help with a math problem.
 
@@ -239,13 +251,32 @@ class Bot:
         Returns:
             str: Result from the math assistant.
         """
-        af.print_warn(f"Redirecionando para o assistente")
+        self.__warn("Redirecionando para o assistente")
         assistant_instructions=f"O nome do usuário é {self.__user} e ele é um usuário expert."
-        self.get_assistant_help(content=content, assistant_instructions=assistant_instructions)
-        self.check_assistant_status()
-        return self.get_assistant_result(print_result=False)
+        run = self.get_assistant_help(content=content, assistant_instructions=assistant_instructions)
+        self.check_assistant_status(run=run)
+        return self.get_assistant_result(print_result=False, run=run)
+
+    @ToolRegistryClass.tool(name='get_math_assistance', keywords=MATH_KEYWORDS)
+    async def async_call_math_assistent(self, content: str, **args):
+        """
+        Calls the math assistant to help with a math problem when the bot runs on AsyncMyGPT.
+
+        Args:
+            content (str): Content of the math problem.
+            **args: Additional arguments.
+
+        Returns:
+            str: Result from the math assistant.
+        """
+        self.__warn("Redirecionando para o assistente")
+        assistant_instructions=f"O nome do usuário é {self.__user} e ele é um usuário expert."
+        run = await self.gpt.call_assistant(message_content=content, assistant_instructions=assistant_instructions)
+        await self.async_check_assistant_status(run=run)
+        return await self.gpt.get_assistant_result(run=run)
     
-    def get_image_description(self, content, path, **args):
+    @ToolRegistryClass.tool(keywords=IMAGE_KEYWORDS)
+    def get_image_description(self, content: str, path: str, **args):
         """
         Gets a description of an image from a URL or path.
 
@@ -257,12 +288,27 @@ class Bot:
         Returns:
             str: Description of the image.
         """
-        af.print_warn(f"Redirecionando para o vision do GPT")
-        if not path.startswith('http'):
-            image_content = af.encode_image(image_path=path)
-            image_file_extension = af.get_file_extension(file_path=path)
-            path = f'data:image/{image_file_extension};base64,{image_content}'
-        return self.gpt.get_image_description(content=content, path=path)
+        self.__warn("Redirecionando para o vision do GPT")
+        # Local images are downscaled and cached by content, descriptions by image and prompt
+        return af.get_image_pipeline().describe(
+            path, content, lambda prompt, url: self.gpt.get_image_description(content=prompt, path=url))
+
+    @ToolRegistryClass.tool(name='get_image_description', keywords=IMAGE_KEYWORDS)
+    async def async_get_image_description(self, content: str, path: str, **args):
+        """
+        Gets a description of an image from a URL or path when the bot runs on AsyncMyGPT.
+
+        Args:
+            content (str): Content related to the image.
+            path (str): URL or path to the image.
+            **args: Additional arguments.
+
+        Returns:
+            str: Description of the image.
+        """
+        self.__warn("Redirecionando para o vision do GPT")
+        return await af.get_image_pipeline().async_describe(
+            path, content, lambda prompt, url: self.gpt.get_image_description(content=prompt, path=url))
        
     def assistant_demonstration(self, content, assistant_instructions):
         """
@@ -272,7 +318,7 @@ class Bot:
             content (str): Content to demonstrate.
             assistant_instructions (str): Instructions for the assistant.
         """
-        af.print_assistant(f"{self.__bot_name}: Ok, vou demonstrar o uso do assistente...")
-        self.get_assistant_help(content=content, assistant_instructions=assistant_instructions)
-        self.check_assistant_status()
-        self.get_assistant_result()
+        self.__say("Ok, vou demonstrar o uso do assistente...")
+        run = self.get_assistant_help(content=content, assistant_instructions=assistant_instructions)
+        self.check_assistant_status(run=run)
+        self.get_assistant_result(run=run)
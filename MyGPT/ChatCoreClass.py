@@ -0,0 +1,363 @@
+import json
+import time
+
+from MyGPT import gpt_constants as c
+from MyGPT import ToolRegistryClass
+from MyGPT import ConversationMemoryClass
+from MyGPT import StreamAccumulatorClass
+
+# Steps yielded by the rounds of a call, performed by the transport of MyGPT or AsyncMyGPT.
+# Each step is a (kind, argument) pair, and the transport sends back its result.
+BUILD_PARAMS = 'build_params'            # keyword arguments of `build_params` -> request parameters
+COMPLETION = 'completion'                # request parameters -> ChatCompletion
+SHARED_COMPLETION = 'shared_completion'  # request parameters -> ChatCompletion, coalesced with the same in flight
+STREAM = 'stream'                        # request parameters -> None, every chunk handed to `add_chunk`
+TEXT = 'text'                            # text given to the consumer of the stream -> None
+TOOLS = 'tools'                          # tool calls -> tool phrases
+LOOKUP = 'lookup'                        # keyword arguments of `SemanticCache.query` -> (SemanticQuery or None, cached answer or None)
+STORE = 'store'                          # (query, content, tools) -> None
+
+class ChatCore:
+    """
+    Request building and tool rounds shared by MyGPT and AsyncMyGPT, without any I/O.
+
+    The rounds of `talk_to_gpt` and `stream_chat` are generators yielding the steps that
+    need I/O (model requests, tool runs, semantic cache lookups) to the class driving
+    them, which performs each step with its own transport and sends the result back.
+    Model routing, memory trimming, round and budget limits, the response cache, the
+    metrics and the round timings are thus the same for both classes.
+
+    Attributes:
+        settings: Instance whose `model`, `max_tokens`, `temperature`, `max_tool_rounds`,
+            `token_budget` and `time_budget` attributes are read on every call.
+        round_timings (list): Timings of each model round of the last call.
+        time_to_first_token (float): Seconds until the first token of the last streamed call.
+        __conversation: ConversationStore holding the conversation history.
+        __tools: ToolRegistry of the registered tools.
+        __memory: ConversationMemory that keeps each request under the token budget.
+        __metrics: MetricsRecorder of the spans of the model calls.
+        __cache: ResponseCache of completions, or None.
+        __router: ModelRouter picking the model of each request, or None.
+        __semantic_cache: SemanticCache answering questions similar to previous ones, or None.
+        __accumulator: StreamAccumulator of the round being streamed.
+        __span: Span of the round being streamed.
+        __started (float): Monotonic time when the streamed call started.
+    """
+
+    def __init__(self, settings, conversation, tools, memory, metrics, cache=None, router=None, semantic_cache=None):
+        """
+        Initializes an instance of the ChatCore class.
+
+        Args:
+            settings: Instance whose model and limit attributes are read on every call.
+            conversation (ConversationStore): Store of the conversation phrases.
+            tools (ToolRegistry): Registry of the tools.
+            memory (ConversationMemory): Memory that trims the phrases sent in each request.
+            metrics (MetricsRecorder): Recorder of the spans of the model calls.
+            cache (ResponseCache, optional): Cache of completions (default: None).
+            router (ModelRouter, optional): Router picking the model of each request (default: None).
+            semantic_cache (SemanticCache, optional): Cache of answers to similar questions (default: None).
+        """
+        self.settings = settings
+        self.round_timings = []
+        self.time_to_first_token = None
+        self.__conversation = conversation
+        self.__tools = tools
+        self.__memory = memory
+        self.__metrics = metrics
+        self.__cache = cache
+        self.__router = router
+        self.__semantic_cache = semantic_cache
+        self.__accumulator = None
+        self.__span = None
+        self.__started = None
+
+    def record_usage(self, span, response):
+        """
+        Adds the tokens and response size of a completion to a span.
+        """
+        if not self.__metrics.enabled:
+            return
+        if response.usage:
+            span.set(prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens)
+        span.set(response_bytes=len(response.choices[0].message.content or ''))
+
+    def summary_params(self, text):
+        """
+        Builds the request summarizing old conversation turns dropped by the memory strategy.
+
+        Args:
+            text (str): Rendered conversation turns, optionally with the previous summary.
+
+        Returns:
+            dict: Parameters of `chat.completions.create`.
+        """
+        return {
+            'messages': [
+                {'role': 'system', 'content': c.SUMMARY_INSTRUCTIONS},
+                {'role': 'user', 'content': text}
+            ],
+            'model': self.settings.model,
+            'max_tokens': getattr(self.__memory.strategy, 'summary_tokens', self.settings.max_tokens),
+            'temperature': 0
+        }
+
+    def build_params(self, model, max_tokens, temperature, exhausted, stream=False, summarize=None):
+        """
+        Builds the parameters of a chat completion request.
+
+        Args:
+            model (str): Model ID to use, or None for the routed model or the instance model.
+            max_tokens (int): Maximum tokens for completion, or None for the instance value.
+            temperature (float): Sampling temperature, or None for the instance value.
+            exhausted (bool): Whether the tool rounds are exhausted, disabling new tool calls.
+            stream (bool, optional): Whether to stream the response (default: False).
+            summarize (function, optional): Summarizer of the turns dropped by the memory strategy.
+
+        Returns:
+            dict: Parameters of `chat.completions.create`.
+        """
+        settings = self.settings
+        conversation = self.__conversation.get_messages()
+        tools = self.__tools.select(ToolRegistryClass.last_user_text(conversation))
+        if model is None and self.__router:
+            model = self.__router.route(ConversationMemoryClass.count_tokens(conversation, settings.model),
+                                        max_tokens=max_tokens or settings.max_tokens, tools=bool(tools.schemas))
+        params = {
+            'messages': self.__memory.build_messages(conversation, model=model or settings.model,
+                                                     max_tokens=max_tokens or settings.max_tokens,
+                                                     tools=tools.encoded if tools.schemas else None,
+                                                     summarize=summarize),
+            'model': model or settings.model,
+            'max_tokens': max_tokens or settings.max_tokens,
+            'temperature': temperature or settings.temperature,
+            'stream': stream
+        }
+        if tools.schemas:
+            params['tools'] = tools.schemas
+            params['tool_choice'] = "none" if exhausted else "auto"
+        return params
+
+    def __tool_rounds_exhausted(self, rounds, used_tokens, started):
+        """
+        Checks whether another tool round can be started in the current call.
+
+        Args:
+            rounds (int): Number of tool rounds already resolved.
+            used_tokens (int): Total tokens used by the model rounds so far.
+            started (float): Monotonic time when the call started.
+
+        Returns:
+            bool: True if the round limit or any budget has been reached.
+        """
+        settings = self.settings
+        if settings.max_tool_rounds is not None and rounds >= settings.max_tool_rounds:
+            return True
+        if settings.token_budget is not None and used_tokens >= settings.token_budget:
+            return True
+        if settings.time_budget is not None and time.monotonic() - started >= settings.time_budget:
+            return True
+        return False
+
+    def __round_params(self, model, max_tokens, temperature, rounds, used_tokens, started, stream=False):
+        """
+        Yields the step building the request of the next round.
+        """
+        exhausted = self.__tool_rounds_exhausted(rounds, used_tokens, started)
+        return (yield BUILD_PARAMS, {'model': model, 'max_tokens': max_tokens, 'temperature': temperature,
+                                     'exhausted': exhausted, 'stream': stream})
+
+    def __lookup_answer(self, model, temperature):
+        """
+        Yields the semantic cache lookup of the last user phrase.
+
+        Args:
+            model (str): Model ID to use, or None for the instance model.
+            temperature (float): Sampling temperature, or None for the instance value.
+
+        Returns:
+            tuple: Lookup key of the question, or None when it cannot be cached, and the cached
+                answer, or None.
+        """
+        if not self.__semantic_cache:
+            return None, None
+        with self.__metrics.span('semantic_cache') as span:
+            query, answer = yield LOOKUP, {'conversation': self.__conversation.get_messages(),
+                                           'model': model or self.settings.model,
+                                           'temperature': temperature or self.settings.temperature,
+                                           'tools': self.__tools.get_names()}
+            span.set(hit=answer is not None)
+        return query, answer
+
+    def __request_completion(self, params):
+        """
+        Yields the request of a chat completion, unless it is cached, inside a span.
+
+        Args:
+            params (dict): Parameters of `chat.completions.create`.
+
+        Returns:
+            ChatCompletion: GPT response.
+        """
+        with self.__metrics.span('chat_completion', model=params['model']) as span:
+            if self.__metrics.enabled:
+                span.set(request_bytes=len(json.dumps(params, default=str)))
+            response = self.__cache.get_completion(params) if self.__cache else None
+            span.set(cached=response is not None)
+            if response is None:
+                shared = not (params.get('stream') or params.get('temperature'))
+                response = yield (SHARED_COMPLETION if shared else COMPLETION), params
+                if self.__cache:
+                    self.__cache.set_completion(params, response)
+            self.record_usage(span, response)
+            return response
+
+    def __run_tools(self, timing, tool_calls):
+        """
+        Yields the run of the tool calls of a round and adds their phrases to the conversation.
+        """
+        tools_started = time.monotonic()
+        tool_phrases = yield TOOLS, tool_calls
+        for phrase in tool_phrases:
+            self.__conversation.append(phrase)
+        timing['tools_time'] = time.monotonic() - tools_started
+
+    def talk_rounds(self, model, max_tokens, temperature):
+        """
+        Resolves the model rounds of `talk_to_gpt`, yielding their I/O steps.
+
+        Tool calls are resolved iteratively, one model round at a time. Once
+        `max_tool_rounds`, `token_budget` or `time_budget` is reached, the model is
+        asked for a final answer with `tool_choice='none'` instead of more tools.
+
+        Args:
+            model (str): Model ID to use, or None.
+            max_tokens (int): Maximum tokens for completion, or None.
+            temperature (float): Sampling temperature, or None.
+
+        Yields:
+            tuple: Steps to perform, as (kind, argument) pairs.
+
+        Returns:
+            ChatCompletion: Last GPT response.
+        """
+        started = time.monotonic()
+        used_tokens = 0
+        rounds = 0
+        self.round_timings = []
+        query, answer = yield from self.__lookup_answer(model, temperature)
+        if answer is not None:
+            # Only sessions configured with a semantic cache load it, along with NumPy
+            from MyGPT import SemanticCacheClass
+            response = SemanticCacheClass.cached_completion(answer, model or self.settings.model)
+            self.__conversation.append(response.choices[0].message.model_dump(exclude_none=True))
+            self.round_timings.append({'round': 0, 'model_time': time.monotonic() - started, 'tools_time': 0.0,
+                                       'tool_calls': [], 'total_tokens': 0})
+            return response
+        used_tools = []
+        while True:
+            round_started = time.monotonic()
+            params = yield from self.__round_params(model, max_tokens, temperature, rounds, used_tokens, started)
+            response = yield from self.__request_completion(params)
+            model_time = time.monotonic() - round_started
+            self.__conversation.append(response.choices[0].message.model_dump(exclude_none=True))
+            if response.usage:
+                used_tokens += response.usage.total_tokens
+            tool_calls = response.choices[0].message.tool_calls
+            timing = {
+                'round': rounds,
+                'model_time': model_time,
+                'tools_time': 0.0,
+                'tool_calls': [tool_call.function.name for tool_call in tool_calls or []],
+                'total_tokens': response.usage.total_tokens if response.usage else 0
+            }
+            self.round_timings.append(timing)
+            if not tool_calls:
+                if query is not None:
+                    yield STORE, (query, response.choices[0].message.content, used_tools)
+                return response
+            used_tools.extend(timing['tool_calls'])
+            yield from self.__run_tools(timing, tool_calls)
+            rounds += 1
+
+    def stream_rounds(self, model, max_tokens, temperature):
+        """
+        Resolves the model rounds of `stream_chat`, yielding their I/O steps.
+
+        Streamed tool calls are reassembled, run and the stream is resumed with their
+        results, following the same round and budget limits as `talk_rounds`. Streamed
+        responses carry no usage, so tokens are counted locally.
+
+        Args:
+            model (str): Model ID to use, or None.
+            max_tokens (int): Maximum tokens for completion, or None.
+            temperature (float): Sampling temperature, or None.
+
+        Yields:
+            tuple: Steps to perform, as (kind, argument) pairs.
+
+        Returns:
+            str: Content of the final answer.
+        """
+        started = self.__started = time.monotonic()
+        used_tokens = 0
+        rounds = 0
+        self.round_timings = []
+        self.time_to_first_token = None
+        query, answer = yield from self.__lookup_answer(model, temperature)
+        if answer is not None:
+            self.time_to_first_token = time.monotonic() - started
+            self.__conversation.append({'role': 'assistant', 'content': answer})
+            self.round_timings.append({'round': 0, 'model_time': self.time_to_first_token, 'tools_time': 0.0,
+                                       'tool_calls': [], 'total_tokens': 0})
+            yield TEXT, answer
+            return answer
+        used_tools = []
+        while True:
+            round_started = time.monotonic()
+            params = yield from self.__round_params(model, max_tokens, temperature, rounds, used_tokens, started,
+                                                    stream=True)
+            self.__accumulator = accumulator = StreamAccumulatorClass.StreamAccumulator()
+            # The span also covers the time the consumer takes between tokens
+            with self.__metrics.span('chat_completion', model=params['model'], stream=True) as span:
+                self.__span = span
+                yield STREAM, params
+                phrase = accumulator.get_phrase()
+                completion_tokens = ConversationMemoryClass.count_message_tokens(phrase, params['model'])
+                span.set(prompt_tokens=self.__memory.get_last_token_count(), completion_tokens=completion_tokens)
+            model_time = time.monotonic() - round_started
+            self.__conversation.append(phrase)
+            round_tokens = self.__memory.get_last_token_count() + completion_tokens
+            used_tokens += round_tokens
+            tool_calls = accumulator.get_tool_calls()
+            timing = {
+                'round': rounds,
+                'model_time': model_time,
+                'tools_time': 0.0,
+                'tool_calls': [tool_call.function.name for tool_call in tool_calls],
+                'total_tokens': round_tokens
+            }
+            self.round_timings.append(timing)
+            if not tool_calls:
+                if query is not None:
+                    yield STORE, (query, accumulator.get_content(), used_tools)
+                return accumulator.get_content()
+            used_tools.extend(timing['tool_calls'])
+            yield from self.__run_tools(timing, tool_calls)
+            rounds += 1
+
+    def add_chunk(self, chunk):
+        """
+        Adds a chunk of the round being streamed, during its STREAM step.
+
+        Args:
+            chunk (ChatCompletionChunk): Chunk received from the stream.
+
+        Returns:
+            str: Text delta of the chunk, or None if it has none.
+        """
+        text = self.__accumulator.add(chunk)
+        if text and self.time_to_first_token is None:
+            self.time_to_first_token = time.monotonic() - self.__started
+            self.__span.set(time_to_first_token=self.time_to_first_token)
+        return text
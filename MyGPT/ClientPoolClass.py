@@ -0,0 +1,533 @@
+import re
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextlib
+import contextvars
+import importlib.util
+
+from MyGPT import config
+from MyGPT import gpt_constants as c
+
+INTERACTIVE = 0
+BATCH = 10
+
+# Key of the model of a request in its httpx extensions, read back by the response hook
+REQUEST_MODEL = 'mygpt_model'
+
+_priority = contextvars.ContextVar('mygpt_request_priority', default=INTERACTIVE)
+
+def parse_reset(value):
+    """
+    Parses the reset durations of the rate-limit headers, as '1s', '6m0s' or '20ms'.
+
+    Args:
+        value (str): Header value.
+
+    Returns:
+        float: Seconds, or None if the value cannot be parsed.
+    """
+    if not value:
+        return None
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    parts = re.findall(r'([\d.]+)(ms|h|m|s)', value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def estimate_request(content):
+    """
+    Reads the model of a request and estimates the tokens it consumes from the
+    tokens-per-minute limit of that model.
+
+    The limit counts the prompt and the `max_tokens` of the completion. The prompt is
+    estimated at four bytes of the request body per token, except for the images, which
+    count `VISION_IMAGE_TOKENS` each whatever the size of their data URL.
+
+    Args:
+        content (bytes): Body of the request.
+
+    Returns:
+        tuple: Model of the request, or None, and its estimated tokens.
+    """
+    if not content:
+        return None, 0
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return None, len(content) // 4
+    if not isinstance(body, dict):
+        return None, len(content) // 4
+    size, images = len(content), 0
+    for message in body.get('messages') or []:
+        parts = message.get('content') if isinstance(message, dict) else None
+        for part in parts if isinstance(parts, list) else []:
+            if isinstance(part, dict) and part.get('type') == 'image_url':
+                size -= len(str((part.get('image_url') or {}).get('url', '')))
+                images += 1
+    return body.get('model'), size // 4 + images * c.VISION_IMAGE_TOKENS + (body.get('max_tokens') or 0)
+
+class TokenBucket:
+    """
+    Bucket refilled continuously up to its capacity, for a per-minute limit.
+
+    Attributes:
+        capacity (float): Maximum level, the per-minute limit (None is unlimited).
+        level (float): Current level.
+        blocked_until (float): Monotonic time before which nothing is taken, after a 429.
+    """
+    __slots__ = ('capacity', 'level', 'updated', 'blocked_until')
+
+    def __init__(self, per_minute=None):
+        self.capacity = per_minute
+        self.level = per_minute or 0
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """
+        Returns the seconds until `amount` can be taken.
+        """
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if not self.capacity:
+            return 0
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def update(self, limit, remaining, reset, now):
+        """
+        Aligns the bucket with the limit and remaining values reported by the API,
+        which replace the local estimates.
+        """
+        self.refill(now)
+        if limit:
+            self.capacity = limit
+        if remaining is not None:
+            self.level = remaining
+            if remaining <= 0 and reset:
+                self.blocked_until = max(self.blocked_until, now + reset)
+
+class RateLimiter:
+    """
+    Schedules requests under the requests-per-minute and tokens-per-minute limits.
+
+    The limits are per model, so each model has two token buckets of its own, updated
+    with the `x-ratelimit-*` headers of its responses, so all clients sharing the
+    limiter slow down together before the API starts answering 429. Requests without a
+    model, as the Assistants API ones, share the buckets of the None model. Waiting
+    requests are served per model by priority, then in order of arrival, so interactive
+    chats go ahead of batch jobs.
+
+    Attributes:
+        requests_per_minute (int): Initial requests limit of each model, until known from the headers.
+        tokens_per_minute (int): Initial tokens limit of each model, until known from the headers.
+        __buckets (dict): Requests and tokens TokenBuckets of each model.
+        __waiters (dict): Heap of (priority, ticket) of the waiting requests of each model.
+        __async_wakers (dict): Event loop and event waking each waiting coroutine, by waiter.
+        __condition: Condition protecting the buckets and waiters.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Initializes an instance of the RateLimiter class.
+
+        Args:
+            requests_per_minute (int, optional): Initial requests limit of each model, until known from
+                the headers (default: None).
+            tokens_per_minute (int, optional): Initial tokens limit of each model, until known from
+                the headers (default: None).
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.__buckets = {}
+        self.__waiters = {}
+        self.__async_wakers = {}
+        self.__tickets = itertools.count()
+        self.__condition = threading.Condition()
+
+    def __notify_all(self):
+        """
+        Wakes the waiting threads and coroutines. Called with the condition held.
+        """
+        self.__condition.notify_all()
+        for loop, event in self.__async_wakers.values():
+            loop.call_soon_threadsafe(event.set)
+
+    def __get_buckets(self, model):
+        """
+        Returns the requests and tokens buckets of a model, created on first use. Called with the condition held.
+        """
+        buckets = self.__buckets.get(model)
+        if buckets is None:
+            buckets = self.__buckets[model] = (TokenBucket(self.requests_per_minute),
+                                               TokenBucket(self.tokens_per_minute))
+        return buckets
+
+    def __enqueue(self, priority, model):
+        waiter = (priority, next(self.__tickets))
+        with self.__condition:
+            heapq.heappush(self.__waiters.setdefault(model, []), waiter)
+        return waiter
+
+    def __dequeue(self, waiter, model):
+        with self.__condition:
+            waiters = self.__waiters[model]
+            waiters.remove(waiter)
+            if waiters:
+                heapq.heapify(waiters)
+            else:
+                del self.__waiters[model]
+            self.__notify_all()
+
+    def __try_take(self, waiter, model, tokens):
+        """
+        Takes the capacity of a request if it is the first in the line of its model and fits in its buckets.
+
+        Returns:
+            float: 0 if taken, otherwise the seconds to wait (None waits for the first in line).
+        """
+        if self.__waiters[model][0] != waiter:
+            return None
+        requests, tokens_bucket = self.__get_buckets(model)
+        now = time.monotonic()
+        requests.refill(now)
+        tokens_bucket.refill(now)
+        wait = max(requests.wait_time(1, now), tokens_bucket.wait_time(tokens, now))
+        if wait <= 0:
+            requests.take(1)
+            tokens_bucket.take(tokens)
+            return 0
+        return wait
+
+    def acquire(self, tokens=0, priority=None, model=None):
+        """
+        Waits until a request fits in the limits of its model and takes its capacity.
+
+        Args:
+            tokens (int, optional): Estimated tokens of the request (default: 0).
+            priority (int, optional): Priority of the request, lower first (default: the current priority).
+            model (str, optional): Model of the request (default: None, requests without a model).
+        """
+        waiter = self.__enqueue(get_priority() if priority is None else priority, model)
+        try:
+            with self.__condition:
+                while True:
+                    wait = self.__try_take(waiter, model, tokens)
+                    if wait == 0:
+                        return
+                    self.__condition.wait(timeout=wait)
+        finally:
+            self.__dequeue(waiter, model)
+
+    async def async_acquire(self, tokens=0, priority=None, model=None):
+        """
+        Waits until a request fits in the limits of its model without blocking the event loop.
+
+        The coroutine sleeps until the buckets refill enough for the request, or until the
+        requests ahead of it leave the line or new headers change the limits.
+
+        Args:
+            tokens (int, optional): Estimated tokens of the request (default: 0).
+            priority (int, optional): Priority of the request, lower first (default: the current priority).
+            model (str, optional): Model of the request (default: None, requests without a model).
+        """
+        event = asyncio.Event()
+        waiter = self.__enqueue(get_priority() if priority is None else priority, model)
+        with self.__condition:
+            self.__async_wakers[waiter] = (asyncio.get_running_loop(), event)
+        try:
+            while True:
+                with self.__condition:
+                    wait = self.__try_take(waiter, model, tokens)
+                    if wait == 0:
+                        return
+                    event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.__condition:
+                del self.__async_wakers[waiter]
+            self.__dequeue(waiter, model)
+
+    def update(self, headers, status_code=200, model=None):
+        """
+        Updates the buckets of a model with the rate-limit headers of its response.
+
+        Args:
+            headers: Response headers.
+            status_code (int, optional): Status of the response. A 429 blocks all requests
+                to the model until its 'retry-after' (default: 200).
+            model (str, optional): Model of the request (default: None, requests without a model).
+        """
+        def number(name):
+            try:
+                return float(headers[name]) if headers.get(name) is not None else None
+            except ValueError:
+                return None
+
+        now = time.monotonic()
+        with self.__condition:
+            requests, tokens = self.__get_buckets(model)
+            requests.update(number('x-ratelimit-limit-requests'), number('x-ratelimit-remaining-requests'),
+                            parse_reset(headers.get('x-ratelimit-reset-requests')), now)
+            tokens.update(number('x-ratelimit-limit-tokens'), number('x-ratelimit-remaining-tokens'),
+                          parse_reset(headers.get('x-ratelimit-reset-tokens')), now)
+            if status_code == 429:
+                retry_after = number('retry-after-ms')
+                retry_after = retry_after / 1000 if retry_after is not None else parse_reset(headers.get('retry-after'))
+                requests.blocked_until = max(requests.blocked_until, now + (retry_after or 1.0))
+            self.__notify_all()
+
+    def get_state(self, model=None):
+        """
+        Returns the current limits and levels of a model.
+
+        Args:
+            model (str, optional): Model (default: None, requests without a model).
+
+        Returns:
+            dict: Capacity and level of the requests and tokens buckets, and the number of waiting requests.
+        """
+        with self.__condition:
+            requests, tokens = self.__get_buckets(model)
+            now = time.monotonic()
+            requests.refill(now)
+            tokens.refill(now)
+            return {'requests_limit': requests.capacity, 'requests_available': requests.level,
+                    'tokens_limit': tokens.capacity, 'tokens_available': tokens.level,
+                    'waiting': len(self.__waiters.get(model, ()))}
+
+    def get_models(self):
+        """
+        Returns the models seen by the limiter.
+
+        Returns:
+            list: Models with buckets, None standing for the requests without a model.
+        """
+        with self.__condition:
+            return list(self.__buckets)
+
+def get_priority():
+    """
+    Returns the priority of the requests made in the current thread or task.
+
+    Returns:
+        int: Priority, INTERACTIVE unless changed with `priority`.
+    """
+    return _priority.get()
+
+@contextlib.contextmanager
+def priority(value):
+    """
+    Sets the priority of the requests made inside the block, in the current thread or task.
+
+    Args:
+        value (int): Priority, as INTERACTIVE or BATCH.
+    """
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class ClientPool:
+    """
+    OpenAI clients sharing one HTTP connection pool and one rate limiter.
+
+    Connections are kept alive and reused by all the bots of a process, over HTTP/2
+    when the `h2` package is installed. Every request first takes its place in the
+    rate limiter, which is kept in sync with the rate-limit headers of the responses.
+
+    Attributes:
+        max_connections (int): Maximum number of open connections.
+        max_keepalive_connections (int): Maximum number of idle connections kept alive.
+        keepalive_expiry (float): Seconds an idle connection is kept alive.
+        http2 (bool): Whether HTTP/2 is used.
+        max_retries (int): Retries of the OpenAI clients, which honor the 'retry-after' headers.
+        timeout (float): Timeout in seconds of the requests.
+        rate_limiter (RateLimiter): Limiter shared by the clients.
+        __client: Synchronous OpenAI client, created on first use.
+        __async_clients (dict): Asynchronous OpenAI client of each event loop, created on first use.
+            An asynchronous client is bound to the loop it is used on, so each running loop gets
+            its own, and clients created outside a loop are kept under None.
+        __lock: Lock protecting the creation of the clients.
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0, http2=None,
+                 max_retries=5, timeout=60.0, rate_limiter=None):
+        """
+        Initializes an instance of the ClientPool class.
+
+        Args:
+            max_connections (int, optional): Maximum number of open connections (default: 100).
+            max_keepalive_connections (int, optional): Maximum number of idle connections kept (default: 20).
+            keepalive_expiry (float, optional): Seconds an idle connection is kept alive (default: 30.0).
+            http2 (bool, optional): Whether to use HTTP/2 (default: when the `h2` package is installed).
+            max_retries (int, optional): Retries of the OpenAI clients (default: 5).
+            timeout (float, optional): Timeout in seconds of the requests (default: 60.0).
+            rate_limiter (RateLimiter, optional): Limiter shared by the clients (default: RateLimiter()).
+        """
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = importlib.util.find_spec('h2') is not None if http2 is None else http2
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.__client = None
+        self.__async_clients = {}
+        self.__lock = threading.Lock()
+
+    def __http_options(self):
+        import httpx
+
+        return {
+            'limits': httpx.Limits(max_connections=self.max_connections,
+                                   max_keepalive_connections=self.max_keepalive_connections,
+                                   keepalive_expiry=self.keepalive_expiry),
+            'http2': self.http2,
+            'timeout': self.timeout
+        }
+
+    def __estimate_request(self, request):
+        """
+        Reads the model and the estimated tokens of a request, keeping the model in its
+        extensions for the response hook.
+        """
+        try:
+            model, tokens = estimate_request(request.content)
+        except Exception:
+            # Streamed bodies, as file uploads, cannot be read here
+            model, tokens = None, 0
+        request.extensions[REQUEST_MODEL] = model
+        return model, tokens
+
+    def __on_request(self, request):
+        model, tokens = self.__estimate_request(request)
+        self.rate_limiter.acquire(tokens=tokens, model=model)
+
+    def __on_response(self, response):
+        self.rate_limiter.update(response.headers, response.status_code,
+                                 model=response.request.extensions.get(REQUEST_MODEL))
+
+    async def __async_on_request(self, request):
+        model, tokens = self.__estimate_request(request)
+        await self.rate_limiter.async_acquire(tokens=tokens, model=model)
+
+    async def __async_on_response(self, response):
+        self.rate_limiter.update(response.headers, response.status_code,
+                                 model=response.request.extensions.get(REQUEST_MODEL))
+
+    def get_client(self):
+        """
+        Returns the shared synchronous OpenAI client.
+
+        Returns:
+            openai.Client: Client using the pooled connections and the rate limiter.
+        """
+        import openai
+
+        config.ensure_config()
+        with self.__lock:
+            if self.__client is None:
+                http_client = openai.DefaultHttpxClient(
+                    event_hooks={'request': [self.__on_request], 'response': [self.__on_response]},
+                    **self.__http_options())
+                self.__client = openai.Client(http_client=http_client, max_retries=self.max_retries)
+            return self.__client
+
+    def get_async_client(self):
+        """
+        Returns the asynchronous OpenAI client shared inside the running event loop.
+
+        Every loop gets a client of its own, since an asynchronous client is bound to the
+        loop it is used on; all of them share the rate limiter. Clients of closed loops
+        are dropped.
+
+        Returns:
+            openai.AsyncClient: Client using the pooled connections and the rate limiter.
+        """
+        import openai
+
+        config.ensure_config()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        with self.__lock:
+            for closed in [key for key in self.__async_clients if key is not None and key.is_closed()]:
+                del self.__async_clients[closed]
+            client = self.__async_clients.get(loop)
+            if client is None:
+                http_client = openai.DefaultAsyncHttpxClient(
+                    event_hooks={'request': [self.__async_on_request], 'response': [self.__async_on_response]},
+                    **self.__http_options())
+                client = self.__async_clients[loop] = openai.AsyncClient(http_client=http_client,
+                                                                         max_retries=self.max_retries)
+            return client
+
+    def close(self):
+        """
+        Closes the synchronous client. The asynchronous one must be closed with `async_close`.
+        """
+        with self.__lock:
+            client, self.__client = self.__client, None
+        if client is not None:
+            client.close()
+
+    async def async_close(self):
+        """
+        Closes the asynchronous client of the running event loop, and the one created outside a loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            clients = [self.__async_clients.pop(key) for key in (loop, None) if key in self.__async_clients]
+        for client in clients:
+            await client.close()
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def get_default_pool():
+    """
+    Returns the pool shared by the instances created without a client.
+
+    Returns:
+        ClientPool: Default client pool, created on first use.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ClientPool()
+        return _default_pool
+
+def set_default_pool(pool):
+    """
+    Replaces the pool shared by the instances created without a client.
+
+    Args:
+        pool (ClientPool): New default pool.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        _default_pool = pool
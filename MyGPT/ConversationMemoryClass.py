@@ -0,0 +1,404 @@
+import json
+from functools import lru_cache
+
+from MyGPT import gpt_constants as c
+
+
+def get_context_window(model):
+    """
+    Returns the context window size of a model, matching the longest known prefix.
+
+    Args:
+        model (str): Model ID.
+
+    Returns:
+        int: Number of tokens of the model context window.
+    """
+    matches = [name for name in c.MODEL_CONTEXT_WINDOWS if model.startswith(name)]
+    if not matches:
+        return c.DEFAULT_CONTEXT_WINDOW
+    return c.MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+
+@lru_cache(maxsize=None)
+def _load_tiktoken():
+    """
+    Imports tiktoken on the first count, returning None when it is not installed.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    tiktoken = _load_tiktoken()
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+@lru_cache(maxsize=8192)
+def count_text_tokens(text, model='gpt-3.5-turbo-0125'):
+    """
+    Counts the tokens of a text locally.
+
+    Uses tiktoken when it is installed, otherwise estimates four characters per token.
+
+    Args:
+        text (str): Text to count.
+        model (str, optional): Model ID used to pick the encoding.
+
+    Returns:
+        int: Number of tokens.
+    """
+    if not text:
+        return 0
+    if _load_tiktoken() is None:
+        return len(text) // 4 + 1
+    return len(_get_encoding(model).encode(text))
+
+def count_message_tokens(message, model='gpt-3.5-turbo-0125'):
+    """
+    Counts the tokens of a single conversation phrase, including its overhead.
+
+    Args:
+        message (dict): Conversation phrase.
+        model (str, optional): Model ID used to pick the encoding.
+
+    Returns:
+        int: Number of tokens.
+    """
+    tokens = 3
+    content = message.get('content')
+    if isinstance(content, str):
+        tokens += count_text_tokens(content, model)
+    elif isinstance(content, list):
+        for part in content:
+            if part.get('type') == 'text':
+                tokens += count_text_tokens(part['text'], model)
+            else:
+                tokens += c.IMAGE_PART_TOKENS
+    if message.get('name'):
+        tokens += 1 + count_text_tokens(message['name'], model)
+    for tool_call in message.get('tool_calls') or []:
+        function = tool_call['function']
+        tokens += 3 + count_text_tokens(function['name'], model) + count_text_tokens(function['arguments'], model)
+    return tokens
+
+def count_tokens(messages, model='gpt-3.5-turbo-0125'):
+    """
+    Counts the prompt tokens of a list of conversation phrases.
+
+    Args:
+        messages (list): Conversation phrases.
+        model (str, optional): Model ID used to pick the encoding.
+
+    Returns:
+        int: Number of tokens.
+    """
+    return 3 + sum(count_message_tokens(message, model) for message in messages)
+
+def group_units(messages):
+    """
+    Groups conversation phrases into units that can only be kept or dropped together.
+
+    An assistant phrase with `tool_calls` and the tool phrases answering it form a
+    single unit, so trimming never breaks the `tool_call_id` pairing.
+
+    Args:
+        messages (list): Conversation phrases.
+
+    Returns:
+        list: List of units, each one a list of phrases.
+    """
+    units = []
+    for message in messages:
+        if message.get('role') == 'tool' and units and units[-1][0].get('tool_calls'):
+            units[-1].append(message)
+        else:
+            units.append([message])
+    return units
+
+def render_units(units):
+    """
+    Renders units as plain text, one phrase per line, to be summarized.
+
+    Args:
+        units (list): List of units.
+
+    Returns:
+        str: Text of the units.
+    """
+    lines = []
+    for unit in units:
+        for message in unit:
+            content = message.get('content')
+            if isinstance(content, list):
+                content = ' '.join(part['text'] for part in content if part.get('type') == 'text')
+            if message.get('tool_calls'):
+                calls = ', '.join(f"{t['function']['name']}({t['function']['arguments']})" for t in message['tool_calls'])
+                content = f"{content or ''} [tools: {calls}]"
+            lines.append(f"{message.get('name') or message.get('role')}: {content}")
+    return '\n'.join(lines)
+
+class SlidingWindowStrategy:
+    """
+    Keeps the most recent units that fit in the token budget.
+
+    Units holding a phrase with one of the pinned roles and the current turn (from the
+    last user phrase on) are always kept. By default the system phrases and the tool
+    call units (the assistant phrase with `tool_calls` and its tool results) are pinned.
+
+    Attributes:
+        pinned_roles (tuple): Roles whose units are never dropped.
+    """
+
+    def __init__(self, pinned_roles=('system', 'tool')):
+        """
+        Initializes an instance of the SlidingWindowStrategy class.
+
+        Args:
+            pinned_roles (tuple, optional): Roles whose units are never dropped (default: ('system', 'tool')).
+        """
+        self.pinned_roles = tuple(pinned_roles)
+
+    def is_pinned(self, unit):
+        """
+        Checks whether a unit holds a phrase with a pinned role.
+
+        Args:
+            unit (list): Unit of phrases.
+
+        Returns:
+            bool: True if the unit must be kept.
+        """
+        return any(message.get('role') in self.pinned_roles for message in unit)
+
+    def split(self, units):
+        """
+        Returns the index of the first unit of the current turn.
+
+        Args:
+            units (list): List of units.
+
+        Returns:
+            int: Index of the last unit started by a user phrase.
+        """
+        for index in range(len(units) - 1, -1, -1):
+            if units[index][0].get('role') == 'user':
+                return index
+        return len(units)
+
+    def select(self, units, units_tokens, budget):
+        """
+        Chooses the indexes of the units to keep.
+
+        Args:
+            units (list): List of units.
+            units_tokens (list): Tokens of each unit.
+            budget (int): Token budget.
+
+        Returns:
+            set: Indexes of the kept units.
+        """
+        turn = self.split(units)
+        kept = {index for index, unit in enumerate(units) if index >= turn or self.is_pinned(unit)}
+        remaining = budget - sum(units_tokens[index] for index in kept)
+        for index in range(turn - 1, -1, -1):
+            if index in kept:
+                continue
+            if units_tokens[index] > remaining:
+                break
+            kept.add(index)
+            remaining -= units_tokens[index]
+        return kept
+
+    def reset(self):
+        """
+        Clears any state kept between requests. The sliding window keeps none.
+        """
+        pass
+
+    def fit(self, units, units_tokens, budget, summarize=None):
+        """
+        Trims the units to the token budget.
+
+        Args:
+            units (list): List of units.
+            units_tokens (list): Tokens of each unit.
+            budget (int): Token budget.
+            summarize (function, optional): Unused by this strategy.
+
+        Returns:
+            list: Phrases to send.
+        """
+        kept = self.select(units, units_tokens, budget)
+        return [message for index, unit in enumerate(units) if index in kept for message in unit]
+
+class SummarizationStrategy(SlidingWindowStrategy):
+    """
+    Replaces the units that do not fit in the token budget with a rolling summary.
+
+    The summary is updated incrementally: only units dropped since the last summary are
+    sent to the summarizer, together with the previous summary. Without a summarizer it
+    behaves as a sliding window.
+
+    Attributes:
+        pinned_roles (tuple): Roles whose units are never dropped.
+        summary_tokens (int): Tokens reserved for the summary phrase.
+        __summarize: Function receiving a text and returning its summary.
+        __summary (str): Current summary.
+        __summarized (int): Number of droppable units already covered by the summary.
+    """
+
+    def __init__(self, summarize=None, pinned_roles=('system', 'tool'), summary_tokens=300):
+        """
+        Initializes an instance of the SummarizationStrategy class.
+
+        Args:
+            summarize (function, optional): Function receiving a text and returning its
+                summary. When missing, the summarizer provided by MyGPT is used.
+            pinned_roles (tuple, optional): Roles whose units are never dropped (default: ('system', 'tool')).
+            summary_tokens (int, optional): Tokens reserved for the summary phrase (default: 300).
+        """
+        super().__init__(pinned_roles=pinned_roles)
+        self.summary_tokens = summary_tokens
+        self.__summarize = summarize
+        self.__summary = None
+        self.__summarized = 0
+
+    def get_summary(self):
+        """
+        Returns the current summary.
+
+        Returns:
+            str: Summary of the dropped units or None.
+        """
+        return self.__summary
+
+    def reset(self):
+        """
+        Clears the current summary.
+        """
+        self.__summary = None
+        self.__summarized = 0
+
+    def fit(self, units, units_tokens, budget, summarize=None):
+        """
+        Trims the units to the token budget, summarizing the dropped ones.
+
+        Args:
+            units (list): List of units.
+            units_tokens (list): Tokens of each unit.
+            budget (int): Token budget.
+            summarize (function, optional): Summarizer used when none was given to the strategy.
+
+        Returns:
+            list: Phrases to send.
+        """
+        summarize = self.__summarize or summarize
+        if summarize is None:
+            return super().fit(units, units_tokens, budget)
+        kept = self.select(units, units_tokens, budget - self.summary_tokens)
+        dropped = [index for index in range(len(units)) if index not in kept]
+        if len(dropped) < self.__summarized:
+            self.reset()
+        if len(dropped) > self.__summarized:
+            text = render_units([units[index] for index in dropped[self.__summarized:]])
+            if self.__summary:
+                text = f"{c.SUMMARY_PREFIX}{self.__summary}\n{text}"
+            self.__summary = summarize(text)
+            self.__summarized = len(dropped)
+        messages = []
+        for index, unit in enumerate(units):
+            if index in kept:
+                messages.extend(unit)
+            elif self.__summary and index == dropped[0]:
+                messages.append({'role': 'system', 'content': f"{c.SUMMARY_PREFIX}{self.__summary}"})
+        return messages
+
+class ConversationMemory:
+    """
+    Keeps the phrases sent to GPT under a token budget.
+
+    The full conversation stays in MyGPT; the memory only chooses what is sent in each
+    request, delegating the trimming to a strategy.
+
+    Attributes:
+        strategy: Strategy used to trim the conversation (SlidingWindowStrategy by default).
+        token_budget (int): Prompt token budget. When None, the model context window minus
+            the completion tokens is used.
+        __last_token_count (int): Prompt tokens of the last built request.
+    """
+
+    def __init__(self, strategy=None, token_budget=None):
+        """
+        Initializes an instance of the ConversationMemory class.
+
+        Args:
+            strategy (optional): Trimming strategy (default: SlidingWindowStrategy()).
+            token_budget (int, optional): Prompt token budget (default: sized per model).
+        """
+        self.strategy = strategy or SlidingWindowStrategy()
+        self.token_budget = token_budget
+        self.__last_token_count = 0
+
+    def get_token_budget(self, model, max_tokens=0, tools=None):
+        """
+        Returns the tokens available for the conversation phrases.
+
+        Args:
+            model (str): Model ID.
+            max_tokens (int, optional): Tokens reserved for the completion.
+            tools (list or str, optional): Tool schemas sent with the request, or their JSON encoding.
+
+        Returns:
+            int: Token budget.
+        """
+        budget = self.token_budget or get_context_window(model) - (max_tokens or 0)
+        if tools:
+            encoded = tools if isinstance(tools, str) else json.dumps(tools, ensure_ascii=False)
+            budget -= count_text_tokens(encoded, model)
+        return budget
+
+    def build_messages(self, conversation, model, max_tokens=0, tools=None, summarize=None):
+        """
+        Returns the phrases to send, trimmed to the token budget.
+
+        Args:
+            conversation (list): Full conversation.
+            model (str): Model ID.
+            max_tokens (int, optional): Tokens reserved for the completion.
+            tools (list or str, optional): Tool schemas sent with the request, or their JSON encoding.
+            summarize (function, optional): Summarizer offered to the strategy.
+
+        Returns:
+            list: Phrases to send. The conversation itself is returned when it fits.
+        """
+        budget = self.get_token_budget(model, max_tokens=max_tokens, tools=tools)
+        units = group_units(conversation)
+        units_tokens = [sum(count_message_tokens(message, model) for message in unit) for unit in units]
+        total = 3 + sum(units_tokens)
+        if total <= budget:
+            self.__last_token_count = total
+            return conversation
+        messages = self.strategy.fit(units, units_tokens, budget - 3, summarize=summarize)
+        self.__last_token_count = count_tokens(messages, model)
+        return messages
+
+    def reset(self):
+        """
+        Clears the state kept by the strategy, for a new conversation.
+        """
+        self.strategy.reset()
+        self.__last_token_count = 0
+
+    def get_last_token_count(self):
+        """
+        Returns the prompt tokens of the last built request, counted locally.
+
+        Returns:
+            int: Number of tokens.
+        """
+        return self.__last_token_count
@@ -0,0 +1,475 @@
+import os
+import sys
+import json
+import uuid
+import sqlite3
+import threading
+from collections import deque
+
+from MyGPT import gpt_constants as c
+
+PHRASE_KEYS = ('role', 'content', 'name', 'tool_calls', 'tool_call_id')
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class MessageRecord:
+    """
+    Compact record of a conversation phrase.
+
+    Roles, names and tool names repeat in every turn, so they are interned and shared
+    by all records. Tool calls are kept as tuples instead of nested dicts.
+
+    Attributes:
+        role (str): Role of the speaker.
+        content: Text of the phrase, a list of content parts, or None.
+        name (str): Name of the speaker or tool, or None.
+        tool_calls (tuple): (id, type, name, arguments) tuples of the requested tools, or None.
+        tool_call_id (str): ID of the tool call answered by a tool phrase, or None.
+        extra (dict): Any other key of the phrase, or None.
+    """
+
+    __slots__ = ('role', 'content', 'name', 'tool_calls', 'tool_call_id', 'extra')
+
+    def __init__(self, role, content=None, name=None, tool_calls=None, tool_call_id=None, extra=None):
+        """
+        Initializes an instance of the MessageRecord class.
+
+        Args:
+            role (str): Role of the speaker.
+            content (optional): Text of the phrase or a list of content parts.
+            name (str, optional): Name of the speaker or tool.
+            tool_calls (tuple, optional): (id, type, name, arguments) tuples of the requested tools.
+            tool_call_id (str, optional): ID of the tool call answered by a tool phrase.
+            extra (dict, optional): Any other key of the phrase.
+        """
+        self.role = _intern(role)
+        self.content = content
+        self.name = _intern(name)
+        self.tool_calls = tool_calls
+        self.tool_call_id = tool_call_id
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, phrase):
+        """
+        Builds a record from a conversation phrase.
+
+        Args:
+            phrase (dict): Conversation phrase, as sent to the chat completions API.
+
+        Returns:
+            MessageRecord: Record of the phrase.
+        """
+        tool_calls = phrase.get('tool_calls')
+        if tool_calls:
+            tool_calls = tuple((call['id'], _intern(call.get('type', 'function')), _intern(call['function']['name']),
+                                call['function']['arguments']) for call in tool_calls)
+        extra = {key: value for key, value in phrase.items() if key not in PHRASE_KEYS}
+        return cls(phrase.get('role'), phrase.get('content'), phrase.get('name'), tool_calls or None,
+                   phrase.get('tool_call_id'), extra)
+
+    def to_dict(self):
+        """
+        Rebuilds the conversation phrase of the record.
+
+        Returns:
+            dict: Conversation phrase, as sent to the chat completions API.
+        """
+        phrase = {'role': self.role}
+        if self.content is not None:
+            phrase['content'] = self.content
+        if self.name is not None:
+            phrase['name'] = self.name
+        if self.tool_calls:
+            phrase['tool_calls'] = [{'id': call_id, 'type': call_type, 'function': {'name': name, 'arguments': arguments}}
+                                    for call_id, call_type, name, arguments in self.tool_calls]
+        if self.tool_call_id is not None:
+            phrase['tool_call_id'] = self.tool_call_id
+        if self.extra:
+            phrase.update(self.extra)
+        return phrase
+
+class JsonlConversationBackend:
+    """
+    Append-only conversation backend, with one JSON Lines file per session.
+
+    Attributes:
+        directory (str): Directory of the session files.
+        __lock: Lock serializing the writes.
+    """
+
+    def __init__(self, directory=c.CONVERSATIONS_PATH):
+        """
+        Initializes an instance of the JsonlConversationBackend class.
+
+        Args:
+            directory (str, optional): Directory of the session files (default: ~/.mygpt/conversations).
+        """
+        self.directory = directory
+        self.__lock = threading.Lock()
+
+    def __path(self, session_id):
+        return os.path.join(self.directory, f'{session_id}.jsonl')
+
+    def append(self, session_id, phrases):
+        """
+        Appends phrases to a session.
+
+        Args:
+            session_id (str): ID of the session.
+            phrases (list): Conversation phrases.
+        """
+        lines = ''.join(json.dumps(phrase, ensure_ascii=False) + '\n' for phrase in phrases)
+        with self.__lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.__path(session_id), 'a', encoding='utf-8') as session_file:
+                session_file.write(lines)
+
+    def count(self, session_id):
+        """
+        Returns the number of phrases of a session.
+
+        Args:
+            session_id (str): ID of the session.
+
+        Returns:
+            int: Number of phrases, 0 for unknown sessions.
+        """
+        try:
+            with open(self.__path(session_id), 'rb') as session_file:
+                return sum(1 for _ in session_file)
+        except FileNotFoundError:
+            return 0
+
+    def load(self, session_id, start=0):
+        """
+        Reads the phrases of a session lazily. Skipped lines are not parsed.
+
+        Args:
+            session_id (str): ID of the session.
+            start (int, optional): Position of the first phrase (default: 0).
+
+        Yields:
+            dict: Conversation phrases, oldest first.
+        """
+        try:
+            session_file = open(self.__path(session_id), encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with session_file:
+            for position, line in enumerate(session_file):
+                if position >= start:
+                    yield json.loads(line)
+
+    def tail(self, session_id, size):
+        """
+        Reads the last phrases of a session in a single pass.
+
+        Args:
+            session_id (str): ID of the session.
+            size (int): Maximum number of phrases.
+
+        Returns:
+            tuple: Position of the first returned phrase and the list of phrases.
+        """
+        try:
+            with open(self.__path(session_id), encoding='utf-8') as session_file:
+                count = 0
+                lines = deque(maxlen=size)
+                for line in session_file:
+                    lines.append(line)
+                    count += 1
+        except FileNotFoundError:
+            return 0, []
+        return count - len(lines), [json.loads(line) for line in lines]
+
+    def sessions(self):
+        """
+        Lists the stored sessions.
+
+        Returns:
+            list: IDs of the sessions.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len('.jsonl')] for name in os.listdir(self.directory) if name.endswith('.jsonl'))
+
+    def delete(self, session_id):
+        """
+        Removes a session.
+
+        Args:
+            session_id (str): ID of the session.
+        """
+        with self.__lock:
+            try:
+                os.remove(self.__path(session_id))
+            except FileNotFoundError:
+                pass
+
+class SqliteConversationBackend:
+    """
+    Append-only conversation backend stored in a SQLite database.
+
+    Attributes:
+        path (str): Path of the database file.
+        __connection: SQLite connection.
+        __lock: Lock serializing the access to the connection.
+    """
+
+    def __init__(self, path='mygpt_conversations.sqlite'):
+        """
+        Initializes an instance of the SqliteConversationBackend class.
+
+        Args:
+            path (str, optional): Path of the database file (default: 'mygpt_conversations.sqlite').
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS messages '
+                '(session_id TEXT, position INTEGER, phrase TEXT, PRIMARY KEY (session_id, position))'
+            )
+
+    def append(self, session_id, phrases):
+        """
+        Appends phrases to a session.
+
+        Args:
+            session_id (str): ID of the session.
+            phrases (list): Conversation phrases.
+        """
+        with self.__lock, self.__connection:
+            start = self.__connection.execute(
+                'SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+            self.__connection.executemany(
+                'INSERT INTO messages (session_id, position, phrase) VALUES (?, ?, ?)',
+                [(session_id, start + index, json.dumps(phrase, ensure_ascii=False)) for index, phrase in enumerate(phrases)]
+            )
+
+    def count(self, session_id):
+        """
+        Returns the number of phrases of a session.
+
+        Args:
+            session_id (str): ID of the session.
+
+        Returns:
+            int: Number of phrases, 0 for unknown sessions.
+        """
+        with self.__lock:
+            return self.__connection.execute(
+                'SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+
+    def load(self, session_id, start=0):
+        """
+        Reads the phrases of a session lazily.
+
+        Args:
+            session_id (str): ID of the session.
+            start (int, optional): Position of the first phrase (default: 0).
+
+        Yields:
+            dict: Conversation phrases, oldest first.
+        """
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT phrase FROM messages WHERE session_id = ? AND position >= ? ORDER BY position',
+                (session_id, start)).fetchall()
+        for row in rows:
+            yield json.loads(row[0])
+
+    def tail(self, session_id, size):
+        """
+        Reads the last phrases of a session.
+
+        Args:
+            session_id (str): ID of the session.
+            size (int): Maximum number of phrases.
+
+        Returns:
+            tuple: Position of the first returned phrase and the list of phrases.
+        """
+        start = max(0, self.count(session_id) - size)
+        return start, list(self.load(session_id, start))
+
+    def sessions(self):
+        """
+        Lists the stored sessions.
+
+        Returns:
+            list: IDs of the sessions.
+        """
+        with self.__lock:
+            rows = self.__connection.execute('SELECT DISTINCT session_id FROM messages ORDER BY session_id').fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, session_id):
+        """
+        Removes a session.
+
+        Args:
+            session_id (str): ID of the session.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+
+class ConversationStore:
+    """
+    Stores the phrases of a conversation as compact records.
+
+    With a backend, every phrase is appended to disk as soon as it is added, so the
+    session can be resumed later by its ID; it is only read on first use. When
+    `max_resident` is set, the oldest turns are paged out of memory, keeping the
+    phrases before the first user phrase (the system instructions) and the most
+    recent complete turns. Paged out turns are no longer sent to GPT but remain on
+    disk and can be read with `get_history`.
+
+    Attributes:
+        backend: Persistence backend, or None to keep the conversation only in memory.
+        max_resident (int): Maximum number of recent phrases kept in memory, or None for all.
+        __session_id (str): ID of the current session.
+        __records (list): Resident records: the leading instructions followed by the recent phrases.
+        __head_size (int): Number of leading records kept before the first user phrase.
+        __paged_out (int): Number of phrases paged out of memory.
+        __loaded (bool): Whether the session was already read from the backend.
+        __lock: Lock protecting the records.
+    """
+
+    def __init__(self, backend=None, session_id=None, max_resident=None):
+        """
+        Initializes an instance of the ConversationStore class.
+
+        Args:
+            backend (optional): JsonlConversationBackend, SqliteConversationBackend or None (default: None).
+            session_id (str, optional): ID of a session to resume (default: a new session).
+            max_resident (int, optional): Maximum number of recent phrases kept in memory. Requires a
+                backend (default: None, keeps all).
+
+        Raises:
+            ValueError: If `max_resident` is set without a backend.
+        """
+        if max_resident is not None and backend is None:
+            raise ValueError('max_resident requires a backend to page the old turns out to')
+        self.backend = backend
+        self.max_resident = max_resident
+        self.__session_id = session_id or uuid.uuid4().hex
+        self.__records = []
+        self.__head_size = 0
+        self.__paged_out = 0
+        self.__loaded = backend is None or session_id is None
+        self.__lock = threading.Lock()
+
+    def __load(self):
+        """
+        Reads the leading instructions and the recent phrases of a resumed session.
+        """
+        if self.__loaded:
+            return
+        self.__loaded = True
+        head = []
+        for phrase in self.backend.load(self.__session_id):
+            if phrase.get('role') == 'user':
+                break
+            head.append(MessageRecord.from_dict(phrase))
+        if self.max_resident is None:
+            start, tail = len(head), list(self.backend.load(self.__session_id, len(head)))
+        else:
+            start, tail = self.backend.tail(self.__session_id, self.max_resident)
+            if start < len(head):
+                tail, start = tail[len(head) - start:], len(head)
+        self.__records = head + [MessageRecord.from_dict(phrase) for phrase in tail]
+        self.__head_size = len(head)
+        self.__paged_out = start - len(head)
+        self.__page_out()
+
+    def __page_out(self):
+        """
+        Drops the oldest complete turns from memory when there are more than `max_resident` recent phrases.
+        """
+        if self.max_resident is None or len(self.__records) - self.__head_size <= self.max_resident:
+            return
+        first = len(self.__records) - self.max_resident
+        for cut in range(max(first, self.__head_size), len(self.__records)):
+            if self.__records[cut].role == 'user':
+                self.__paged_out += cut - self.__head_size
+                del self.__records[self.__head_size:cut]
+                return
+
+    def append(self, phrase):
+        """
+        Adds a phrase to the conversation, persisting it when there is a backend.
+
+        Args:
+            phrase (dict): Conversation phrase.
+        """
+        record = MessageRecord.from_dict(phrase)
+        with self.__lock:
+            self.__load()
+            if self.backend is not None:
+                self.backend.append(self.__session_id, [record.to_dict()])
+            self.__records.append(record)
+            if self.__head_size == len(self.__records) - 1 and record.role != 'user':
+                self.__head_size += 1
+            self.__page_out()
+
+    def get_messages(self):
+        """
+        Returns the resident phrases, in the format of the chat completions API.
+
+        Returns:
+            list: Conversation phrases.
+        """
+        with self.__lock:
+            self.__load()
+            return [record.to_dict() for record in self.__records]
+
+    def get_history(self):
+        """
+        Reads the whole conversation, including the turns paged out of memory.
+
+        Yields:
+            dict: Conversation phrases, oldest first.
+        """
+        if self.backend is None:
+            yield from self.get_messages()
+        else:
+            yield from self.backend.load(self.__session_id)
+
+    def get_session_id(self):
+        """
+        Returns the ID of the current session, used to resume it.
+
+        Returns:
+            str: Session ID.
+        """
+        return self.__session_id
+
+    def get_stats(self):
+        """
+        Returns the size of the conversation.
+
+        Returns:
+            dict: Total phrases ('messages'), phrases in memory ('resident') and paged out ('paged_out').
+        """
+        with self.__lock:
+            self.__load()
+            resident = len(self.__records)
+            return {'messages': resident + self.__paged_out, 'resident': resident, 'paged_out': self.__paged_out}
+
+    def reset(self, session_id=None):
+        """
+        Starts a new session. Persisted sessions stay in the backend.
+
+        Args:
+            session_id (str, optional): ID of a session to resume (default: a new session).
+        """
+        with self.__lock:
+            self.__session_id = session_id or uuid.uuid4().hex
+            self.__records = []
+            self.__head_size = 0
+            self.__paged_out = 0
+            self.__loaded = self.backend is None or session_id is None
@@ -0,0 +1,277 @@
+import os
+import sys
+import glob
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+from MyGPT import gpt_constants as c
+from MyGPT import auxiliar_functions as af
+from MyGPT import ClientPoolClass
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff')
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                    openai.InternalServerError)
+
+def collect_images(source):
+    """
+    Lists the images of a batch.
+
+    Args:
+        source (str or list): Directory, glob pattern, or list of paths and URLs.
+
+    Returns:
+        list: Paths and URLs of the images, in a stable order.
+    """
+    if not isinstance(source, str):
+        return list(source)
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source)
+                      if af.get_file_extension(name) in IMAGE_EXTENSIONS)
+    if any(char in source for char in '*?['):
+        return sorted(glob.glob(source, recursive=True))
+    return [source]
+
+def retry_delay(error, attempt, base_delay=1.0, max_delay=60.0):
+    """
+    Returns the seconds to wait before retrying a failed request.
+
+    The `retry-after-ms` and `retry-after` headers of rate-limit responses are
+    honored; otherwise the delay grows exponentially with jitter.
+
+    Args:
+        error (Exception): Error of the failed request.
+        attempt (int): Number of the failed attempt, starting at 0.
+        base_delay (float, optional): Delay after the first failure (default: 1.0).
+        max_delay (float, optional): Maximum delay (default: 60.0).
+
+    Returns:
+        float: Seconds to wait.
+    """
+    response = getattr(error, 'response', None)
+    headers = response.headers if response is not None else {}
+    try:
+        if headers.get('retry-after-ms'):
+            return min(max_delay, float(headers['retry-after-ms']) / 1000)
+        if headers.get('retry-after'):
+            return min(max_delay, float(headers['retry-after']))
+    except ValueError:
+        pass
+    return min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+class ImageBatch:
+    """
+    Describes many images with the vision model.
+
+    Images are preprocessed by the shared image pipeline and described through a
+    bounded pool of threads. Requests have the BATCH priority in the client pool, so
+    interactive chats go first. Failed requests are retried, waiting as asked by the
+    rate-limit headers. Several images may be packed into a single multi-image
+    message. Results are yielded, or written as JSONL, as soon as they finish.
+
+    Attributes:
+        prompt (str): Text prompt for the descriptions.
+        max_workers (int): Maximum number of requests running at once.
+        images_per_request (int): Number of images packed into each request.
+        max_retries (int): Maximum number of retries of a request.
+        max_tokens (int): Maximum tokens of each description.
+        __client: OpenAI client used for the requests.
+        __pipeline: Image pipeline used to prepare the images.
+        __stats (dict): Counters of the last run.
+        __lock: Lock protecting the counters.
+    """
+
+    def __init__(self, prompt='Descreva a imagem.', max_workers=8, images_per_request=1, max_retries=5,
+                 max_tokens=300, client=None, pipeline=None):
+        """
+        Initializes an instance of the ImageBatch class.
+
+        Args:
+            prompt (str, optional): Text prompt for the descriptions (default: 'Descreva a imagem.').
+            max_workers (int, optional): Maximum number of requests running at once (default: 8).
+            images_per_request (int, optional): Number of images packed into each request (default: 1).
+            max_retries (int, optional): Maximum number of retries of a request (default: 5).
+            max_tokens (int, optional): Maximum tokens of each description (default: 300).
+            client (optional): OpenAI client (default: the client of the default ClientPool, without its own retries).
+            pipeline (optional): Image pipeline (default: af.get_image_pipeline()).
+        """
+        self.prompt = prompt
+        self.max_workers = max_workers
+        self.images_per_request = max(1, images_per_request)
+        self.max_retries = max_retries
+        self.max_tokens = max_tokens
+        self.__client = client or ClientPoolClass.get_default_pool().get_client().with_options(max_retries=0)
+        self.__pipeline = pipeline or af.get_image_pipeline()
+        self.__stats = {}
+        self.__lock = threading.Lock()
+        self.__reset_stats()
+
+    def __reset_stats(self):
+        with self.__lock:
+            self.__stats = {'images': 0, 'failed': 0, 'requests': 0, 'retries': 0, 'prompt_tokens': 0,
+                            'completion_tokens': 0, 'started': time.monotonic(), 'finished': None}
+
+    def __count(self, **counters):
+        with self.__lock:
+            for name, value in counters.items():
+                self.__stats[name] += value
+
+    def __messages(self, urls):
+        """
+        Builds the message of a request for one or several images.
+        """
+        if len(urls) == 1:
+            text = self.prompt
+        else:
+            text = (f'{self.prompt}\nDescreva cada uma das {len(urls)} imagens separadamente, na ordem em que '
+                    'foram enviadas. Responda com um objeto JSON no formato {"descriptions": ["...", "..."]}.')
+        content = [{'type': 'text', 'text': text}]
+        content.extend({'type': 'image_url', 'image_url': {'url': url}} for url in urls)
+        return [{'role': 'user', 'content': content}]
+
+    def __body(self, urls):
+        """
+        Returns the parameters of the request for one or several images.
+        """
+        body = {'model': c.VISION_MODEL, 'messages': self.__messages(urls),
+                'max_tokens': self.max_tokens * len(urls), 'temperature': 0}
+        if len(urls) > 1:
+            body['response_format'] = {'type': 'json_object'}
+        return body
+
+    def __request(self, urls):
+        """
+        Sends a request, retrying the rate-limited and transient failures.
+
+        Returns:
+            str: Content of the answer.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.__count(requests=1)
+                with ClientPoolClass.priority(ClientPoolClass.BATCH):
+                    response = self.__client.chat.completions.create(**self.__body(urls))
+                if response.usage:
+                    self.__count(prompt_tokens=response.usage.prompt_tokens,
+                                 completion_tokens=response.usage.completion_tokens)
+                return response.choices[0].message.content
+            except RETRYABLE_ERRORS as error:
+                if attempt == self.max_retries:
+                    raise
+                self.__count(retries=1)
+                time.sleep(retry_delay(error, attempt))
+
+    def __describe_group(self, paths):
+        """
+        Describes a group of images in one request.
+
+        Returns:
+            list: One result per image.
+        """
+        started = time.monotonic()
+        try:
+            if len(paths) == 1:
+                descriptions = [self.__pipeline.describe(paths[0], self.prompt,
+                                                         lambda prompt, url: self.__request([url]))]
+            else:
+                answer = self.__request([self.__pipeline.prepare(path) for path in paths])
+                try:
+                    descriptions = json.loads(answer)['descriptions']
+                except (TypeError, ValueError, KeyError):
+                    descriptions = None
+                if not isinstance(descriptions, list) or len(descriptions) != len(paths):
+                    # The packed answer could not be matched to the images, describe them one by one
+                    return [result for path in paths for result in self.__describe_group([path])]
+            seconds = (time.monotonic() - started) / len(paths)
+            self.__count(images=len(paths))
+            return [{'path': path, 'description': description, 'error': None, 'seconds': round(seconds, 3)}
+                    for path, description in zip(paths, descriptions)]
+        except (OSError, openai.OpenAIError) as error:
+            self.__count(images=len(paths), failed=len(paths))
+            return [{'path': path, 'description': None, 'error': f'{type(error).__name__}: {error}', 'seconds': None}
+                    for path in paths]
+
+    def __groups(self, paths):
+        return [paths[index:index + self.images_per_request] for index in range(0, len(paths), self.images_per_request)]
+
+    def run(self, source):
+        """
+        Describes the images of a batch, yielding each result as soon as it finishes.
+
+        Args:
+            source (str or list): Directory, glob pattern, or list of paths and URLs.
+
+        Yields:
+            dict: Result with the `path`, `description`, `error` and `seconds` of an image.
+        """
+        self.__reset_stats()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='mygpt-batch') as executor:
+            futures = [executor.submit(self.__describe_group, group) for group in self.__groups(collect_images(source))]
+            for future in as_completed(futures):
+                yield from future.result()
+        with self.__lock:
+            self.__stats['finished'] = time.monotonic()
+
+    def write_jsonl(self, source, output=sys.stdout):
+        """
+        Describes the images of a batch, writing one JSON line per image as it finishes.
+
+        Args:
+            source (str or list): Directory, glob pattern, or list of paths and URLs.
+            output (str or file, optional): Path or text file of the output (default: sys.stdout).
+
+        Returns:
+            dict: Statistics of the run, as returned by `get_stats`.
+        """
+        output_file = open(output, 'w', encoding='utf-8') if isinstance(output, str) else output
+        try:
+            for result in self.run(source):
+                output_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+                output_file.flush()
+        finally:
+            if output_file is not output:
+                output_file.close()
+        return self.get_stats()
+
+    def export_batch_file(self, source, output):
+        """
+        Writes the requests of a batch in the input file format of the OpenAI Batch API.
+
+        Each line has a `custom_id` listing the images of the request, separated by '|'.
+
+        Args:
+            source (str or list): Directory, glob pattern, or list of paths and URLs.
+            output (str): Path of the JSONL file.
+
+        Returns:
+            int: Number of requests written.
+        """
+        groups = self.__groups(collect_images(source))
+        with open(output, 'w', encoding='utf-8') as output_file:
+            for group in groups:
+                request = {
+                    'custom_id': '|'.join(group),
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': self.__body([self.__pipeline.prepare(path) for path in group])
+                }
+                output_file.write(json.dumps(request) + '\n')
+        return len(groups)
+
+    def get_stats(self):
+        """
+        Returns the counters and throughput of the last run.
+
+        Returns:
+            dict: Images, failed images, requests, retries, tokens, elapsed seconds and images per second.
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+        elapsed = (stats.pop('finished') or time.monotonic()) - stats.pop('started')
+        stats['elapsed'] = round(elapsed, 3)
+        stats['images_per_second'] = round(stats['images'] / elapsed, 3) if elapsed > 0 else 0.0
+        return stats
@@ -0,0 +1,234 @@
+import io
+import os
+import base64
+import asyncio
+import hashlib
+import threading
+
+from MyGPT import gpt_constants as c
+from MyGPT import ResponseCacheClass
+
+CHUNK_SIZE = 3 * 64 * 1024
+EXIF_ORIENTATION = 0x0112
+
+def hash_file(path):
+    """
+    Computes the SHA-256 of a file, reading it in chunks.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        str: Hexadecimal digest of the content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def encode_stream(stream):
+    """
+    Base64-encodes a binary stream in chunks, without holding its raw content.
+
+    Args:
+        stream: Binary file object.
+
+    Returns:
+        str: Base64 content.
+    """
+    # Chunks are multiples of 3 bytes, so their encodings can be joined without padding
+    return ''.join(base64.b64encode(chunk).decode('ascii')
+                   for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''))
+
+def vision_size(width, height, max_side=c.VISION_MAX_SIDE, short_side=c.VISION_SHORT_SIDE):
+    """
+    Returns the size the vision model scales an image to before reading it.
+
+    The image is fit in a `max_side` square and then its shortest side is limited
+    to `short_side`. Smaller images are kept as they are.
+
+    Args:
+        width (int): Width of the image.
+        height (int): Height of the image.
+        max_side (int, optional): Side of the square the image must fit in.
+        short_side (int, optional): Maximum length of the shortest side.
+
+    Returns:
+        tuple: Width and height of the scaled image.
+    """
+    scale = min(1, max_side / max(width, height))
+    if min(width, height) * scale > short_side:
+        scale = short_side / min(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+class ImagePipeline:
+    """
+    Prepares local images for the vision model.
+
+    Images are downscaled to the resolution the vision model actually reads and
+    re-encoded compactly (JPEG, or PNG when they have transparency) before becoming
+    a data URL. Payloads are cached by content hash and descriptions by content hash
+    and prompt, so an image sent twice is neither re-encoded nor described again. The
+    hash of a file is remembered by its path, size and modification time, so an
+    unchanged file is not even read again.
+
+    Attributes:
+        quality (int): JPEG quality of the re-encoded images.
+        max_side (int): Side of the square the images must fit in.
+        short_side (int): Maximum length of the shortest side of the images.
+        __payloads: Cache backend of data URLs by content hash.
+        __descriptions: Cache backend of descriptions by content hash and prompt.
+        __file_hashes (dict): Mapping of (path, size, modification time) to content hashes.
+        __lock: Lock protecting the file hashes.
+    """
+
+    def __init__(self, quality=85, max_side=c.VISION_MAX_SIDE, short_side=c.VISION_SHORT_SIDE, max_payloads=64,
+                 max_descriptions=1024):
+        """
+        Initializes an instance of the ImagePipeline class.
+
+        Args:
+            quality (int, optional): JPEG quality of the re-encoded images (default: 85).
+            max_side (int, optional): Side of the square the images must fit in (default: c.VISION_MAX_SIDE).
+            short_side (int, optional): Maximum length of the shortest side (default: c.VISION_SHORT_SIDE).
+            max_payloads (int, optional): Maximum number of data URLs kept (default: 64).
+            max_descriptions (int, optional): Maximum number of descriptions kept (default: 1024).
+        """
+        self.quality = quality
+        self.max_side = max_side
+        self.short_side = short_side
+        self.__payloads = ResponseCacheClass.MemoryCacheBackend(max_entries=max_payloads)
+        self.__descriptions = ResponseCacheClass.MemoryCacheBackend(max_entries=max_descriptions)
+        self.__file_hashes = {}
+        self.__lock = threading.Lock()
+
+    def get_hash(self, path):
+        """
+        Returns the content hash of an image, or of the URL for remote images.
+
+        Args:
+            path (str): Path or URL of the image.
+
+        Returns:
+            str: Hexadecimal digest.
+        """
+        if path.startswith('http') or path.startswith('data:image'):
+            return hashlib.sha256(path.encode('utf-8')).hexdigest()
+        stat = os.stat(path)
+        file_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self.__lock:
+            content_hash = self.__file_hashes.get(file_key)
+        if content_hash is None:
+            content_hash = hash_file(path)
+            with self.__lock:
+                self.__file_hashes[file_key] = content_hash
+        return content_hash
+
+    def __encode(self, path):
+        """
+        Downscales and re-encodes an image, returning its data URL.
+
+        Files Pillow cannot read are sent as they are.
+        """
+        from PIL import Image, ImageOps
+
+        try:
+            image = Image.open(path)
+        except (OSError, ValueError):
+            with open(path, 'rb') as image_file:
+                extension = os.path.splitext(path)[1][1:].lower()
+                return f'data:image/{extension};base64,{encode_stream(image_file)}'
+        with image:
+            width, height = image.size
+            # EXIF orientations 5 to 8 rotate the image by 90 degrees, swapping its sides
+            rotated = image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8)
+            if rotated:
+                width, height = height, width
+            size = vision_size(width, height, max_side=self.max_side, short_side=self.short_side)
+            # JPEG files are decoded directly at a reduced scale when possible, in their stored orientation
+            image.draft('RGB', size[::-1] if rotated else size)
+            image = ImageOps.exif_transpose(image)
+            if image.size != size:
+                image = image.resize(size, Image.LANCZOS)
+            buffer = io.BytesIO()
+            if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+                image.save(buffer, format='PNG', optimize=True)
+                mime = 'png'
+            else:
+                image.convert('RGB').save(buffer, format='JPEG', quality=self.quality, optimize=True)
+                mime = 'jpeg'
+        buffer.seek(0)
+        return f'data:image/{mime};base64,{encode_stream(buffer)}'
+
+    def prepare(self, path, content_hash=None):
+        """
+        Returns the data URL of a local image, or the path itself for URLs.
+
+        Args:
+            path (str): Path or URL of the image.
+            content_hash (str, optional): Content hash, if already known.
+
+        Returns:
+            str: URL to send to the vision model.
+        """
+        if path.startswith('http') or path.startswith('data:image'):
+            return path
+        content_hash = content_hash or self.get_hash(path)
+        data_url = self.__payloads.get(content_hash)
+        if data_url is None:
+            data_url = self.__encode(path)
+            self.__payloads.set(content_hash, data_url)
+        return data_url
+
+    def describe(self, path, prompt, describe):
+        """
+        Describes an image, reusing the description of the same image and prompt.
+
+        Args:
+            path (str): Path or URL of the image.
+            prompt (str): Text prompt for the description.
+            describe (function): Called with the prompt and the image URL, returns the description.
+
+        Returns:
+            str: Description of the image.
+        """
+        content_hash = self.get_hash(path)
+        key = f'{content_hash}:{hashlib.sha256(prompt.encode("utf-8")).hexdigest()}'
+        description = self.__descriptions.get(key)
+        if description is None:
+            description = describe(prompt, self.prepare(path, content_hash=content_hash))
+            if description:
+                self.__descriptions.set(key, description)
+        return description
+
+    async def async_describe(self, path, prompt, describe):
+        """
+        Describes an image without blocking the event loop.
+
+        Args:
+            path (str): Path or URL of the image.
+            prompt (str): Text prompt for the description.
+            describe (function): Coroutine function called with the prompt and the image URL.
+
+        Returns:
+            str: Description of the image.
+        """
+        content_hash = await asyncio.to_thread(self.get_hash, path)
+        key = f'{content_hash}:{hashlib.sha256(prompt.encode("utf-8")).hexdigest()}'
+        description = self.__descriptions.get(key)
+        if description is None:
+            url = await asyncio.to_thread(self.prepare, path, content_hash)
+            description = await describe(prompt, url)
+            if description:
+                self.__descriptions.set(key, description)
+        return description
+
+    def clear(self):
+        """
+        Removes all cached payloads, descriptions and file hashes.
+        """
+        self.__payloads.clear()
+        self.__descriptions.clear()
+        with self.__lock:
+            self.__file_hashes.clear()
@@ -0,0 +1,368 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+
+SUMMED_ATTRIBUTES = ('prompt_tokens', 'completion_tokens', 'total_tokens', 'request_bytes', 'response_bytes')
+LABEL_ATTRIBUTES = ('model', 'tool')
+QUANTILES = (0.5, 0.9, 0.99)
+
+def percentile(samples, quantile):
+    """
+    Returns a percentile of a list of samples, using the nearest rank.
+
+    Args:
+        samples (list): Sorted samples.
+        quantile (float): Quantile between 0 and 1.
+
+    Returns:
+        float: Sample at the quantile, or None if there are no samples.
+    """
+    if not samples:
+        return None
+    rank = max(0, min(len(samples) - 1, math.ceil(quantile * len(samples)) - 1))
+    return samples[rank]
+
+class Span:
+    """
+    Timed operation with its attributes.
+
+    Attributes:
+        name (str): Name of the operation, as 'chat_completion'.
+        attributes (dict): Attributes of the operation, as the model and tokens.
+        start_time (float): Epoch time when the operation started.
+        duration (float): Wall time of the operation in seconds.
+        error (str): Name of the exception raised by the operation, or None.
+    """
+    __slots__ = ('name', 'attributes', 'start_time', 'duration', 'error', '_started')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.duration = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        """
+        Adds attributes to the span.
+        """
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {'name': self.name, 'start_time': self.start_time, 'duration': self.duration, 'error': self.error,
+                'attributes': self.attributes}
+
+class _SpanContext:
+    __slots__ = ('recorder', 'span')
+
+    def __init__(self, recorder, span):
+        self.recorder = recorder
+        self.span = span
+
+    def __enter__(self):
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.span.duration = time.perf_counter() - self.span._started
+        if exc_type is not None:
+            self.span.error = exc_type.__name__
+        self.recorder.record(self.span)
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class NullMetrics:
+    """
+    Metrics recorder that records nothing, used when no recorder is given.
+    """
+    enabled = False
+
+    def span(self, name, **attributes):
+        return _NULL_SPAN
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+class MetricsRecorder:
+    """
+    Records spans of the operations of MyGPT and keeps their aggregates.
+
+    Each span records its wall time and attributes such as the model, tokens and
+    payload bytes. Spans are aggregated by name and by their 'model' or 'tool'
+    attribute, keeping the counts, sums and a window of recent durations to compute
+    percentiles. Observers are called with each finished span, so they can forward it
+    to a tracing system, and aggregates can be exported to a file in the Prometheus
+    text format or the recent spans in the OpenTelemetry (OTLP) JSON format.
+
+    Attributes:
+        service_name (str): Name of the service in the exported spans.
+        max_samples (int): Number of recent durations kept per aggregate.
+        __aggregates (dict): Mapping of (name, labels) to their aggregates.
+        __counters (dict): Mapping of (name, labels) to counter values.
+        __spans (deque): Recent finished spans.
+        __observers (list): Functions called with each finished span.
+        __lock: Lock protecting the aggregates.
+    """
+    enabled = True
+
+    def __init__(self, service_name='mygpt', max_samples=1024, max_spans=1000):
+        """
+        Initializes an instance of the MetricsRecorder class.
+
+        Args:
+            service_name (str, optional): Name of the service in the exported spans (default: 'mygpt').
+            max_samples (int, optional): Number of recent durations kept per aggregate (default: 1024).
+            max_spans (int, optional): Number of recent spans kept for export (default: 1000).
+        """
+        self.service_name = service_name
+        self.max_samples = max_samples
+        self.__aggregates = {}
+        self.__counters = {}
+        self.__spans = deque(maxlen=max_spans)
+        self.__observers = []
+        self.__lock = threading.Lock()
+
+    def add_observer(self, observer):
+        """
+        Registers a function called with each finished span.
+
+        Args:
+            observer (function): Function receiving a Span.
+        """
+        self.__observers.append(observer)
+
+    def span(self, name, **attributes):
+        """
+        Returns a context manager timing an operation.
+
+        Args:
+            name (str): Name of the operation.
+            **attributes: Initial attributes of the span.
+
+        Returns:
+            Context manager yielding the Span, whose attributes can be completed with `set`.
+        """
+        return _SpanContext(self, Span(name, attributes))
+
+    def __labels(self, attributes):
+        return tuple((label, str(attributes[label])) for label in LABEL_ATTRIBUTES if attributes.get(label) is not None)
+
+    def record(self, span):
+        """
+        Adds a finished span to the aggregates and notifies the observers.
+
+        Args:
+            span (Span): Finished span.
+        """
+        key = (span.name, self.__labels(span.attributes))
+        with self.__lock:
+            aggregate = self.__aggregates.get(key)
+            if aggregate is None:
+                aggregate = self.__aggregates[key] = {
+                    'count': 0, 'errors': 0, 'seconds': 0.0,
+                    'durations': deque(maxlen=self.max_samples), 'sums': dict.fromkeys(SUMMED_ATTRIBUTES, 0)
+                }
+            aggregate['count'] += 1
+            aggregate['errors'] += span.error is not None
+            aggregate['seconds'] += span.duration
+            aggregate['durations'].append(span.duration)
+            for attribute in SUMMED_ATTRIBUTES:
+                value = span.attributes.get(attribute)
+                if value:
+                    aggregate['sums'][attribute] += value
+            self.__spans.append(span)
+        for observer in self.__observers:
+            observer(span)
+
+    def increment(self, name, value=1, **labels):
+        """
+        Increments a counter, as cache hits or tool timeouts.
+
+        Args:
+            name (str): Name of the counter.
+            value (int, optional): Amount to add (default: 1).
+            **labels: Labels of the counter.
+        """
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def get_summary(self):
+        """
+        Returns the aggregates of the recorded spans.
+
+        Returns:
+            list: One entry per span name and labels, with its count, errors, total seconds,
+                p50/p90/p99 and max durations, and the summed tokens and bytes.
+        """
+        with self.__lock:
+            items = [(key, dict(aggregate, durations=sorted(aggregate['durations']), sums=dict(aggregate['sums'])))
+                     for key, aggregate in self.__aggregates.items()]
+        summary = []
+        for (name, labels), aggregate in items:
+            durations = aggregate['durations']
+            entry = {'name': name, **dict(labels), 'count': aggregate['count'], 'errors': aggregate['errors'],
+                     'seconds': aggregate['seconds']}
+            entry.update({f'p{int(quantile * 100)}': percentile(durations, quantile) for quantile in QUANTILES})
+            entry['max'] = durations[-1] if durations else None
+            entry.update({attribute: value for attribute, value in aggregate['sums'].items() if value})
+            summary.append(entry)
+        return summary
+
+    def get_counters(self):
+        """
+        Returns the counters.
+
+        Returns:
+            dict: Mapping of (name, labels) to values.
+        """
+        with self.__lock:
+            return dict(self.__counters)
+
+    def get_spans(self):
+        """
+        Returns the recent finished spans.
+
+        Returns:
+            list: Spans, oldest first.
+        """
+        with self.__lock:
+            return list(self.__spans)
+
+    def reset(self):
+        """
+        Removes all spans, aggregates and counters.
+        """
+        with self.__lock:
+            self.__aggregates.clear()
+            self.__counters.clear()
+            self.__spans.clear()
+
+    def __write(self, path, text):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(text)
+        os.replace(temp_path, path)
+
+    def to_prometheus(self, prefix='mygpt'):
+        """
+        Renders the aggregates and counters in the Prometheus text exposition format.
+
+        Durations are exported as summaries with the p50, p90 and p99 quantiles, and
+        the summed attributes as counters.
+
+        Args:
+            prefix (str, optional): Prefix of the metric names (default: 'mygpt').
+
+        Returns:
+            str: Metrics text.
+        """
+        def render_labels(labels):
+            if not labels:
+                return ''
+            rendered = ','.join('{}="{}"'.format(label, value.replace('\\', '\\\\').replace('"', '\\"'))
+                                for label, value in labels)
+            return '{' + rendered + '}'
+
+        lines = [f'# TYPE {prefix}_span_duration_seconds summary']
+        summary = self.get_summary()
+        for entry in summary:
+            labels = [('span', entry['name'])] + [(label, entry[label]) for label in LABEL_ATTRIBUTES if label in entry]
+            for quantile in QUANTILES:
+                value = entry[f'p{int(quantile * 100)}']
+                lines.append(f'{prefix}_span_duration_seconds{render_labels(labels + [("quantile", str(quantile))])} '
+                             f'{value}')
+            lines.append(f'{prefix}_span_duration_seconds_sum{render_labels(labels)} {entry["seconds"]}')
+            lines.append(f'{prefix}_span_duration_seconds_count{render_labels(labels)} {entry["count"]}')
+        lines.append(f'# TYPE {prefix}_span_errors_total counter')
+        for entry in summary:
+            labels = [('span', entry['name'])] + [(label, entry[label]) for label in LABEL_ATTRIBUTES if label in entry]
+            lines.append(f'{prefix}_span_errors_total{render_labels(labels)} {entry["errors"]}')
+        for attribute in SUMMED_ATTRIBUTES:
+            entries = [entry for entry in summary if attribute in entry]
+            if not entries:
+                continue
+            lines.append(f'# TYPE {prefix}_{attribute}_total counter')
+            for entry in entries:
+                labels = [('span', entry['name'])] + [(label, entry[label]) for label in LABEL_ATTRIBUTES if label in entry]
+                lines.append(f'{prefix}_{attribute}_total{render_labels(labels)} {entry[attribute]}')
+        counters = sorted(self.get_counters().items())
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append(f'{prefix}_{name}_total{render_labels(list(labels))} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def export_prometheus(self, path, prefix='mygpt'):
+        """
+        Writes the metrics to a file in the Prometheus text format, as read by the
+        node exporter textfile collector.
+
+        Args:
+            path (str): Path of the file.
+            prefix (str, optional): Prefix of the metric names (default: 'mygpt').
+        """
+        self.__write(path, self.to_prometheus(prefix=prefix))
+
+    def to_otlp(self):
+        """
+        Renders the recent spans in the OpenTelemetry (OTLP) JSON format.
+
+        Returns:
+            dict: OTLP `ExportTraceServiceRequest` payload.
+        """
+        def attribute_value(value):
+            if isinstance(value, bool):
+                return {'boolValue': value}
+            if isinstance(value, int):
+                return {'intValue': str(value)}
+            if isinstance(value, float):
+                return {'doubleValue': value}
+            return {'stringValue': str(value)}
+
+        spans = []
+        for span in self.get_spans():
+            start = int(span.start_time * 1e9)
+            otlp_span = {
+                'traceId': os.urandom(16).hex(),
+                'spanId': os.urandom(8).hex(),
+                'name': span.name,
+                'kind': 1,
+                'startTimeUnixNano': str(start),
+                'endTimeUnixNano': str(start + int(span.duration * 1e9)),
+                'attributes': [{'key': key, 'value': attribute_value(value)} for key, value in span.attributes.items()],
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+            }
+            spans.append(otlp_span)
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'MyGPT'}, 'spans': spans}]
+        }]}
+
+    def export_otlp(self, path):
+        """
+        Writes the recent spans to a file in the OpenTelemetry (OTLP) JSON format.
+
+        Args:
+            path (str): Path of the file.
+        """
+        self.__write(path, json.dumps(self.to_otlp()))
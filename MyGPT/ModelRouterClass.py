@@ -0,0 +1,293 @@
+import asyncio
+import threading
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from MyGPT import gpt_constants as c
+from MyGPT import ConversationMemoryClass
+
+def is_acceptable(response):
+    """
+    Checks whether a completion can be returned to the user.
+
+    Answers cut by the token limit or by the content filter, and empty answers without
+    tool calls, are not acceptable and are escalated to the next model.
+
+    Args:
+        response (ChatCompletion): Completion to check.
+
+    Returns:
+        bool: True if the completion is acceptable.
+    """
+    choice = response.choices[0]
+    if choice.finish_reason in ('length', 'content_filter'):
+        return False
+    return bool(choice.message.content or choice.message.tool_calls)
+
+class ModelRouter:
+    """
+    Picks the model of each request and escalates or hedges it with a stronger model.
+
+    Models are listed from the cheapest to the strongest. Each request goes to the first
+    model whose context window fits the prompt and the completion, skipping the models
+    whose average latency is above `latency_target`. Requests sending tools may go to a
+    model of their own. When the answer is not acceptable, the request is sent again to
+    the next model of the list.
+
+    With `hedge_delay`, the next model is also fired when the first one has not answered
+    after that many seconds (0 sends both at once). The first acceptable answer wins, and
+    the other request is cancelled when possible or its answer is discarded.
+
+    Attributes:
+        models (list): Candidate models, from the cheapest to the strongest.
+        tools_model (str): Model of the requests that send tools, or None to route them as the others.
+        vision_model (str): Model of the image descriptions.
+        hedge_delay (float): Seconds before the next model is fired, or None to disable hedging.
+        latency_target (float): Average latency in seconds above which a model is skipped, or None.
+        smoothing (float): Weight of the last latency in the moving average of each model.
+        is_acceptable (function): Checks whether a completion can be returned.
+        max_workers (int): Maximum number of hedged requests running at the same time.
+        __latencies (dict): Moving average of the latency of each model, in seconds.
+        __stats (dict): Counters of the requests, hedges, escalations and wins of each model.
+        __executor: Thread pool running the hedged requests, created on first use.
+        __lock: Lock protecting the latencies and the counters.
+    """
+
+    def __init__(self, models=c.ROUTER_MODELS, tools_model=None, vision_model=c.VISION_MODEL, hedge_delay=None,
+                 latency_target=None, smoothing=0.3, is_acceptable=is_acceptable, max_workers=8):
+        """
+        Initializes an instance of the ModelRouter class.
+
+        Args:
+            models (list, optional): Candidate models, from the cheapest to the strongest
+                (default: gpt-3.5-turbo-0125 then gpt-4o).
+            tools_model (str, optional): Model of the requests that send tools (default: None).
+            vision_model (str, optional): Model of the image descriptions (default: gpt-4o).
+            hedge_delay (float, optional): Seconds before the next model is fired, 0 to fire both
+                at once (default: None, no hedging).
+            latency_target (float, optional): Average latency in seconds above which a model is
+                skipped (default: None).
+            smoothing (float, optional): Weight of the last latency in the moving average (default: 0.3).
+            is_acceptable (function, optional): Checks whether a completion can be returned
+                (default: not cut by the token limit and not empty).
+            max_workers (int, optional): Maximum number of hedged requests running at the same time (default: 8).
+        """
+        self.models = list(models)
+        self.tools_model = tools_model
+        self.vision_model = vision_model
+        self.hedge_delay = hedge_delay
+        self.latency_target = latency_target
+        self.smoothing = smoothing
+        self.is_acceptable = is_acceptable
+        self.max_workers = max_workers
+        self.__latencies = {}
+        self.__stats = {'requests': 0, 'hedged': 0, 'escalated': 0, 'wins': {}}
+        self.__executor = None
+        self.__lock = threading.Lock()
+
+    def __get_executor(self):
+        """
+        Returns the thread pool, creating it once on first use.
+        """
+        if self.__executor is None:
+            with self.__lock:
+                if self.__executor is None:
+                    self.__executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                         thread_name_prefix='mygpt-hedge')
+        return self.__executor
+
+    def __submit(self, create, params):
+        """
+        Runs a request on the thread pool, in a copy of the caller's context, so the
+        request keeps the priority of the caller.
+        """
+        return self.__get_executor().submit(contextvars.copy_context().run, self.__timed, create, params)
+
+    def route(self, prompt_tokens, max_tokens=0, tools=False):
+        """
+        Picks the model of a request.
+
+        Args:
+            prompt_tokens (int): Tokens of the conversation to send.
+            max_tokens (int, optional): Tokens reserved for the completion.
+            tools (bool, optional): Whether the request sends tools.
+
+        Returns:
+            str: Model ID.
+        """
+        needed = prompt_tokens + (max_tokens or 0)
+        if tools and self.tools_model and ConversationMemoryClass.get_context_window(self.tools_model) >= needed:
+            return self.tools_model
+        candidates = [model for model in self.models if ConversationMemoryClass.get_context_window(model) >= needed]
+        if not candidates:
+            return max(self.models, key=ConversationMemoryClass.get_context_window)
+        if self.latency_target is not None:
+            with self.__lock:
+                fast = [model for model in candidates if self.__latencies.get(model, 0) <= self.latency_target]
+                if not fast:
+                    return min(candidates, key=lambda model: self.__latencies[model])
+            return fast[0]
+        return candidates[0]
+
+    def get_fallback(self, model):
+        """
+        Returns the model a request is escalated or hedged to.
+
+        Args:
+            model (str): Model of the request.
+
+        Returns:
+            str: Next model of the list, or None for the last one and models out of the list.
+        """
+        if model not in self.models:
+            return None
+        index = self.models.index(model)
+        return self.models[index + 1] if index + 1 < len(self.models) else None
+
+    def record_latency(self, model, seconds):
+        """
+        Adds the latency of a request to the moving average of its model.
+
+        Args:
+            model (str): Model ID.
+            seconds (float): Latency of the request.
+        """
+        with self.__lock:
+            average = self.__latencies.get(model)
+            self.__latencies[model] = seconds if average is None else \
+                self.smoothing * seconds + (1 - self.smoothing) * average
+
+    def __count(self, stat, model=None):
+        with self.__lock:
+            if model is None:
+                self.__stats[stat] += 1
+            else:
+                self.__stats[stat][model] = self.__stats[stat].get(model, 0) + 1
+
+    def __timed(self, create, params):
+        started = time.monotonic()
+        response = create(**params)
+        self.record_latency(params['model'], time.monotonic() - started)
+        return response
+
+    async def __async_timed(self, create, params):
+        started = time.monotonic()
+        response = await create(**params)
+        self.record_latency(params['model'], time.monotonic() - started)
+        return response
+
+    def __accepts(self, future):
+        return future.exception() is None and self.is_acceptable(future.result())
+
+    def __pick(self, futures):
+        """
+        Returns the answer of hedged requests when none of them was acceptable, preferring
+        the last one and raising its exception when every request failed.
+        """
+        for future in reversed(futures):
+            if future.exception() is None:
+                return future.result()
+        return futures[-1].result()
+
+    def request(self, create, params):
+        """
+        Requests a completion on the routed model, escalating or hedging it to the next model.
+
+        Args:
+            create (function): `chat.completions.create` of the client.
+            params (dict): Parameters of `chat.completions.create`.
+
+        Returns:
+            ChatCompletion: First acceptable completion, or the last one received.
+        """
+        self.__count('requests')
+        fallback = self.get_fallback(params['model'])
+        if fallback is None or self.hedge_delay is None:
+            response = self.__timed(create, params)
+            if fallback is not None and not self.is_acceptable(response):
+                self.__count('escalated')
+                params = {**params, 'model': fallback}
+                response = self.__timed(create, params)
+            self.__count('wins', params['model'])
+            return response
+        primary = self.__submit(create, params)
+        wait([primary], timeout=self.hedge_delay)
+        if primary.done() and self.__accepts(primary):
+            self.__count('wins', params['model'])
+            return primary.result()
+        self.__count('hedged')
+        futures = [primary, self.__submit(create, {**params, 'model': fallback})]
+        models = [params['model'], fallback]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if self.__accepts(future):
+                    for other in pending:
+                        other.cancel()
+                    self.__count('wins', models[futures.index(future)])
+                    return future.result()
+        return self.__pick(futures)
+
+    async def async_request(self, create, params):
+        """
+        Requests a completion on the routed model with an async client, escalating or hedging
+        it to the next model. The losing request of a hedge is cancelled.
+
+        Args:
+            create (function): `chat.completions.create` of the async client.
+            params (dict): Parameters of `chat.completions.create`.
+
+        Returns:
+            ChatCompletion: First acceptable completion, or the last one received.
+        """
+        self.__count('requests')
+        fallback = self.get_fallback(params['model'])
+        if fallback is None or self.hedge_delay is None:
+            response = await self.__async_timed(create, params)
+            if fallback is not None and not self.is_acceptable(response):
+                self.__count('escalated')
+                params = {**params, 'model': fallback}
+                response = await self.__async_timed(create, params)
+            self.__count('wins', params['model'])
+            return response
+        primary = asyncio.ensure_future(self.__async_timed(create, params))
+        await asyncio.wait([primary], timeout=self.hedge_delay)
+        if primary.done() and self.__accepts(primary):
+            self.__count('wins', params['model'])
+            return primary.result()
+        self.__count('hedged')
+        futures = [primary, asyncio.ensure_future(self.__async_timed(create, {**params, 'model': fallback}))]
+        models = [params['model'], fallback]
+        pending = set(futures)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if self.__accepts(future):
+                    for other in pending:
+                        other.cancel()
+                    self.__count('wins', models[futures.index(future)])
+                    return future.result()
+        return self.__pick(futures)
+
+    def get_latencies(self):
+        """
+        Returns the moving average of the latency of each model.
+
+        Returns:
+            dict: Mapping of model IDs to seconds.
+        """
+        with self.__lock:
+            return dict(self.__latencies)
+
+    def get_stats(self):
+        """
+        Returns the routing counters.
+
+        Returns:
+            dict: Requests ('requests'), requests hedged ('hedged') and escalated ('escalated'),
+                and the answers returned per model ('wins').
+        """
+        with self.__lock:
+            return {**self.__stats, 'wins': dict(self.__stats['wins'])}
@@ -1,10 +1,19 @@
-import openai
-import json
-from dotenv import load_dotenv, find_dotenv
+import hashlib
+import threading
 
 from MyGPT import gpt_constants as c
-
-_ = load_dotenv(find_dotenv())
+from MyGPT import auxiliar_functions as af
+from MyGPT import ToolDispatcherClass
+from MyGPT import ToolRegistryClass
+from MyGPT import SingleFlightClass
+from MyGPT import ConversationMemoryClass
+from MyGPT import ConversationStoreClass
+from MyGPT import AssistantRunWaiterClass
+from MyGPT import AssistantRunManagerClass
+from MyGPT import MetricsRecorderClass
+from MyGPT import OutputSinkClass
+from MyGPT import ClientPoolClass
+from MyGPT import ChatCoreClass
 
 class MyGPT:
     """
@@ -14,21 +23,36 @@ class MyGPT:
         model (str): Model ID to use for GPT.
         max_tokens (int): Maximum number of tokens per request.
         temperature (float): Sampling temperature for text generation.
-        __conversation (list): List to store conversation history.
+        __conversation: ConversationStore holding the conversation history.
         __responses (list): List to store GPT responses.
         __usages (list): List to store internal usage statistics.
         __stream_content: Content from streamed asynchronous sessions.
         __client: OpenAI Client instance.
         __assistant_name (str): Name of the assistant.
-        __printf: Print function to use.
-        __available_tools (list): List of registered tools.
-        __available_tools_pointers (dict): Mapping of tool names to their functions.
-        __code_interpreter_assistent: ID of the code interpreter assistant.
-        __assistant_thread: ID of the current thread with the assistant.
-        __assistant_thread_run: ID of the current assistant run.
+        __printf: Output sink receiving the streamed tokens.
+        __tools: ToolRegistry of the registered tools, with their schemas prepared once.
+        __tool_dispatcher: Dispatcher that runs the tool calls of a turn concurrently.
+        __memory: ConversationMemory that keeps each request under the token budget.
+        __cache: ResponseCache of completions and tool results, or None.
+        __assistants_cache_path (str): File where resolved assistant IDs are persisted.
+        __code_interpreter_assistent: ID of the code interpreter assistant, resolved on first use.
+        __assistant_lock: Lock serializing the resolution of the code interpreter assistant.
+        __assistant_run: Handle of the last assistant run started, used when no run is given.
+        __run_waiter: AssistantRunWaiter used to wait for assistant runs.
+        __run_manager: AssistantRunManager running each assistant call on a thread of its own.
+        __router: ModelRouter picking the model of each request, or None to always use `model`.
+        __semantic_cache: SemanticCache answering questions similar to previous ones, or None.
+        __single_flight: SingleFlight sharing identical completions and image descriptions in flight.
+        __metrics: MetricsRecorder of the spans of model calls, tools, assistant runs and images.
+        __core: ChatCore building the requests and resolving the tool rounds, shared with AsyncMyGPT.
     """
 
-    def __init__(self, assistant_name=None, model='gpt-3.5-turbo-0125', max_tokens=1000, temperature=0, printf=print):
+    def __init__(self, assistant_name=None, model='gpt-3.5-turbo-0125', max_tokens=1000, temperature=0, printf=None,
+                 max_tool_workers=4, tool_timeout=None, max_tool_rounds=5, token_budget=None, time_budget=None,
+                 memory=None, cache=None, assistants_cache_path=c.ASSISTANTS_CACHE_PATH,
+                 run_waiter=None, client=None, tool_dispatcher=None, metrics=None, conversation_store=None,
+                 tool_registry=None, run_manager=None, model_router=None,
+                 semantic_cache=None, single_flight=None):
         """
         Initializes an instance of the MyGPT class.
 
@@ -37,23 +61,70 @@ class MyGPT:
             model (str, optional): Model ID to use for GPT (default: 'gpt-3.5-turbo-0125').
             max_tokens (int, optional): Maximum number of tokens per request (default: 1000).
             temperature (float, optional): Sampling temperature for text generation (default: 0).
-            printf (function, optional): Function to use for printing (default: print).
+            printf (optional): Output sink receiving the streamed tokens, or a print-like function
+                (default: the default sink of OutputSinkClass).
+            max_tool_workers (int, optional): Maximum number of tools run concurrently in a turn (default: 4).
+            tool_timeout (float, optional): Default timeout in seconds for each tool (default: None).
+            max_tool_rounds (int, optional): Maximum number of tool rounds per `chat` call (default: 5).
+            token_budget (int, optional): Total tokens after which no more tool rounds are started (default: None).
+            time_budget (float, optional): Seconds after which no more tool rounds are started (default: None).
+            memory (ConversationMemory, optional): Memory that trims the phrases sent in each request
+                (default: sliding window sized per model).
+            cache (ResponseCache, optional): Cache of completions and tool results (default: None).
+            assistants_cache_path (str, optional): File where resolved assistant IDs are persisted,
+                or None to always list the assistants (default: ~/.mygpt/assistants.json).
+            run_waiter (AssistantRunWaiter, optional): Waiter for assistant runs (default: AssistantRunWaiter()).
+            client (optional): OpenAI client (default: the client of the default ClientPool, shared by all
+                instances, with pooled connections and rate-limit scheduling).
+            tool_dispatcher (ToolDispatcher, optional): Dispatcher shared with other instances. When given,
+                `max_tool_workers`, `tool_timeout`, the tool results cache and its metrics are taken from it.
+            metrics (MetricsRecorder, optional): Recorder of the spans of model calls, tools, assistant
+                runs and image descriptions (default: None, records nothing).
+            conversation_store (ConversationStore, optional): Store of the conversation phrases, which may
+                persist and resume the session (default: in-memory store).
+            tool_registry (ToolRegistry, optional): Registry of the tools of this instance, which may send
+                only the tools relevant to each turn (default: ToolRegistry(), sends all tools).
+            run_manager (AssistantRunManager, optional): Manager of the assistant runs and of their threads
+                pool (default: AssistantRunManager() on this client and run waiter, reusing threads).
+            model_router (ModelRouter, optional): Router picking the model of each request from the prompt
+                size, the tools and the past latencies, and escalating or hedging it to a stronger model
+                (default: None, every request goes to `model`).
+            semantic_cache (SemanticCache, optional): Cache returning the answer of a previous similar
+                question instead of calling the model (default: None).
+            single_flight (SingleFlight, optional): Coalescer of identical deterministic completions and
+                image descriptions requested at the same moment (default: the SingleFlight shared by the process).
         """
         self.model = model
         self.max_tokens = max_tokens
         self.temperature = temperature
-        self.__conversation = []
+        self.max_tool_rounds = max_tool_rounds
+        self.token_budget = token_budget
+        self.time_budget = time_budget
+        self.__conversation = conversation_store or ConversationStoreClass.ConversationStore()
         self.__responses = []
         self.__usages = []
         self.__stream_content = None
-        self.__client = openai.Client()
+        self.__client = client or ClientPoolClass.get_default_pool().get_client()
         self.__assistant_name = assistant_name
-        self.__printf=printf
-        self.__available_tools = []
-        self.__available_tools_pointers = {}
-        self.__recover_assistants()
-        self.__add_code_interpreter_assistant(name=c.CODE_ASSISTANT_NAME, instructions=c.CODE_ASSISTANT_INSTRUCTIONS)
-        self.__add_thread()
+        self.__printf = OutputSinkClass.as_sink(printf)
+        self.__tools = tool_registry or ToolRegistryClass.ToolRegistry()
+        self.__metrics = metrics or MetricsRecorderClass.NullMetrics()
+        self.__tool_dispatcher = tool_dispatcher or ToolDispatcherClass.ToolDispatcher(
+            max_workers=max_tool_workers, timeout=tool_timeout, cache=cache, metrics=metrics)
+        self.__memory = memory or ConversationMemoryClass.ConversationMemory()
+        self.__cache = cache
+        self.__assistants_cache_path = assistants_cache_path
+        self.__code_interpreter_assistent = None
+        self.__assistant_lock = threading.Lock()
+        self.__assistant_run = None
+        self.__run_waiter = run_waiter or AssistantRunWaiterClass.AssistantRunWaiter()
+        self.__run_manager = run_manager or AssistantRunManagerClass.AssistantRunManager(self.__client,
+                                                                                        self.__run_waiter)
+        self.__router = model_router
+        self.__semantic_cache = semantic_cache
+        self.__single_flight = single_flight or SingleFlightClass.get_default_single_flight()
+        self.__core = ChatCoreClass.ChatCore(self, self.__conversation, self.__tools, self.__memory, self.__metrics,
+                                             cache=cache, router=model_router, semantic_cache=semantic_cache)
 
     def __recover_assistants(self):
         """
@@ -81,57 +152,170 @@ class MyGPT:
             )
             self.__code_interpreter_assistent = assistant.id
 
-    def __add_thread(self):
+    def __assistant_cache_key(self, name):
+        """
+        Builds the key of an assistant in the IDs cache file, scoped by API key.
+
+        Args:
+            name (str): Name of the assistant.
+
+        Returns:
+            str: Cache key.
         """
-        Creates a new thread for communication with the assistant.
+        fingerprint = hashlib.sha256((self.__client.api_key or '').encode('utf-8')).hexdigest()[:16]
+        return f'{fingerprint}:{name}'
+
+    def __resolve_code_interpreter_assistant(self, refresh=False):
+        """
+        Resolves the code interpreter assistant ID, from the IDs cache file when possible.
+
+        Args:
+            refresh (bool, optional): Whether to ignore the cached ID (default: False).
+        """
+        key = self.__assistant_cache_key(c.CODE_ASSISTANT_NAME)
+        assistant_id = None if refresh else af.load_assistant_ids(self.__assistants_cache_path).get(key)
+        if assistant_id:
+            self.__code_interpreter_assistent = assistant_id
+            return
+        self.__recover_assistants()
+        self.__add_code_interpreter_assistant(name=c.CODE_ASSISTANT_NAME, instructions=c.CODE_ASSISTANT_INSTRUCTIONS)
+        af.save_assistant_id(self.__assistants_cache_path, key, self.__code_interpreter_assistent)
+
+    def __refresh_code_interpreter_assistant(self):
+        """
+        Resolves the code interpreter assistant again, after the cached one was deleted.
+
+        Returns:
+            str: ID of the code interpreter assistant.
         """
-        thread = self.__client.beta.threads.create()
-        self.__assistant_thread = thread.id
+        with self.__assistant_lock:
+            self.__resolve_code_interpreter_assistant(refresh=True)
+            return self.__code_interpreter_assistent
 
-    def call_assistant(self, message_content, assistant_instructions=''):
+    def call_assistant(self, message_content, assistant_instructions='', stream=False):
         """
         Calls the assistant with a user message and optional instructions.
 
+        The assistant is resolved on the first call, so sessions that never use the assistant
+        make no Assistants API request. Each call starts a run on a thread of its own, so
+        many runs may be in progress at once.
+
         Args:
             message_content (str): Content of the user's message.
             assistant_instructions (str, optional): Instructions for the assistant.
+            stream (bool, optional): Whether to follow the run through the streaming API, when
+                the installed SDK supports it, instead of polling its status (default: False).
+
+        Returns:
+            AssistantRun: Handle of the new run, also kept as the current run.
         """
-        message = self.__client.beta.threads.messages.create(
-            thread_id=self.__assistant_thread,
-            role='user',
-            content=message_content
-        )
-        run = self.__client.beta.threads.runs.create(
-            thread_id=self.__assistant_thread,
-            assistant_id=self.__code_interpreter_assistent,
-            instructions=assistant_instructions
-        )
-        self.__assistant_thread_run = run.id
+        with self.__metrics.span('call_assistant', request_bytes=len(message_content)) as span:
+            with self.__assistant_lock:
+                if self.__code_interpreter_assistent is None:
+                    self.__resolve_code_interpreter_assistant()
+            stream = stream and hasattr(self.__client.beta.threads.runs, 'stream')
+            span.set(stream=stream)
+            run = self.__run_manager.start(self.__code_interpreter_assistent, message_content,
+                                           assistant_instructions, stream=stream,
+                                           refresh_assistant=self.__refresh_code_interpreter_assistant)
+            self.__assistant_run = run
+            return run
 
-    def check_assistant_status(self):
+    def wait_assistant_run(self, timeout=None, on_status=None, run=None):
         """
-        Checks the status of the current assistant run.
+        Waits for an assistant run to finish.
+
+        Streamed runs finish on their completion event; other runs are polled with
+        exponential backoff and jitter.
+
+        Args:
+            timeout (float, optional): Deadline in seconds (default: the run waiter timeout).
+            on_status (function, optional): Called with each new status of a polled run.
+            run (AssistantRun, optional): Run to wait for (default: the current run).
+
+        Returns:
+            str: Final status of the run.
+
+        Raises:
+            TimeoutError: If the run does not finish before the deadline.
+        """
+        run = run or self.__assistant_run
+        with self.__metrics.span('assistant_run', stream=run.future is not None) as span:
+            status = self.__run_manager.wait(run, timeout=timeout, on_status=on_status)
+            span.set(status=status)
+            return status
+
+    def wait_assistant_run_async(self, timeout=None, on_status=None, callback=None, run=None):
+        """
+        Waits for an assistant run in background.
+
+        Args:
+            timeout (float, optional): Deadline in seconds (default: the run waiter timeout).
+            on_status (function, optional): Called with each new status of a polled run.
+            callback (function, optional): Called with the future once the run finishes.
+            run (AssistantRun, optional): Run to wait for (default: the current run).
+
+        Returns:
+            Future: Future resolved with the final status of the run.
+        """
+        run = run or self.__assistant_run
+        if run.future is not None and timeout is None:
+            if callback:
+                run.future.add_done_callback(callback)
+            return run.future
+        return self.__run_waiter.submit(self.wait_assistant_run, timeout=timeout, on_status=on_status, run=run,
+                                        callback=callback)
+
+    def check_assistant_status(self, run=None):
+        """
+        Checks the status of an assistant run.
+
+        Args:
+            run (AssistantRun, optional): Run to check (default: the current run).
 
         Returns:
             str: Status of the assistant run.
         """
-        run = self.__client.beta.threads.runs.retrieve(
-            thread_id=self.__assistant_thread,
-            run_id=self.__assistant_thread_run
-        )
-        return run.status
+        return self.__run_manager.check_status(run or self.__assistant_run)
 
-    def get_assistant_result(self):
+    def get_assistant_result(self, run=None):
         """
-        Retrieves the result from the assistant after a call.
+        Retrieves the answer of an assistant run, by run ID.
+
+        Args:
+            run (AssistantRun, optional): Finished run (default: the current run).
 
         Returns:
             str: Content of the assistant's response.
         """
-        message = self.__client.beta.threads.messages.list(
-            thread_id=self.__assistant_thread
-        )
-        return message.data[0].content[0].text.value
+        return self.__run_manager.get_result(run or self.__assistant_run)
+
+    def get_assistant_run_manager(self):
+        """
+        Returns the AssistantRunManager that starts and tracks the assistant runs.
+
+        Returns:
+            AssistantRunManager: Manager of the assistant runs.
+        """
+        return self.__run_manager
+
+    def get_semantic_cache(self):
+        """
+        Returns the SemanticCache answering questions similar to previous ones.
+
+        Returns:
+            SemanticCache: Semantic cache, or None.
+        """
+        return self.__semantic_cache
+
+    def get_model_router(self):
+        """
+        Returns the ModelRouter that picks the model of each request.
+
+        Returns:
+            ModelRouter: Model router, or None when every request goes to `model`.
+        """
+        return self.__router
 
     def add_tool(self, name, registration_info):
         """
@@ -139,10 +323,27 @@ class MyGPT:
 
         Args:
             name (str): Name of the tool.
-            registration_info (dict): Registration information for the tool.
+            registration_info (dict): Registration information for the tool. An optional
+                'timeout' key overrides the default tool timeout, and an optional 'keywords' list is
+                used by the tool routing of the registry.
+
+        Raises:
+            ValueError: If the registration schema is not valid.
         """
-        self.__available_tools.append(registration_info['registration_info'])
-        self.__available_tools_pointers[name] = registration_info['func']
+        self.__tools.register(name, registration_info['registration_info'], registration_info['func'],
+                              keywords=registration_info.get('keywords'))
+        if 'timeout' in registration_info:
+            self.__tool_dispatcher.set_timeout(name, registration_info['timeout'])
+
+    def add_tools(self, *functions):
+        """
+        Adds functions decorated with `ToolRegistryClass.tool` as tools.
+
+        Args:
+            *functions: Decorated functions or bound methods.
+        """
+        for function in functions:
+            self.add_tool(function.tool_info['name'], {**function.tool_info, 'func': function})
 
     def set_attribute(self, att, value):
         """
@@ -198,61 +399,209 @@ class MyGPT:
                         {'url': path}}
                     ]
                 }],
-            'model': 'gpt-4o',
+            'model': self.__router.vision_model if self.__router else c.VISION_MODEL,
             'max_tokens': max_tokens or self.max_tokens,
             'temperature': temperature or self.temperature,
             'stream': asynchronous
         }
-        response = self.__client.chat.completions.create(**params)
+        with self.__metrics.span('image_description', model=params['model'],
+                                 request_bytes=len(path) + len(content)) as span:
+            if asynchronous:
+                response = self.__client.chat.completions.create(**params)
+            else:
+                response = self.__share_flight('image_description', params, self.__call_client)
+            self.__core.record_usage(span, response)
+        return response.choices[0].message.content
+
+    def __summarize(self, text):
+        """
+        Summarizes old conversation turns dropped by the memory strategy.
+
+        Args:
+            text (str): Rendered conversation turns, optionally with the previous summary.
+
+        Returns:
+            str: Summary of the turns.
+        """
+        response = self.__client.chat.completions.create(**self.__core.summary_params(text))
         return response.choices[0].message.content
 
     def talk_to_gpt(self, model=None, max_tokens=None, temperature=None, asynchronous=False):
         """
         Initiates a conversation with the GPT model.
 
+        Tool calls are resolved iteratively, one model round at a time. Once
+        `max_tool_rounds`, `token_budget` or `time_budget` is reached, the model is
+        asked for a final answer with `tool_choice='none'` instead of more tools.
+
         Args:
             model (str, optional): Model ID to use.
             max_tokens (int, optional): Maximum tokens for completion.
             temperature (float, optional): Sampling temperature.
-            asynchronous (bool, optional): Whether to stream the response.
+            asynchronous (bool, optional): Whether to stream the response. In this case the
+                `stream_chat` generator is returned.
 
         Returns:
-            str: Content of the GPT response.
+            ChatCompletion: Last GPT response.
         """
-        params = {
-            'messages': self.__conversation,
-            'model': model or self.model,
-            'max_tokens': max_tokens or self.max_tokens,
-            'temperature': temperature or self.temperature,
-            'stream': asynchronous
-        }
-        if len(self.__available_tools) > 0:
-            params['tools'] = self.__available_tools
-            params['tool_choice'] = "auto"
-        response = self.__client.chat.completions.create(**params)
-        self.add_phrase(phrase=response.choices[0].message.model_dump(exclude_none=True))
-        tool_calls = None
-        try:
-            tool_calls = response.choices[0].message.tool_calls
-        except:
-            pass
-
-        if tool_calls:
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_to_call = self.__available_tools_pointers[function_name]
-                function_args = json.loads(tool_call.function.arguments)
-                function_response = function_to_call(**function_args)
-                phrase = {
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": function_response,
-                }
-                self.add_phrase(phrase=phrase)
-            response = self.talk_to_gpt(model=model, max_tokens=max_tokens, temperature=temperature, asynchronous=asynchronous)
+        if asynchronous:
+            return self.stream_chat(model=model, max_tokens=max_tokens, temperature=temperature)
+        with self.__metrics.span('talk_to_gpt', model=model or self.model) as span:
+            response = self.__drive(self.__core.talk_rounds(model, max_tokens, temperature))
+            span.set(rounds=len(self.__core.round_timings),
+                     total_tokens=sum(timing['total_tokens'] for timing in self.__core.round_timings))
+            return response
+
+    def __call_client(self, params):
+        return self.__client.chat.completions.create(**params)
+
+    def __call_model(self, params):
+        """
+        Requests a chat completion, through the model router when there is one.
+        """
+        if self.__router:
+            return self.__router.request(self.__client.chat.completions.create, params)
+        return self.__call_client(params)
+
+    def __share_flight(self, kind, params, call_model):
+        """
+        Requests a completion, or waits for the identical request in flight.
+
+        Args:
+            kind (str): Kind of the request ('chat_completion' or 'image_description').
+            params (dict): Parameters of `chat.completions.create`.
+            call_model (function): Requests the completion from the parameters.
+
+        Returns:
+            ChatCompletion: GPT response.
+        """
+        response, shared = self.__single_flight.do(kind, SingleFlightClass.request_key(params), call_model, params)
+        if shared:
+            self.__metrics.increment('coalesced_requests', kind=kind, model=params['model'])
         return response
 
+    def __run_step(self, step, argument):
+        """
+        Performs a step of the rounds of a call, other than streaming.
+
+        Args:
+            step (str): Kind of the step, one of the ChatCoreClass steps.
+            argument: Argument of the step.
+
+        Returns:
+            Result of the step.
+        """
+        if step == ChatCoreClass.BUILD_PARAMS:
+            return self.__core.build_params(**argument, summarize=self.__summarize)
+        if step == ChatCoreClass.COMPLETION:
+            return self.__call_model(argument)
+        if step == ChatCoreClass.SHARED_COMPLETION:
+            return self.__share_flight('chat_completion', argument, self.__call_model)
+        if step == ChatCoreClass.TOOLS:
+            # The notices of the tools go to the sink of this instance
+            with OutputSinkClass.using_sink(self.__printf):
+                return self.__tool_dispatcher.dispatch(argument, self.__tools.get_functions(),
+                                                       self.__tools.get_validators())
+        if step == ChatCoreClass.LOOKUP:
+            query = self.__semantic_cache.query(**argument)
+            return query, self.__semantic_cache.get(query) if query else None
+        if step == ChatCoreClass.STORE:
+            query, content, tools = argument
+            return self.__semantic_cache.set(query, content, tools=tools)
+        raise ValueError(f'Unknown step: {step}')
+
+    def __drive(self, steps):
+        """
+        Performs the steps of the rounds of a call until they return.
+
+        Errors of a step are raised inside the rounds, so their spans record them.
+
+        Args:
+            steps (generator): Rounds of the call, from ChatCore.
+
+        Returns:
+            Value returned by the rounds.
+        """
+        send, value = steps.send, None
+        while True:
+            try:
+                step, argument = send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                send, value = steps.send, self.__run_step(step, argument)
+            except Exception as error:
+                send, value = steps.throw, error
+
+    def stream_chat(self, model=None, max_tokens=None, temperature=None):
+        """
+        Streams a chat session with GPT, yielding the text tokens as they arrive.
+
+        Streamed tool calls are reassembled, run and the stream is resumed with their
+        results, following the same round and budget limits as `talk_to_gpt`. Streamed
+        responses carry no usage, so tokens are counted locally.
+
+        Args:
+            model (str, optional): Model ID to use.
+            max_tokens (int, optional): Maximum tokens for completion.
+            temperature (float, optional): Sampling temperature.
+
+        Yields:
+            str: Text tokens of the response.
+        """
+        steps = self.__core.stream_rounds(model, max_tokens, temperature)
+        send, value = steps.send, None
+        while True:
+            try:
+                step, argument = send(value)
+            except StopIteration as stop:
+                self.__responses.append(stop.value)
+                return
+            send, value = steps.send, None
+            try:
+                if step == ChatCoreClass.TEXT:
+                    yield argument
+                elif step == ChatCoreClass.STREAM:
+                    for chunk in self.__client.chat.completions.create(**argument):
+                        text = self.__core.add_chunk(chunk)
+                        if text:
+                            yield text
+                else:
+                    value = self.__run_step(step, argument)
+            except Exception as error:
+                send, value = steps.throw, error
+
+    def get_time_to_first_token(self):
+        """
+        Returns the time to the first token of the last streamed call, the latency seen by users.
+
+        Returns:
+            float: Seconds from the call to the first text token, or None if no token was streamed.
+        """
+        return self.__core.time_to_first_token
+
+    def get_metrics(self):
+        """
+        Returns the recorder of the spans of this instance.
+
+        Returns:
+            MetricsRecorder: Metrics recorder, or a NullMetrics if none was given.
+        """
+        return self.__metrics
+
+    def get_round_timings(self):
+        """
+        Returns the timings of each model round of the last `talk_to_gpt` call.
+
+        Each entry holds the round number, the seconds spent waiting for the model
+        ('model_time') and running its tools ('tools_time'), the names of the tools
+        called and the total tokens of the round.
+
+        Returns:
+            list: List of round timings.
+        """
+        return self.__core.round_timings
+
     def chat(self, model=None, max_tokens=None, temperature=None, asynchronous=False):
         """
         Runs a chat session using GPT.
@@ -266,29 +615,67 @@ class MyGPT:
         Returns:
             str: Content of the GPT response.
         """
-        response = self.talk_to_gpt(model=model, max_tokens=max_tokens, temperature=temperature, asynchronous=asynchronous)
-        if not asynchronous:
-            response_content = response.choices[0].message.content
-            usage = {
-                'completion_tokens': response.usage.completion_tokens,
-                'prompt_tokens': response.usage.prompt_tokens,
-                'total_tokens': response.usage.total_tokens
-            }
-            self.__usages.append(usage)
-            self.__responses.append(response_content)
-            # self.__printf(f"{self.__assistant_name or self.__conversation[-1]['role']}: {self.__conversation[-1]['content']}")
-        else:
-            self.__stream_content = response
+        if asynchronous:
+            self.__stream_content = self.stream_chat(model=model, max_tokens=max_tokens, temperature=temperature)
             self.print_stream()
-        return response.choices[0].message.content
+            return self.__responses[-1]
+        response = self.talk_to_gpt(model=model, max_tokens=max_tokens, temperature=temperature)
+        response_content = response.choices[0].message.content
+        usage = {
+            'completion_tokens': response.usage.completion_tokens,
+            'prompt_tokens': response.usage.prompt_tokens,
+            'total_tokens': response.usage.total_tokens
+        }
+        self.__usages.append(usage)
+        self.__responses.append(response_content)
+        # self.__printf(f"{self.__assistant_name or self.__conversation[-1]['role']}: {self.__conversation[-1]['content']}")
+        return response_content
+
+    def get_output(self):
+        """
+        Returns the sink receiving the streamed tokens.
+
+        Returns:
+            Output sink.
+        """
+        return self.__printf
+
+    def get_memory(self):
+        """
+        Returns the conversation memory that trims each request.
+
+        Returns:
+            ConversationMemory: Conversation memory.
+        """
+        return self.__memory
 
     def get_conversation(self):
         """
-        Returns the entire conversation history.
+        Returns the conversation history kept in memory.
+
+        Turns paged out by the conversation store are read with its `get_history` method.
 
         Returns:
             list: List of conversation objects.
         """
+        return self.__conversation.get_messages()
+
+    def get_tool_registry(self):
+        """
+        Returns the registry of the tools of this instance.
+
+        Returns:
+            ToolRegistry: Tool registry.
+        """
+        return self.__tools
+
+    def get_conversation_store(self):
+        """
+        Returns the store of the conversation phrases.
+
+        Returns:
+            ConversationStore: Conversation store.
+        """
         return self.__conversation
 
     def get_responses(self):
@@ -313,18 +700,21 @@ class MyGPT:
         """
         Resets the conversation history.
         """
-        self.__conversation = []
+        self.__conversation.reset()
         self.__responses = []
+        self.__memory.reset()
 
     def print_stream(self):
         """
-        Prints the streamed content from an asynchronous chat session.
+        Emits the streamed content from an asynchronous chat session to the output sink.
+
+        Each token is emitted as a 'token' event and the whole answer as a 'stream_end'
+        event, so sinks may render the tokens as they come or only the final answer.
+        The phrases are added to the conversation by `stream_chat` while it is consumed.
         """
-        full_text = ''
-        print('')
-        for chunk in self.__stream_content:
-            text = chunk.choices[0].delta.content or ""
-            full_text += text
-            self.__printf(text, end='')
-        self.add_phrase(role='assistant', content=full_text)
-        self.__printf('')
+        emit = self.__printf.emit
+        chunks = []
+        for text in self.__stream_content:
+            chunks.append(text)
+            emit(OutputSinkClass.TOKEN, text, bot=self.__assistant_name)
+        emit(OutputSinkClass.STREAM_END, ''.join(chunks), bot=self.__assistant_name)
@@ -0,0 +1,431 @@
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextlib
+import contextvars
+from termcolor import colored
+
+# Kinds of the events emitted by the bots
+ASSISTANT = 'assistant'
+WARN = 'warn'
+STATUS = 'status'
+TOKEN = 'token'
+STREAM_END = 'stream_end'
+
+# Console color of each kind of event
+COLORS = {ASSISTANT: 'blue', WARN: 'red', STATUS: 'blue', TOKEN: 'blue', STREAM_END: 'blue'}
+
+class OutputEvent:
+    """
+    Single piece of output, as an answer, a notice or a streamed token.
+
+    Attributes:
+        kind (str): Kind of the event ('assistant', 'warn', 'status', 'token' or 'stream_end').
+        text (str): Text of the event. For 'stream_end', the whole streamed answer.
+        fields (dict): Structured fields of the event, as the bot name.
+        time (float): Time of the event, in seconds since the epoch.
+    """
+    __slots__ = ('kind', 'text', 'fields', 'time')
+
+    def __init__(self, kind, text='', fields=None):
+        self.kind = kind
+        self.text = text
+        self.fields = fields or {}
+        self.time = time.time()
+
+def render(event, colors=COLORS):
+    """
+    Renders an event as console text.
+
+    Tokens are rendered without a line break, so a streamed answer stays on its line,
+    and the end of a stream only breaks the line.
+
+    Args:
+        event (OutputEvent): Event to render.
+        colors (dict, optional): Console color of each kind of event (default: COLORS).
+
+    Returns:
+        str: Text to write.
+    """
+    if event.kind == STREAM_END:
+        return '\n'
+    text = colored(event.text, colors[event.kind]) if colors and event.kind in colors else event.text
+    return text if event.kind == TOKEN else text + '\n'
+
+class ConsoleSink:
+    """
+    Writes each event to the console as it is emitted.
+
+    Streamed tokens are flushed at most once every `flush_interval` seconds instead of
+    one by one; the other events are flushed right away.
+
+    Attributes:
+        colors (dict): Console color of each kind of event, or None for plain text.
+        flush_interval (float): Minimum seconds between two flushes of streamed tokens.
+        __stream: Text stream written to, or None for the current `sys.stdout`.
+        __flushed (float): Time of the last flush.
+        __lock: Lock keeping the events of concurrent threads apart.
+    """
+
+    def __init__(self, stream=None, colors=COLORS, flush_interval=0.05):
+        """
+        Initializes an instance of the ConsoleSink class.
+
+        Args:
+            stream (optional): Text stream written to (default: the current `sys.stdout`).
+            colors (dict, optional): Console color of each kind of event, or None for plain text (default: COLORS).
+            flush_interval (float, optional): Minimum seconds between two flushes of streamed tokens (default: 0.05).
+        """
+        self.colors = colors
+        self.flush_interval = flush_interval
+        self.__stream = stream
+        self.__flushed = 0.0
+        self.__lock = threading.Lock()
+
+    def emit(self, kind, text='', **fields):
+        """
+        Writes an event.
+
+        Args:
+            kind (str): Kind of the event.
+            text (str, optional): Text of the event.
+            **fields: Structured fields of the event.
+        """
+        stream = self.__stream or sys.stdout
+        with self.__lock:
+            stream.write(render(OutputEvent(kind, text, fields), self.colors))
+            now = time.monotonic()
+            if kind != TOKEN or now - self.__flushed >= self.flush_interval:
+                stream.flush()
+                self.__flushed = now
+
+    def flush(self):
+        """
+        Flushes the console.
+        """
+        (self.__stream or sys.stdout).flush()
+
+    def close(self):
+        """
+        Flushes the console.
+        """
+        self.flush()
+
+class BufferedConsoleSink:
+    """
+    Writes the events to the console from a background thread.
+
+    Emitting only queues the event, so the request path never waits on the terminal.
+    The writer thread drains every queued event at once and writes them with a single
+    write and flush, so streamed tokens are rendered in batches instead of one by one.
+    Queued events are flushed at exit.
+
+    Attributes:
+        colors (dict): Console color of each kind of event, or None for plain text.
+        __stream: Text stream written to, or None for the current `sys.stdout`.
+        __queue: Events waiting to be written.
+        __thread: Writer thread, started on the first event.
+        __lock: Lock protecting the start and stop of the writer thread.
+    """
+
+    def __init__(self, stream=None, colors=COLORS):
+        """
+        Initializes an instance of the BufferedConsoleSink class.
+
+        Args:
+            stream (optional): Text stream written to (default: the current `sys.stdout`).
+            colors (dict, optional): Console color of each kind of event, or None for plain text (default: COLORS).
+        """
+        self.colors = colors
+        self.__stream = stream
+        self.__queue = queue.SimpleQueue()
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def __start(self):
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__write, name='mygpt-output', daemon=True)
+                self.__thread.start()
+                atexit.register(self.close)
+
+    def __write(self):
+        """
+        Writes the queued events until the sink is closed.
+        """
+        closing = False
+        while not closing:
+            items = [self.__queue.get()]
+            while True:
+                try:
+                    items.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            chunks, flushed = [], []
+            for item in items:
+                if item is None:
+                    closing = True
+                elif isinstance(item, OutputEvent):
+                    chunks.append(render(item, self.colors))
+                else:
+                    flushed.append(item)
+            stream = self.__stream or sys.stdout
+            if chunks:
+                stream.write(''.join(chunks))
+            stream.flush()
+            for done in flushed:
+                done.set()
+
+    def emit(self, kind, text='', **fields):
+        """
+        Queues an event to be written.
+
+        Args:
+            kind (str): Kind of the event.
+            text (str, optional): Text of the event.
+            **fields: Structured fields of the event.
+        """
+        if self.__thread is None:
+            self.__start()
+        self.__queue.put(OutputEvent(kind, text, fields))
+
+    def flush(self, timeout=None):
+        """
+        Waits until the events queued so far are written.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait (default: None, waits until written).
+
+        Returns:
+            bool: True if the events were written before the timeout.
+        """
+        if self.__thread is None:
+            return True
+        done = threading.Event()
+        self.__queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Writes the queued events and stops the writer thread. A later event starts it again.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait for the writer thread (default: None).
+        """
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+        if thread is not None:
+            self.__queue.put(None)
+            thread.join(timeout)
+            atexit.unregister(self.close)
+
+class LoggingSink:
+    """
+    Sends the events to a logger as structured records.
+
+    The kind and the fields of each event go in the `extra` of its record, as the
+    `event` attribute and their own attributes. Tokens are not logged one by one: the
+    whole streamed answer is logged once its stream ends.
+
+    Attributes:
+        logger: Logger receiving the records.
+        levels (dict): Logging level of each kind of event.
+    """
+
+    def __init__(self, logger=None, levels=None):
+        """
+        Initializes an instance of the LoggingSink class.
+
+        Args:
+            logger (optional): Logger receiving the records (default: the 'MyGPT' logger).
+            levels (dict, optional): Logging level of each kind of event (default: INFO for all).
+        """
+        self.logger = logger or logging.getLogger('MyGPT')
+        self.levels = levels or {}
+
+    def emit(self, kind, text='', **fields):
+        """
+        Logs an event.
+
+        Args:
+            kind (str): Kind of the event.
+            text (str, optional): Text of the event.
+            **fields: Structured fields of the event.
+        """
+        if kind == TOKEN:
+            return
+        level = self.levels.get(kind, logging.INFO)
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, text, extra={'event': kind, **fields})
+
+    def flush(self):
+        """
+        Flushes the handlers of the logger.
+        """
+        for handler in self.logger.handlers:
+            handler.flush()
+
+    def close(self):
+        """
+        Flushes the handlers of the logger.
+        """
+        self.flush()
+
+class CallbackSink:
+    """
+    Hands every event to a function, as a UI or a websocket would need.
+
+    Attributes:
+        callback (function): Called with each OutputEvent.
+    """
+
+    def __init__(self, callback):
+        """
+        Initializes an instance of the CallbackSink class.
+
+        Args:
+            callback (function): Called with each OutputEvent.
+        """
+        self.callback = callback
+
+    def emit(self, kind, text='', **fields):
+        """
+        Hands an event to the callback.
+
+        Args:
+            kind (str): Kind of the event.
+            text (str, optional): Text of the event.
+            **fields: Structured fields of the event.
+        """
+        self.callback(OutputEvent(kind, text, fields))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class PrintfSink:
+    """
+    Adapts a print-like function, as `print`, to the sink interface.
+
+    Attributes:
+        printf (function): Called with the text of each event and its `end`.
+    """
+
+    def __init__(self, printf):
+        """
+        Initializes an instance of the PrintfSink class.
+
+        Args:
+            printf (function): Print-like function, accepting the `end` keyword.
+        """
+        self.printf = printf
+
+    def emit(self, kind, text='', **fields):
+        """
+        Prints an event.
+
+        Args:
+            kind (str): Kind of the event.
+            text (str, optional): Text of the event.
+            **fields: Structured fields of the event.
+        """
+        if kind == STREAM_END:
+            self.printf('')
+        else:
+            self.printf(text, end='' if kind == TOKEN else '\n')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class NullSink:
+    """
+    Drops every event, for servers and benchmarks.
+    """
+
+    def emit(self, kind, text='', **fields):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def as_sink(output):
+    """
+    Returns the sink of an output argument.
+
+    Args:
+        output: Sink, print-like function, or None for the default sink.
+
+    Returns:
+        Sink with `emit`, `flush` and `close` methods.
+    """
+    if output is None:
+        return get_default_sink()
+    if hasattr(output, 'emit'):
+        return output
+    return PrintfSink(output)
+
+_default_sink = None
+_default_sink_lock = threading.Lock()
+# Sink of the bot running in the current thread or task, for the notices of its tools
+_current_sink = contextvars.ContextVar('mygpt_output_sink', default=None)
+
+def get_default_sink():
+    """
+    Returns the sink shared by the instances created without one.
+
+    Returns:
+        Default sink, a ConsoleSink unless replaced.
+    """
+    global _default_sink
+    with _default_sink_lock:
+        if _default_sink is None:
+            _default_sink = ConsoleSink()
+        return _default_sink
+
+def set_default_sink(sink):
+    """
+    Replaces the sink shared by the instances created without one.
+
+    Args:
+        sink: New default sink.
+    """
+    global _default_sink
+    with _default_sink_lock:
+        _default_sink = sink
+
+def get_current_sink():
+    """
+    Returns the sink of the bot running in the current thread or task.
+
+    Tools write their notices here, so they reach the sink of the bot that called them
+    instead of the process default.
+
+    Returns:
+        Sink set with `using_sink`, or the default sink.
+    """
+    return _current_sink.get() or get_default_sink()
+
+@contextlib.contextmanager
+def using_sink(sink):
+    """
+    Sets the sink returned by `get_current_sink` inside the block, in the current thread or task.
+
+    Args:
+        sink: Sink of the bot.
+    """
+    token = _current_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _current_sink.reset(token)
@@ -0,0 +1,307 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class MemoryCacheBackend:
+    """
+    In-memory cache backend with LRU eviction and per-entry expiration.
+
+    Attributes:
+        max_entries (int): Maximum number of entries kept.
+        __entries (OrderedDict): Mapping of keys to (value, expiration) pairs, oldest first.
+        __lock: Lock protecting the entries.
+    """
+
+    def __init__(self, max_entries=1024):
+        """
+        Initializes an instance of the MemoryCacheBackend class.
+
+        Args:
+            max_entries (int, optional): Maximum number of entries kept (default: 1024).
+        """
+        self.max_entries = max_entries
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns a cached value.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            str: Cached value or None if missing or expired.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self.__entries[key]
+                return None
+            self.__entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value, evicting the least recently used entries when full.
+
+        Args:
+            key (str): Cache key.
+            value (str): Value to store.
+            ttl (float, optional): Seconds until the entry expires (None never expires).
+        """
+        with self.__lock:
+            self.__entries[key] = (value, None if ttl is None else time.time() + ttl)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+class SqliteCacheBackend:
+    """
+    On-disk cache backend stored in a SQLite database, shared between processes.
+
+    Attributes:
+        path (str): Path of the database file.
+        max_entries (int): Maximum number of entries kept.
+        __connection: SQLite connection.
+        __lock: Lock serializing the access to the connection.
+    """
+
+    def __init__(self, path='mygpt_cache.sqlite', max_entries=100000):
+        """
+        Initializes an instance of the SqliteCacheBackend class.
+
+        Args:
+            path (str, optional): Path of the database file (default: 'mygpt_cache.sqlite').
+            max_entries (int, optional): Maximum number of entries kept (default: 100000).
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)'
+            )
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+
+    def get(self, key):
+        """
+        Returns a cached value.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            str: Cached value or None if missing or expired.
+        """
+        now = time.time()
+        with self.__lock, self.__connection:
+            row = self.__connection.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] < now:
+                self.__connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+                return None
+            self.__connection.execute('UPDATE cache SET used = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value, evicting the least recently used entries when full.
+
+        Args:
+            key (str): Cache key.
+            value (str): Value to store.
+            ttl (float, optional): Seconds until the entry expires (None never expires).
+        """
+        now = time.time()
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)',
+                (key, value, None if ttl is None else now + ttl, now)
+            )
+            self.__connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM cache')
+
+class ResponseCache:
+    """
+    Caches chat completions and tool results keyed on the normalized request.
+
+    Completions are only cached for deterministic requests (temperature 0) that are
+    not streamed. Tools are only cached when a TTL is configured for them, since most
+    of them (as the math assistant) must run every time.
+
+    Attributes:
+        backend: Storage backend (MemoryCacheBackend by default).
+        ttl (float): Seconds until a cached completion expires (None never expires).
+        tool_ttls (dict): Mapping of cacheable tool names to their TTL in seconds.
+        deterministic_only (bool): Whether only temperature 0 completions are cached.
+        __stats (dict): Hit and miss counters.
+        __lock: Lock protecting the counters.
+    """
+
+    def __init__(self, backend=None, ttl=None, tool_ttls=None, deterministic_only=True):
+        """
+        Initializes an instance of the ResponseCache class.
+
+        Args:
+            backend (optional): Storage backend (default: MemoryCacheBackend()).
+            ttl (float, optional): Seconds until a cached completion expires (default: None).
+            tool_ttls (dict, optional): Mapping of cacheable tool names to their TTL (default: {}).
+            deterministic_only (bool, optional): Whether only temperature 0 completions are cached (default: True).
+        """
+        self.backend = backend or MemoryCacheBackend()
+        self.ttl = ttl
+        self.tool_ttls = tool_ttls or {}
+        self.deterministic_only = deterministic_only
+        self.__stats = {'completion_hits': 0, 'completion_misses': 0, 'tool_hits': 0, 'tool_misses': 0}
+        self.__lock = threading.Lock()
+
+    def __count(self, stat):
+        with self.__lock:
+            self.__stats[stat] += 1
+
+    def __digest(self, kind, payload):
+        """
+        Builds a cache key from a JSON serializable payload.
+
+        Args:
+            kind (str): Kind of the entry ('completion' or 'tool').
+            payload: Normalized request.
+
+        Returns:
+            str: Cache key.
+        """
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return f"{kind}:{hashlib.sha256(encoded.encode('utf-8')).hexdigest()}"
+
+    def is_cacheable(self, params):
+        """
+        Checks whether a completion request can be cached.
+
+        Args:
+            params (dict): Parameters of `chat.completions.create`.
+
+        Returns:
+            bool: True if the request is not streamed and, when required, deterministic.
+        """
+        if params.get('stream'):
+            return False
+        return not self.deterministic_only or not params.get('temperature')
+
+    def completion_key(self, params):
+        """
+        Builds the cache key of a completion request.
+
+        Args:
+            params (dict): Parameters of `chat.completions.create`.
+
+        Returns:
+            str: Cache key.
+        """
+        keys = ('messages', 'model', 'temperature', 'max_tokens', 'tools', 'tool_choice')
+        return self.__digest('completion', {k: params.get(k) for k in keys})
+
+    def get_completion(self, params):
+        """
+        Returns a cached completion for the request.
+
+        Args:
+            params (dict): Parameters of `chat.completions.create`.
+
+        Returns:
+            ChatCompletion: Cached completion or None.
+        """
+        if not self.is_cacheable(params):
+            return None
+        value = self.backend.get(self.completion_key(params))
+        if value is None:
+            self.__count('completion_misses')
+            return None
+        self.__count('completion_hits')
+        from openai.types.chat import ChatCompletion
+
+        return ChatCompletion.model_validate_json(value)
+
+    def set_completion(self, params, response):
+        """
+        Stores the completion of a request.
+
+        Args:
+            params (dict): Parameters of `chat.completions.create`.
+            response (ChatCompletion): Completion returned by OpenAI.
+        """
+        if self.is_cacheable(params):
+            self.backend.set(self.completion_key(params), response.model_dump_json(), ttl=self.ttl)
+
+    def get_tool(self, name, args):
+        """
+        Returns the cached result of a tool call.
+
+        Args:
+            name (str): Name of the tool.
+            args (dict): Arguments of the call.
+
+        Returns:
+            str: Cached result or None.
+        """
+        if name not in self.tool_ttls:
+            return None
+        value = self.backend.get(self.__digest('tool', [name, args]))
+        if value is None:
+            self.__count('tool_misses')
+            return None
+        self.__count('tool_hits')
+        return json.loads(value)
+
+    def set_tool(self, name, args, content):
+        """
+        Stores the result of a tool call, if the tool is cacheable.
+
+        Args:
+            name (str): Name of the tool.
+            args (dict): Arguments of the call.
+            content: Result of the tool.
+        """
+        if name in self.tool_ttls:
+            self.backend.set(self.__digest('tool', [name, args]), json.dumps(content), ttl=self.tool_ttls[name])
+
+    def get_stats(self):
+        """
+        Returns the hit and miss counters.
+
+        Returns:
+            dict: Counters of completion and tool hits and misses.
+        """
+        with self.__lock:
+            return dict(self.__stats)
+
+    def clear(self):
+        """
+        Removes all cached entries.
+        """
+        self.backend.clear()
@@ -0,0 +1,629 @@
+import os
+import re
+import json
+import asyncio
+import time
+import zlib
+import hashlib
+import threading
+
+import numpy as np
+
+from MyGPT import gpt_constants as c
+from MyGPT import ClientPoolClass
+from MyGPT import ToolRegistryClass
+
+def cached_completion(content, model):
+    """
+    Builds the chat completion returned for a cached answer, with no token usage.
+
+    Args:
+        content (str): Cached answer.
+        model (str): Model reported in the completion.
+
+    Returns:
+        ChatCompletion: Completion holding the answer.
+    """
+    from openai.types.chat import ChatCompletion
+
+    return ChatCompletion.model_validate({
+        'id': 'chatcmpl-semantic-cache', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+    })
+
+# Terms that must match exactly between similar questions: paths, URLs and file names,
+# numbers with the arithmetic between them, and tickers as PETR4 or PETR4.SA
+KEY_TERMS = re.compile(r"""
+    \S*[/\\]\S* | [\w-]+\.(?:png|jpe?g|gif|webp|bmp|csv|json|txt|pdf)\b
+    | \d[\d.,]*(?:\s*[-+*/^%=x×÷]\s*\d[\d.,]*)*
+    | [^\W\d_]+\d\w*(?:\.[^\W\d_]+)?
+""", re.VERBOSE | re.IGNORECASE)
+
+def key_terms(text):
+    """
+    Extracts the terms of a text that must match exactly for two questions to share an answer.
+
+    Embeddings place "Quanto é 2+2?" and "Quanto é 3+5?", or the same question about two
+    tickers or two image files, close together, although their answers differ.
+
+    Args:
+        text (str): Text of the question.
+
+    Returns:
+        list: Sorted lowercase terms, without spaces.
+    """
+    return sorted({re.sub(r'\s+', '', match.group()).rstrip('.,?!;:').lower() for match in KEY_TERMS.finditer(text)})
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class HashingEmbedder:
+    """
+    Local embedder hashing the words, word pairs and character n-grams of a text.
+
+    Texts are normalized as the tool keywords (lowercase, no accents), so near-duplicate
+    questions that differ in accents, inflections or a few words stay close. It makes no
+    network call and its vectors are stable between processes.
+
+    Attributes:
+        dim (int): Size of the vectors.
+        ngram (int): Size of the character n-grams.
+    """
+
+    def __init__(self, dim=512, ngram=3):
+        """
+        Initializes an instance of the HashingEmbedder class.
+
+        Args:
+            dim (int, optional): Size of the vectors (default: 512).
+            ngram (int, optional): Size of the character n-grams (default: 3).
+        """
+        self.dim = dim
+        self.ngram = ngram
+
+    def __add(self, vector, feature, weight):
+        code = zlib.crc32(feature.encode('utf-8'))
+        vector[code % self.dim] += weight if code & 0x80000000 else -weight
+
+    def embed(self, text):
+        """
+        Embeds a text.
+
+        Args:
+            text (str): Text to embed.
+
+        Returns:
+            ndarray: Unit vector of the text.
+        """
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = [word for word in ToolRegistryClass.normalize_words(text) if len(word) > 2]
+        for word in words:
+            self.__add(vector, word, 1.0)
+            padded = f'#{word}#'
+            for start in range(len(padded) - self.ngram + 1):
+                self.__add(vector, padded[start:start + self.ngram], 0.5)
+        for first, second in zip(words, words[1:]):
+            self.__add(vector, f'{first} {second}', 0.5)
+        return _unit(vector)
+
+class OpenAIEmbedder:
+    """
+    Embedder calling the OpenAI embeddings API.
+
+    Attributes:
+        model (str): Embedding model.
+        __client: OpenAI client, taken from the default ClientPool on first use when not given.
+    """
+
+    def __init__(self, client=None, model=c.EMBEDDING_MODEL):
+        """
+        Initializes an instance of the OpenAIEmbedder class.
+
+        Args:
+            client (optional): Synchronous OpenAI client (default: the client of the default ClientPool).
+            model (str, optional): Embedding model (default: 'text-embedding-3-small').
+        """
+        self.model = model
+        self.__client = client
+
+    def embed(self, text):
+        """
+        Embeds a text.
+
+        Args:
+            text (str): Text to embed.
+
+        Returns:
+            ndarray: Unit vector of the text.
+        """
+        if self.__client is None:
+            self.__client = ClientPoolClass.get_default_pool().get_client()
+        response = self.__client.embeddings.create(model=self.model, input=text)
+        return _unit(np.asarray(response.data[0].embedding, dtype=np.float32))
+
+class VectorIndex:
+    """
+    Index of unit vectors searched by cosine similarity.
+
+    Vectors are compared by brute force with a single matrix product. With `lsh_bits`,
+    random hyperplanes split the vectors in buckets and only the vectors sharing a bucket
+    with the query in one of the `lsh_tables` tables are compared, which may miss a few
+    matches on large indexes. Saved vectors are memory mapped when loaded, so only the
+    pages touched by the searches are read; new vectors are kept in memory until saved.
+
+    Attributes:
+        lsh_bits (int): Hyperplanes of each LSH table, or None to search by brute force.
+        lsh_tables (int): Number of LSH tables.
+        seed (int): Seed of the hyperplanes, so saved indexes keep their buckets.
+        __base: Saved vectors, memory mapped, or None.
+        __tail: Vectors added since the index was loaded, with spare rows.
+        __tail_size (int): Rows of `__tail` in use.
+        __alive: Mask of the rows not removed, with spare rows.
+        __planes: Hyperplanes of the LSH tables, created with the first vector.
+        __buckets (list): Mapping of bucket keys to rows, per LSH table.
+    """
+
+    def __init__(self, lsh_bits=None, lsh_tables=4, seed=0):
+        """
+        Initializes an instance of the VectorIndex class.
+
+        Args:
+            lsh_bits (int, optional): Hyperplanes of each LSH table (default: None, brute force).
+            lsh_tables (int, optional): Number of LSH tables (default: 4).
+            seed (int, optional): Seed of the hyperplanes (default: 0).
+        """
+        self.lsh_bits = lsh_bits
+        self.lsh_tables = lsh_tables
+        self.seed = seed
+        self.__base = None
+        self.__tail = None
+        self.__tail_size = 0
+        self.__alive = np.zeros(0, dtype=bool)
+        self.__planes = None
+        self.__buckets = [{} for _ in range(lsh_tables)]
+
+    def size(self):
+        """
+        Returns the number of rows, including the removed ones until the index is compacted.
+
+        Returns:
+            int: Number of rows.
+        """
+        return (0 if self.__base is None else len(self.__base)) + self.__tail_size
+
+    def __bucket_keys(self, vectors):
+        """
+        Returns the bucket keys of vectors in each LSH table, as an array (tables, vectors).
+        """
+        bits = np.einsum('tbd,nd->tnb', self.__planes, vectors) > 0
+        return bits.dot(1 << np.arange(self.lsh_bits, dtype=np.int64))
+
+    def __index_rows(self, vectors, first_row):
+        if self.lsh_bits is None or not len(vectors):
+            return
+        if self.__planes is None:
+            rng = np.random.default_rng(self.seed)
+            self.__planes = rng.standard_normal((self.lsh_tables, self.lsh_bits, vectors.shape[1])).astype(np.float32)
+        for table, keys in zip(self.__buckets, self.__bucket_keys(vectors)):
+            for offset, key in enumerate(keys.tolist()):
+                table.setdefault(key, []).append(first_row + offset)
+
+    def add(self, vector):
+        """
+        Adds a vector.
+
+        Args:
+            vector (ndarray): Unit vector.
+
+        Returns:
+            int: Row of the vector.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.__tail is None:
+            self.__tail = np.zeros((16, len(vector)), dtype=np.float32)
+        elif self.__tail_size == len(self.__tail):
+            self.__tail = np.concatenate([self.__tail, np.zeros_like(self.__tail)])
+        row = self.size()
+        if row == len(self.__alive):
+            self.__alive = np.concatenate([self.__alive, np.zeros(max(16, row), dtype=bool)])
+        self.__tail[self.__tail_size] = vector
+        self.__tail_size += 1
+        self.__alive[row] = True
+        self.__index_rows(vector[None, :], row)
+        return row
+
+    def remove(self, row):
+        """
+        Removes a row from the search results.
+
+        Args:
+            row (int): Row to remove.
+        """
+        self.__alive[row] = False
+
+    def __vectors(self, rows):
+        base_size = 0 if self.__base is None else len(self.__base)
+        rows = np.asarray(rows, dtype=np.int64)
+        in_base = rows < base_size
+        vectors = np.empty((len(rows), self.__tail.shape[1] if self.__tail is not None else self.__base.shape[1]),
+                           dtype=np.float32)
+        if in_base.any():
+            vectors[in_base] = self.__base[rows[in_base]]
+        if (~in_base).any():
+            vectors[~in_base] = self.__tail[rows[~in_base] - base_size]
+        return vectors
+
+    def search(self, vector, k=5):
+        """
+        Returns the rows most similar to a vector.
+
+        Args:
+            vector (ndarray): Unit vector of the query.
+            k (int, optional): Maximum number of rows returned (default: 5).
+
+        Returns:
+            list: (row, similarity) pairs, most similar first.
+        """
+        if not self.__alive[:self.size()].any():
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.lsh_bits is None:
+            parts = [] if self.__base is None else [self.__base @ vector]
+            if self.__tail_size:
+                parts.append(self.__tail[:self.__tail_size] @ vector)
+            rows = np.arange(self.size())
+            scores = np.concatenate(parts)
+        else:
+            keys = self.__bucket_keys(vector[None, :])[:, 0].tolist()
+            candidates = set()
+            for table, key in zip(self.__buckets, keys):
+                candidates.update(table.get(key, ()))
+            if not candidates:
+                return []
+            rows = np.fromiter(candidates, dtype=np.int64)
+            scores = self.__vectors(rows) @ vector
+        alive = self.__alive[rows]
+        rows, scores = rows[alive], scores[alive]
+        best = np.argsort(-scores)[:k]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+    def compact(self):
+        """
+        Drops the removed rows, keeping the others in memory.
+
+        Returns:
+            list: Previous rows of the kept vectors, in their new order.
+        """
+        kept = np.flatnonzero(self.__alive[:self.size()])
+        vectors = self.__vectors(kept) if len(kept) else None
+        self.__base = None
+        self.__tail = vectors if vectors is not None else None
+        self.__tail_size = len(kept)
+        self.__alive = np.ones(len(kept), dtype=bool)
+        self.__buckets = [{} for _ in range(self.lsh_tables)]
+        if vectors is not None:
+            self.__index_rows(vectors, 0)
+        return kept.tolist()
+
+    def save(self, path):
+        """
+        Compacts the index and writes its vectors to a `.npy` file, memory mapping them back.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            list: Previous rows of the saved vectors, in their new order.
+        """
+        kept = self.compact()
+        vectors = self.__tail[:self.__tail_size] if self.__tail is not None else np.zeros((0, 0), dtype=np.float32)
+        temporary = f'{path}.tmp.npy'
+        np.save(temporary, vectors)
+        os.replace(temporary, path)
+        self.load(path)
+        return kept
+
+    def load(self, path):
+        """
+        Replaces the vectors of the index by the ones of a `.npy` file, memory mapped.
+
+        Args:
+            path (str): Path of the file.
+        """
+        base = np.load(path, mmap_mode='r')
+        self.__base = base if base.size else None
+        self.__tail = None
+        self.__tail_size = 0
+        self.__alive = np.ones(0 if self.__base is None else len(base), dtype=bool)
+        self.__buckets = [{} for _ in range(self.lsh_tables)]
+        if self.__base is not None:
+            self.__index_rows(self.__base, 0)
+
+class SemanticQuery:
+    """
+    Lookup key of a question in the SemanticCache.
+
+    Attributes:
+        vector: Unit vector of the question blended with its recent context.
+        namespace (str): Digest of the system phrases, which must match exactly.
+        terms (list): Key terms of the question and its context, which must match exactly.
+    """
+    __slots__ = ('vector', 'namespace', 'terms')
+
+    def __init__(self, vector, namespace, terms=()):
+        self.vector = vector
+        self.namespace = namespace
+        self.terms = list(terms)
+
+class SemanticCache:
+    """
+    Caches the answers of the questions and returns them for similar later questions.
+
+    The last user phrase is embedded together with the text of the phrases before it,
+    weighted by `context_weight`, and searched in a local vector index. An answer is
+    returned when the similarity reaches `threshold`, the system phrases are the same and
+    so are the key terms (numbers, tickers, paths and URLs, see `key_terms`) of the
+    question and its context. Answers expire after `ttl`, or after the TTL of the tools
+    used to build them when shorter, so answers with stock prices expire after 5 minutes
+    by default; tools with a TTL of 0 are never cached. Past `max_entries`, the expired
+    answers and then the least recently used ones are evicted.
+
+    The embedders are synchronous, and the OpenAI one calls the API, so the `async_*`
+    methods run the lookups and stores in a worker thread.
+
+    Attributes:
+        embedder: Embedder of the questions (HashingEmbedder by default).
+        index: VectorIndex of the questions.
+        threshold (float): Minimum cosine similarity of a hit.
+        context_turns (int): Number of previous phrases embedded with the question.
+        context_weight (float): Weight of the previous phrases in the embedding.
+        ttl (float): Seconds until an answer expires, or None.
+        tool_ttls (dict): Mapping of tool names to the TTL of the answers that used them.
+        max_entries (int): Maximum number of answers kept.
+        path (str): Directory where the index and the answers are saved, or None.
+        __entries (list): Answers aligned with the index rows, None for the removed ones.
+        __alive (int): Number of answers kept.
+        __stats (dict): Hit, miss, store, expiration and eviction counters.
+        __lock: Lock protecting the index, the answers and the counters.
+    """
+
+    def __init__(self, embedder=None, index=None, threshold=0.9, context_turns=2, context_weight=0.25, ttl=None,
+                 tool_ttls=None, max_entries=10000, path=None):
+        """
+        Initializes an instance of the SemanticCache class.
+
+        Args:
+            embedder (optional): Embedder with an `embed(text)` method (default: HashingEmbedder()).
+            index (VectorIndex, optional): Index of the questions (default: VectorIndex(), brute force).
+            threshold (float, optional): Minimum cosine similarity of a hit (default: 0.9).
+            context_turns (int, optional): Number of previous phrases embedded with the question (default: 2).
+            context_weight (float, optional): Weight of the previous phrases in the embedding (default: 0.25).
+            ttl (float, optional): Seconds until an answer expires (default: None, never).
+            tool_ttls (dict, optional): Mapping of tool names to the TTL of the answers that used them,
+                0 to never cache them, merged over the defaults (default: 300 seconds for the stock tools).
+            max_entries (int, optional): Maximum number of answers kept (default: 10000).
+            path (str, optional): Directory where `save` writes the index and the answers, loaded
+                when it exists (default: None, memory only).
+        """
+        self.embedder = embedder or HashingEmbedder()
+        self.index = index or VectorIndex()
+        self.threshold = threshold
+        self.context_turns = context_turns
+        self.context_weight = context_weight
+        self.ttl = ttl
+        self.tool_ttls = {**c.SEMANTIC_CACHE_TOOL_TTLS, **(tool_ttls or {})}
+        self.max_entries = max_entries
+        self.path = path
+        self.__entries = []
+        self.__alive = 0
+        self.__stats = {'hits': 0, 'misses': 0, 'stores': 0, 'expirations': 0, 'evictions': 0}
+        self.__lock = threading.Lock()
+        if path and os.path.exists(os.path.join(path, 'entries.json')):
+            self.__load()
+
+    def __count(self, stat):
+        self.__stats[stat] += 1
+
+    def query(self, conversation, model=None, temperature=None, tools=()):
+        """
+        Builds the lookup key of the last user phrase of a conversation.
+
+        Answers are only shared between conversations with the same system phrases,
+        model, temperature and tools.
+
+        Args:
+            conversation (list): Conversation phrases.
+            model (str, optional): Model ID answering the question.
+            temperature (float, optional): Sampling temperature of the answer.
+            tools (list, optional): Names of the tools available to the model.
+
+        Returns:
+            SemanticQuery: Lookup key, or None when the conversation does not end with a text user phrase.
+        """
+        if not conversation or conversation[-1].get('role') != 'user':
+            return None
+        question = conversation[-1].get('content')
+        if not isinstance(question, str) or not question.strip():
+            return None
+        system = [phrase.get('content') for phrase in conversation if phrase.get('role') == 'system']
+        settings = {'system': system, 'model': model, 'temperature': temperature, 'tools': sorted(tools)}
+        namespace = hashlib.sha256(json.dumps(settings, default=str).encode('utf-8')).hexdigest()[:16]
+        vector = self.embedder.embed(question)
+        context = [phrase['content'] for phrase in conversation[:-1]
+                   if phrase.get('role') in ('user', 'assistant') and isinstance(phrase.get('content'), str)]
+        context = context[-self.context_turns:] if self.context_turns else []
+        if context and self.context_weight:
+            vector = _unit(vector + self.context_weight * self.embedder.embed('\n'.join(context)))
+        return SemanticQuery(vector, namespace, key_terms('\n'.join([*context, question])))
+
+    async def async_query(self, conversation, model=None, temperature=None, tools=()):
+        """
+        Builds the lookup key of the last user phrase in a worker thread, without blocking the event loop.
+
+        Args:
+            conversation (list): Conversation phrases.
+            model (str, optional): Model ID answering the question.
+            temperature (float, optional): Sampling temperature of the answer.
+            tools (list, optional): Names of the tools available to the model.
+
+        Returns:
+            SemanticQuery: Lookup key, or None when the conversation does not end with a text user phrase.
+        """
+        return await asyncio.to_thread(self.query, conversation, model, temperature, tools)
+
+    def __remove(self, row):
+        self.index.remove(row)
+        self.__entries[row] = None
+        self.__alive -= 1
+
+    def get(self, query):
+        """
+        Returns the cached answer of the most similar question.
+
+        Args:
+            query (SemanticQuery): Lookup key of the question.
+
+        Returns:
+            str: Cached answer, or None.
+        """
+        now = time.time()
+        with self.__lock:
+            for row, similarity in self.index.search(query.vector):
+                if similarity < self.threshold:
+                    break
+                entry = self.__entries[row]
+                if entry['namespace'] != query.namespace or entry.get('terms', []) != query.terms:
+                    continue
+                if entry['expires'] is not None and entry['expires'] < now:
+                    self.__remove(row)
+                    self.__count('expirations')
+                    continue
+                entry['used'] = now
+                self.__count('hits')
+                return entry['content']
+            self.__count('misses')
+            return None
+
+    async def async_get(self, query):
+        """
+        Returns the cached answer of the most similar question, searched in a worker thread.
+
+        Args:
+            query (SemanticQuery): Lookup key of the question.
+
+        Returns:
+            str: Cached answer, or None.
+        """
+        return await asyncio.to_thread(self.get, query)
+
+    def get_ttl(self, tools=()):
+        """
+        Returns the TTL of an answer built with some tools.
+
+        Args:
+            tools (list, optional): Names of the tools used in the answer.
+
+        Returns:
+            float: Seconds until the answer expires, None if it never expires, 0 if it is not cached.
+        """
+        ttls = [self.tool_ttls.get(name, self.ttl) for name in tools] + [self.ttl]
+        ttls = [ttl for ttl in ttls if ttl is not None]
+        return min(ttls) if ttls else None
+
+    def __evict(self, now):
+        """
+        Removes the expired answers, then the least recently used ones, down to 90% of
+        `max_entries` so the answers are not scanned again on every store.
+        """
+        for row, entry in enumerate(self.__entries):
+            if entry is not None and entry['expires'] is not None and entry['expires'] < now:
+                self.__remove(row)
+                self.__count('expirations')
+        excess = self.__alive - int(self.max_entries * 0.9)
+        if excess > 0:
+            alive = [(entry['used'], row) for row, entry in enumerate(self.__entries) if entry is not None]
+            for _, row in sorted(alive)[:excess]:
+                self.__remove(row)
+                self.__count('evictions')
+        if len(self.__entries) > 2 * self.__alive + 64:
+            self.__entries = [self.__entries[row] for row in self.index.compact()]
+
+    def set(self, query, content, tools=()):
+        """
+        Stores the answer of a question.
+
+        Args:
+            query (SemanticQuery): Lookup key of the question.
+            content (str): Answer.
+            tools (list, optional): Names of the tools used in the answer, which set its TTL.
+        """
+        ttl = self.get_ttl(tools)
+        if not content or ttl == 0:
+            return
+        now = time.time()
+        with self.__lock:
+            row = self.index.add(query.vector)
+            self.__entries.append({'namespace': query.namespace, 'terms': query.terms, 'content': content,
+                                   'expires': None if ttl is None else now + ttl, 'used': now,
+                                   'tools': list(tools)})
+            self.__alive += 1
+            self.__count('stores')
+            if self.__alive > self.max_entries:
+                self.__evict(now)
+
+    async def async_set(self, query, content, tools=()):
+        """
+        Stores the answer of a question in a worker thread, as eviction may scan the answers.
+
+        Args:
+            query (SemanticQuery): Lookup key of the question.
+            content (str): Answer.
+            tools (list, optional): Names of the tools used in the answer, which set its TTL.
+        """
+        await asyncio.to_thread(self.set, query, content, tools)
+
+    def save(self):
+        """
+        Writes the index and the answers to `path`. The vectors are memory mapped back.
+        """
+        if not self.path:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with self.__lock:
+            kept = self.index.save(os.path.join(self.path, 'vectors.npy'))
+            self.__entries = [self.__entries[row] for row in kept]
+            temporary = os.path.join(self.path, 'entries.json.tmp')
+            with open(temporary, 'w', encoding='utf-8') as file:
+                json.dump(self.__entries, file, ensure_ascii=False)
+            os.replace(temporary, os.path.join(self.path, 'entries.json'))
+
+    def __load(self):
+        """
+        Reads the index and the answers saved in `path`.
+        """
+        with open(os.path.join(self.path, 'entries.json'), encoding='utf-8') as file:
+            self.__entries = json.load(file)
+        self.index.load(os.path.join(self.path, 'vectors.npy'))
+        self.__alive = len(self.__entries)
+
+    def get_stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Hits, misses, stored answers, expired and evicted answers, and answers kept ('entries').
+        """
+        with self.__lock:
+            return {**self.__stats, 'entries': self.__alive}
+
+    def clear(self):
+        """
+        Removes all answers. Saved files are only replaced on the next `save`.
+        """
+        with self.__lock:
+            for row, entry in enumerate(self.__entries):
+                if entry is not None:
+                    self.__remove(row)
+            self.__entries = [self.__entries[row] for row in self.index.compact()]
@@ -0,0 +1,250 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from MyGPT import BotClass
+from MyGPT import ClientPoolClass
+from MyGPT import ToolDispatcherClass
+from MyGPT import ConversationStoreClass
+from MyGPT import AssistantRunWaiterClass
+from MyGPT import OutputSinkClass
+
+class Session:
+    """
+    Conversation state of a single user.
+
+    Attributes:
+        bot (Bot): Bot holding the isolated conversation.
+        lock: Lock serializing the messages of the session.
+        last_used (float): Monotonic time of the last message.
+    """
+    __slots__ = ('bot', 'lock', 'last_used')
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+class SessionManager:
+    """
+    Serves many users, each one with an isolated conversation.
+
+    All sessions share one OpenAI client (and its connection pool), one tool
+    dispatcher and one assistant run waiter, so an idle session only keeps its own
+    conversation. Sessions idle for longer than `idle_timeout` are evicted, and the
+    least recently used ones are evicted when `max_sessions` is reached. With a
+    `conversation_backend`, conversations are persisted under their session ID, so
+    evicted sessions are resumed from disk on their next message.
+
+    Attributes:
+        bot_name (str): Name of the bots created for the sessions.
+        max_sessions (int): Maximum number of sessions kept.
+        idle_timeout (float): Seconds after which an idle session is evicted (None keeps it).
+        conversation_backend: Backend persisting the conversations, or None to keep them only in memory.
+        max_resident (int): Maximum number of recent phrases of each conversation kept in memory.
+        __client: OpenAI client shared by all sessions.
+        __output: Sink receiving the output of all the bots.
+        __gpt_options (dict): Additional arguments for the MyGPT of each session.
+        __sessions (OrderedDict): Mapping of session IDs to sessions, least recently used first.
+        __lock: Lock protecting the sessions mapping.
+        __executor: Thread pool used by `submit_message`, whose threads start on first use.
+        __max_workers (int): Maximum number of messages handled at once by `submit_message`.
+    """
+
+    def __init__(self, bot_name='Tião', max_sessions=1000, idle_timeout=1800, max_workers=16, client=None,
+                 conversation_backend=None, max_resident=None, output=None, **gpt_options):
+        """
+        Initializes an instance of the SessionManager class.
+
+        Args:
+            bot_name (str, optional): Name of the bots (default: 'Tião').
+            max_sessions (int, optional): Maximum number of sessions kept (default: 1000).
+            idle_timeout (float, optional): Seconds after which an idle session is evicted (default: 1800).
+            max_workers (int, optional): Maximum number of messages handled at once by `submit_message`
+                and of tools running at once (default: 16).
+            client (optional): OpenAI client shared by all sessions (default: the client of the default ClientPool).
+            conversation_backend (optional): JsonlConversationBackend or SqliteConversationBackend persisting
+                the conversations (default: None).
+            max_resident (int, optional): Maximum number of recent phrases of each conversation kept in memory.
+                Requires a conversation backend (default: None, keeps all).
+            output (optional): Sink receiving the output of all the bots (default: LoggingSink(), so
+                the answers are logged instead of printed).
+            **gpt_options: Additional arguments for the MyGPT of each session.
+        """
+        self.bot_name = bot_name
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.conversation_backend = conversation_backend
+        self.max_resident = max_resident
+        self.__output = output or OutputSinkClass.LoggingSink()
+        self.__client = client or ClientPoolClass.get_default_pool().get_client()
+        self.__gpt_options = {
+            'tool_dispatcher': ToolDispatcherClass.ToolDispatcher(max_workers=max_workers,
+                                                                  metrics=gpt_options.get('metrics')),
+            'run_waiter': AssistantRunWaiterClass.AssistantRunWaiter(),
+            **gpt_options
+        }
+        self.__sessions = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__max_workers = max_workers
+        # Created here rather than on first use, so concurrent first submits share one pool
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mygpt-session')
+
+    def __new_bot(self, session_id):
+        """
+        Creates a bot sharing the client, dispatcher and run waiter of the manager.
+        """
+        store = ConversationStoreClass.ConversationStore(backend=self.conversation_backend, session_id=session_id,
+                                                         max_resident=self.max_resident)
+        return BotClass.Bot(bot_name=self.bot_name, client=self.__client, conversation_store=store,
+                            output=self.__output, **self.__gpt_options)
+
+    def __touch(self, session_id):
+        """
+        Returns a session and marks it as the most recently used, or None. Called with the lock held.
+        """
+        session = self.__sessions.get(session_id)
+        if session is not None:
+            self.__sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+        return session
+
+    def __evict_over_limit(self, keep):
+        """
+        Evicts the least recently used sessions above `max_sessions`. Called with the lock held.
+
+        Sessions handling a message are skipped, as in `evict_idle_sessions`, so the limit
+        may be exceeded while all the oldest sessions are busy.
+        """
+        excess = len(self.__sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        evicted = []
+        for session_id, session in self.__sessions.items():
+            if len(evicted) == excess:
+                break
+            if session_id != keep and not session.lock.locked():
+                evicted.append(session_id)
+        for session_id in evicted:
+            del self.__sessions[session_id]
+
+    def get_session(self, session_id):
+        """
+        Returns a session, creating it if needed.
+
+        The bot of a new session is built outside the manager lock, so a slow construction
+        (as resuming a long conversation from the backend) does not block the other sessions.
+        When two threads create the same session at once, the first one inserted is kept.
+
+        Args:
+            session_id (str): ID of the session.
+
+        Returns:
+            Session: Session of the ID.
+        """
+        with self.__lock:
+            session = self.__touch(session_id)
+        if session is not None:
+            return session
+        created = Session(self.__new_bot(session_id))
+        created.bot.set_user(session_id)
+        with self.__lock:
+            session = self.__touch(session_id)
+            if session is None:
+                session = self.__sessions[session_id] = created
+                self.__evict_over_limit(keep=session_id)
+            return session
+
+    def __is_current(self, session_id, session):
+        with self.__lock:
+            return self.__sessions.get(session_id) is session
+
+    def handle_message(self, session_id, text, user=None):
+        """
+        Answers a message in the conversation of a session.
+
+        Messages of the same session are handled one at a time; messages of different
+        sessions may be handled concurrently from different threads.
+
+        Args:
+            session_id (str): ID of the session.
+            text (str): Content of the user's message.
+            user (str, optional): Name of the user (default: the session ID).
+
+        Returns:
+            str: Bot answer.
+        """
+        self.evict_idle_sessions()
+        while True:
+            session = self.get_session(session_id)
+            with session.lock:
+                # The session may have been evicted between the lookup and the lock, and a
+                # new one resumed from the backend; answering on the old one would overwrite it
+                if not self.__is_current(session_id, session):
+                    continue
+                if user:
+                    session.bot.set_user(user)
+                answer = session.bot.answer(content=text)
+                session.last_used = time.monotonic()
+            return answer
+
+    def submit_message(self, session_id, text, user=None, callback=None):
+        """
+        Answers a message in background.
+
+        Args:
+            session_id (str): ID of the session.
+            text (str): Content of the user's message.
+            user (str, optional): Name of the user (default: the session ID).
+            callback (function, optional): Called with the finished future.
+
+        Returns:
+            Future: Future resolved with the bot answer.
+        """
+        future = self.__executor.submit(self.handle_message, session_id, text, user)
+        if callback:
+            future.add_done_callback(callback)
+        return future
+
+    def close_session(self, session_id):
+        """
+        Removes a session and its conversation from memory. Persisted conversations stay in the backend.
+
+        Args:
+            session_id (str): ID of the session.
+        """
+        with self.__lock:
+            self.__sessions.pop(session_id, None)
+
+    def evict_idle_sessions(self):
+        """
+        Removes the sessions idle for longer than `idle_timeout`.
+
+        Returns:
+            int: Number of evicted sessions.
+        """
+        if self.idle_timeout is None:
+            return 0
+        limit = time.monotonic() - self.idle_timeout
+        evicted = 0
+        with self.__lock:
+            # Sessions are kept in usage order, so the idle ones are at the beginning
+            for session_id, session in list(self.__sessions.items()):
+                if session.last_used > limit:
+                    break
+                if session.lock.locked():
+                    continue
+                del self.__sessions[session_id]
+                evicted += 1
+        return evicted
+
+    def get_session_ids(self):
+        """
+        Returns the IDs of the current sessions.
+
+        Returns:
+            list: Session IDs, least recently used first.
+        """
+        with self.__lock:
+            return list(self.__sessions.keys())
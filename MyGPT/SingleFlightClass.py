@@ -0,0 +1,154 @@
+import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+
+def request_key(payload):
+    """
+    Builds the key of a request from a JSON serializable payload.
+
+    Args:
+        payload: Request parameters.
+
+    Returns:
+        str: Digest of the payload.
+    """
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into a single call in flight.
+
+    The first caller of a key runs the call; callers arriving with the same key while it
+    is in flight wait for it and share its result or its exception. Once the call ends the
+    key is released, so later calls run again (caching is left to ResponseCache). Threads
+    and asyncio tasks have their own variants; asyncio calls are coalesced per event loop.
+
+    Attributes:
+        __calls (dict): Futures of the calls in flight, by kind and key.
+        __async_calls (dict): Tasks of the coroutine calls in flight, by event loop, kind and key.
+        __stats (dict): Calls and coalesced calls, by kind.
+        __lock: Lock protecting the calls in flight and the counters.
+    """
+
+    def __init__(self):
+        """
+        Initializes an instance of the SingleFlight class.
+        """
+        self.__calls = {}
+        self.__async_calls = {}
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    def __count(self, kind, shared):
+        stats = self.__stats.setdefault(kind, {'calls': 0, 'coalesced': 0})
+        stats['calls'] += 1
+        if shared:
+            stats['coalesced'] += 1
+
+    def do(self, kind, key, function, *args, **kwargs):
+        """
+        Runs a call, or waits for the identical call in flight.
+
+        Args:
+            kind (str): Kind of the call, as 'tool' or 'image_description'.
+            key: Hashable key identifying identical calls.
+            function (function): Function to call.
+            *args: Positional arguments of the function.
+            **kwargs: Keyword arguments of the function.
+
+        Returns:
+            tuple: Result of the call and whether it was shared with a call in flight.
+        """
+        with self.__lock:
+            future = self.__calls.get((kind, key))
+            shared = future is not None
+            if not shared:
+                future = self.__calls[(kind, key)] = Future()
+            self.__count(kind, shared)
+        if shared:
+            return future.result(), True
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self.__lock:
+                del self.__calls[(kind, key)]
+        return result, False
+
+    async def async_do(self, kind, key, function, *args, **kwargs):
+        """
+        Awaits a call, or the identical call in flight on the running event loop.
+
+        The call runs in its own task, so a caller that is cancelled, as by a timeout,
+        does not cancel it for the other callers.
+
+        Args:
+            kind (str): Kind of the call, as 'tool' or 'image_description'.
+            key: Hashable key identifying identical calls.
+            function (function): Function returning an awaitable.
+            *args: Positional arguments of the function.
+            **kwargs: Keyword arguments of the function.
+
+        Returns:
+            tuple: Result of the call and whether it was shared with a call in flight.
+        """
+        flight_key = (asyncio.get_running_loop(), kind, key)
+        with self.__lock:
+            task = self.__async_calls.get(flight_key)
+            shared = task is not None
+            if not shared:
+                task = self.__async_calls[flight_key] = asyncio.ensure_future(function(*args, **kwargs))
+                task.add_done_callback(lambda _: self.__release(flight_key))
+            self.__count(kind, shared)
+        return await asyncio.shield(task), shared
+
+    def __release(self, flight_key):
+        with self.__lock:
+            del self.__async_calls[flight_key]
+
+    def get_stats(self):
+        """
+        Returns the counters of the calls.
+
+        Returns:
+            dict: Mapping of each kind to its calls ('calls') and the calls that shared a call
+                in flight ('coalesced'), and the calls in flight ('in_flight').
+        """
+        with self.__lock:
+            stats = {kind: dict(counters) for kind, counters in self.__stats.items()}
+            stats['in_flight'] = len(self.__calls) + len(self.__async_calls)
+            return stats
+
+_default_single_flight = None
+_default_single_flight_lock = threading.Lock()
+
+def get_default_single_flight():
+    """
+    Returns the SingleFlight shared by the instances created without one.
+
+    Returns:
+        SingleFlight: Shared single flight.
+    """
+    global _default_single_flight
+    with _default_single_flight_lock:
+        if _default_single_flight is None:
+            _default_single_flight = SingleFlight()
+        return _default_single_flight
+
+def set_default_single_flight(single_flight):
+    """
+    Replaces the SingleFlight shared by the instances created without one.
+
+    Args:
+        single_flight (SingleFlight): New shared single flight.
+    """
+    global _default_single_flight
+    with _default_single_flight_lock:
+        _default_single_flight = single_flight
@@ -0,0 +1,316 @@
+import os
+import re
+import json
+import time
+import threading
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+PERIODS = ["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"]
+MAX_START = pd.Timestamp('1900-01-01')
+
+class YahooDataSource:
+    """
+    Stock closes downloaded from the Yahoo Finance API.
+
+    Several tickers are fetched in a single bulk download instead of one request
+    per ticker.
+    """
+
+    def history(self, tickers, period='1mo', start=None):
+        """
+        Returns the daily closes of the tickers.
+
+        Args:
+            tickers (list): Ticker symbols, as 'PETR4.SA'.
+            period (str, optional): Historical period, as '1mo' (default: '1mo'). Ignored when `start` is given.
+            start (str, optional): First date to return, as 'YYYY-MM-DD' (default: None).
+
+        Returns:
+            DataFrame: Closes indexed by date, one column per ticker.
+        """
+        # yfinance is only loaded by the first download
+        import yfinance as yf
+
+        tickers = list(tickers)
+        if len(tickers) == 1:
+            ticker_obj = yf.Ticker(tickers[0])
+            hist = ticker_obj.history(start=start) if start else ticker_obj.history(period=period)
+            closes = hist[['Close']].rename(columns={'Close': tickers[0]})
+        else:
+            options = {'start': start} if start else {'period': period}
+            data = yf.download(tickers, progress=False, auto_adjust=True, group_by='column', **options)
+            closes = data['Close'].reindex(columns=tickers)
+        closes.index = pd.DatetimeIndex(closes.index).tz_localize(None).normalize()
+        return closes
+
+class CsvDataSource:
+    """
+    Stock closes read from a local CSV file, to use the stock tools offline.
+
+    The file has a 'Date' column followed by one column of closes per ticker. Periods
+    are counted back from the last date in the file.
+
+    Attributes:
+        path (str): Path of the CSV file.
+        __closes (DataFrame): Closes loaded on first use.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes an instance of the CsvDataSource class.
+
+        Args:
+            path (str): Path of the CSV file.
+        """
+        self.path = path
+        self.__closes = None
+
+    def __load(self):
+        if self.__closes is None:
+            self.__closes = pd.read_csv(self.path, index_col='Date', parse_dates=True).sort_index()
+        return self.__closes
+
+    def history(self, tickers, period='1mo', start=None):
+        """
+        Returns the daily closes of the tickers.
+
+        Args:
+            tickers (list): Ticker symbols, as 'PETR4.SA'.
+            period (str, optional): Historical period, as '1mo' (default: '1mo'). Ignored when `start` is given.
+            start (str, optional): First date to return, as 'YYYY-MM-DD' (default: None).
+
+        Returns:
+            DataFrame: Closes indexed by date, one column per ticker.
+        """
+        closes = self.__load().reindex(columns=list(tickers))
+        if start:
+            return closes.loc[pd.Timestamp(start):]
+        return slice_period(closes, period)
+
+class CachedDataSource:
+    """
+    Keeps the closes downloaded by another data source in a local columnar store.
+
+    Each ticker is stored as two NumPy files, the dates (days since epoch) and the
+    closes, read back memory-mapped. A request only downloads what is missing: the tail
+    since the last stored date, or the older history when a longer period than the
+    stored one is requested. The tail is refreshed at most once per `refresh_interval`.
+
+    Downloads run outside the store lock, so requests for different tickers download
+    concurrently. A lock per ticker keeps concurrent requests for the same ticker from
+    downloading it twice: the later ones wait and find it stored.
+
+    Attributes:
+        source: Data source used to download the missing closes.
+        cache_dir (str): Directory of the store.
+        refresh_interval (float): Seconds between two downloads of the tail of a ticker.
+        __index (dict): Mapping of tickers to the first covered date and last refresh time.
+        __ticker_locks (dict): Lock of each ticker, held while it is downloaded.
+        __lock: Lock protecting the index, the ticker locks and the store files.
+    """
+
+    def __init__(self, source=None, cache_dir=os.path.join(os.path.expanduser('~'), '.mygpt', 'stocks'),
+                 refresh_interval=900):
+        """
+        Initializes an instance of the CachedDataSource class.
+
+        Args:
+            source (optional): Data source used to download the closes (default: YahooDataSource()).
+            cache_dir (str, optional): Directory of the store (default: ~/.mygpt/stocks).
+            refresh_interval (float, optional): Seconds between two downloads of the tail of a ticker (default: 900).
+        """
+        self.source = source or YahooDataSource()
+        self.cache_dir = cache_dir
+        self.refresh_interval = refresh_interval
+        self.__lock = threading.Lock()
+        self.__ticker_locks = {}
+        self.__index = self.__load_index()
+
+    def __index_path(self):
+        return os.path.join(self.cache_dir, 'index.json')
+
+    def __load_index(self):
+        try:
+            with open(self.__index_path(), 'r') as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def __save_index(self):
+        temp_path = f'{self.__index_path()}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump(self.__index, index_file)
+        os.replace(temp_path, self.__index_path())
+
+    def __paths(self, ticker):
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', ticker)
+        return (os.path.join(self.cache_dir, f'{name}.dates.npy'), os.path.join(self.cache_dir, f'{name}.closes.npy'))
+
+    def __read(self, ticker):
+        """
+        Returns the stored closes of a ticker, memory-mapped.
+
+        Returns:
+            Series: Closes indexed by date, empty if the ticker is not stored.
+        """
+        dates_path, closes_path = self.__paths(ticker)
+        if ticker not in self.__index or not os.path.exists(dates_path):
+            return pd.Series(dtype='float64')
+        dates = np.load(dates_path, mmap_mode='r')
+        closes = np.load(closes_path, mmap_mode='r')
+        return pd.Series(closes, index=pd.to_datetime(np.asarray(dates), unit='D'))
+
+    def __write(self, ticker, closes):
+        """
+        Replaces the stored closes of a ticker.
+        """
+        closes = closes.dropna()
+        days = (closes.index.values.astype('datetime64[D]')).astype('int64')
+        for path, values in zip(self.__paths(ticker), (days, closes.to_numpy(dtype='float64'))):
+            temp_path = f'{path}.{os.getpid()}.tmp.npy'
+            np.save(temp_path, values)
+            os.replace(temp_path, path)
+
+    def __required_start(self, period, start):
+        """
+        Returns the first date a request needs, counted back from today.
+
+        Periods are sliced from the last trading day, which may be before today, so a
+        week of margin is added to cover weekends and holidays.
+        """
+        if start:
+            return pd.Timestamp(start)
+        today = pd.Timestamp.today().normalize()
+        margin = pd.Timedelta(days=7)
+        if period == 'max':
+            return MAX_START
+        if period == 'ytd':
+            return pd.Timestamp(year=today.year, month=1, day=1) - margin
+        match = re.fullmatch(r'(\d+)(d|mo|y)', period)
+        if not match:
+            raise ValueError(f'Invalid period {period}')
+        size, unit = int(match.group(1)), match.group(2)
+        if unit == 'd':
+            return today - pd.Timedelta(days=size * 2) - margin
+        offset = pd.DateOffset(months=size) if unit == 'mo' else pd.DateOffset(years=size)
+        return today - offset - margin
+
+    def __download(self, tickers, required_start):
+        """
+        Downloads the closes of the tickers from a date on.
+        """
+        if required_start == MAX_START:
+            return self.source.history(tickers, period='max')
+        return self.source.history(tickers, start=required_start.strftime('%Y-%m-%d'))
+
+    def update(self, tickers, period='1mo', start=None):
+        """
+        Downloads the closes missing in the store for a request.
+
+        Tickers missing the older history are downloaded together from the required
+        date; the others only download their tail, also in a single request.
+
+        Args:
+            tickers (list): Ticker symbols.
+            period (str, optional): Historical period (default: '1mo').
+            start (str, optional): First date needed, as 'YYYY-MM-DD' (default: None).
+        """
+        required_start = self.__required_start(period, start)
+        with self.__lock:
+            locks = [self.__ticker_locks.setdefault(ticker, threading.Lock()) for ticker in sorted(set(tickers))]
+        # Ticker locks are always taken in the same order, so overlapping requests cannot deadlock
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            now = time.time()
+            with self.__lock:
+                full, tails = [], {}
+                for ticker in tickers:
+                    entry = self.__index.get(ticker)
+                    if entry is None or pd.Timestamp(entry['from']) > required_start:
+                        full.append(ticker)
+                    elif now - entry['refreshed'] >= self.refresh_interval:
+                        stored = self.__read(ticker)
+                        tails[ticker] = stored.index[-1] if len(stored) else pd.Timestamp(entry['from'])
+            if not full and not tails:
+                return
+            full_download = self.__download(full, required_start) if full else None
+            # The last stored day is downloaded again, since its close may have changed
+            tails_download = self.__download(list(tails), min(tails.values())) if tails else None
+            with self.__lock:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                for ticker in full:
+                    closes = full_download[ticker] if ticker in full_download else pd.Series(dtype='float64')
+                    self.__write(ticker, closes)
+                    self.__index[ticker] = {'from': required_start.strftime('%Y-%m-%d'), 'refreshed': now}
+                for ticker, last in tails.items():
+                    stored = self.__read(ticker)
+                    tail = tails_download[ticker].dropna() if ticker in tails_download else pd.Series(dtype='float64')
+                    merged = pd.concat([stored[stored.index < last], tail[tail.index >= last]])
+                    self.__write(ticker, merged)
+                    self.__index[ticker]['refreshed'] = now
+                self.__save_index()
+
+    def history(self, tickers, period='1mo', start=None):
+        """
+        Returns the daily closes of the tickers, answered from the store.
+
+        Args:
+            tickers (list): Ticker symbols, as 'PETR4.SA'.
+            period (str, optional): Historical period, as '1mo' (default: '1mo'). Ignored when `start` is given.
+            start (str, optional): First date to return, as 'YYYY-MM-DD' (default: None).
+
+        Returns:
+            DataFrame: Closes indexed by date, one column per ticker.
+        """
+        tickers = list(tickers)
+        self.update(tickers, period=period, start=start)
+        with self.__lock:
+            closes = pd.DataFrame({ticker: self.__read(ticker) for ticker in tickers}, columns=tickers)
+        if start:
+            return closes.loc[pd.Timestamp(start):]
+        return slice_period(closes, period)
+
+def slice_period(closes, period):
+    """
+    Keeps only the rows of a period counted back from the last date.
+
+    Args:
+        closes (DataFrame): Closes indexed by date.
+        period (str): Historical period, one of PERIODS.
+
+    Returns:
+        DataFrame: Rows of the period.
+    """
+    if period == 'max' or closes.empty:
+        return closes
+    last = closes.index[-1]
+    if period == 'ytd':
+        return closes.loc[pd.Timestamp(year=last.year, month=1, day=1):]
+    match = re.fullmatch(r'(\d+)(d|mo|y)', period)
+    if not match:
+        raise ValueError(f'Invalid period {period}')
+    size, unit = int(match.group(1)), match.group(2)
+    if unit == 'd':
+        return closes.iloc[-size:]
+    offset = pd.DateOffset(months=size) if unit == 'mo' else pd.DateOffset(years=size)
+    return closes.loc[last - offset + pd.Timedelta(days=1):]
+
+def downsample(closes, max_points=30):
+    """
+    Downsamples all series together, keeping the last row and evenly spaced rows before it.
+
+    Args:
+        closes (DataFrame): Closes indexed by date.
+        max_points (int, optional): Number of rows above which the series are downsampled (default: 30).
+
+    Returns:
+        DataFrame: Downsampled closes.
+    """
+    if len(closes) <= max_points:
+        return closes
+    step = int(len(closes) / max_points)
+    return closes.iloc[::-step].iloc[::-1]
@@ -0,0 +1,85 @@
+
+class StreamAccumulator:
+    """
+    Reassembles the assistant phrase of a streamed chat completion.
+
+    Text deltas are collected as they arrive and `tool_calls` deltas, which come split
+    in many chunks (id and name first, then pieces of the arguments), are merged by
+    their index.
+
+    Attributes:
+        __content (list): Text deltas received so far.
+        __tool_calls (dict): Mapping of tool call indexes to their merged data.
+    """
+
+    def __init__(self):
+        """
+        Initializes an instance of the StreamAccumulator class.
+        """
+        self.__content = []
+        self.__tool_calls = {}
+
+    def add(self, chunk):
+        """
+        Adds a streamed chunk.
+
+        Args:
+            chunk (ChatCompletionChunk): Chunk received from the stream.
+
+        Returns:
+            str: Text delta of the chunk, or None if it has none.
+        """
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta
+        for tool_call in delta.tool_calls or []:
+            entry = self.__tool_calls.setdefault(tool_call.index, {
+                'id': None,
+                'type': 'function',
+                'function': {'name': '', 'arguments': ''}
+            })
+            if tool_call.id:
+                entry['id'] = tool_call.id
+            if tool_call.function:
+                entry['function']['name'] += tool_call.function.name or ''
+                entry['function']['arguments'] += tool_call.function.arguments or ''
+        if delta.content:
+            self.__content.append(delta.content)
+            return delta.content
+        return None
+
+    def get_content(self):
+        """
+        Returns the text received so far.
+
+        Returns:
+            str: Text of the phrase, or None if no text was streamed.
+        """
+        return ''.join(self.__content) if self.__content else None
+
+    def get_tool_calls(self):
+        """
+        Returns the merged tool calls.
+
+        Returns:
+            list: ChatCompletionMessageToolCall objects, in index order.
+        """
+        from openai.types.chat import ChatCompletionMessageToolCall
+
+        return [ChatCompletionMessageToolCall.model_validate(self.__tool_calls[index])
+                for index in sorted(self.__tool_calls)]
+
+    def get_phrase(self):
+        """
+        Returns the assistant phrase to append to the conversation.
+
+        Returns:
+            dict: Assistant phrase, as a non-streamed message dump.
+        """
+        phrase = {'role': 'assistant'}
+        content = self.get_content()
+        if content is not None:
+            phrase['content'] = content
+        if self.__tool_calls:
+            phrase['tool_calls'] = [self.__tool_calls[index] for index in sorted(self.__tool_calls)]
+        return phrase
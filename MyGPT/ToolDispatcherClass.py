@@ -0,0 +1,321 @@
+import asyncio
+import functools
+import json
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from MyGPT import MetricsRecorderClass
+from MyGPT import ToolRegistryClass
+from MyGPT import SingleFlightClass
+
+class ToolDispatcher:
+    """
+    Runs the tool calls requested by GPT in a single turn concurrently.
+
+    Tools are submitted to a shared thread pool, so a turn with several independent
+    I/O-bound tools takes about as long as the slowest one. The resulting phrases are
+    always returned in the same order as the tool calls in the model response.
+
+    Arguments are checked by the validators of the tool registry before running a tool.
+    Calls with malformed or invalid arguments, or to unknown tools, are answered with
+    an error message so the model can correct them, instead of failing the turn. Tool
+    results are converted to strings with `ToolRegistryClass.to_tool_content`.
+
+    Identical calls (same function and arguments) running at the same moment, in this
+    turn or in other sessions sharing the single flight, run only once and share their
+    result; each shared call increments the 'tool_coalesced' counter.
+
+    A tool that times out is abandoned, but Python cannot stop its thread: it keeps its
+    worker until it returns. Size `max_workers` for the tools that may hang at once, or
+    give them timeouts of their own (e.g. network timeouts) so their workers are freed.
+
+    Attributes:
+        max_workers (int): Maximum number of tools running at the same time.
+        timeout (float): Default timeout in seconds for each tool (None waits forever).
+        cache (ResponseCache): Cache of tool results, or None.
+        metrics (MetricsRecorder): Recorder of a 'tool' span per tool run.
+        single_flight (SingleFlight): Coalescer of the identical calls in flight.
+        __timeouts (dict): Mapping of tool names to their own timeouts.
+        __executor: Thread pool used to run the tools, created on first use.
+        __executor_lock: Lock creating the thread pool only once when the dispatcher is shared.
+    """
+
+    def __init__(self, max_workers=4, timeout=None, cache=None, metrics=None, single_flight=None):
+        """
+        Initializes an instance of the ToolDispatcher class.
+
+        Args:
+            max_workers (int, optional): Maximum number of concurrent tools (default: 4).
+            timeout (float, optional): Default timeout in seconds for each tool (default: None).
+            cache (ResponseCache, optional): Cache of tool results (default: None).
+            metrics (MetricsRecorder, optional): Recorder of the tool spans (default: None).
+            single_flight (SingleFlight, optional): Coalescer of the identical calls in flight
+                (default: the SingleFlight shared by the process).
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = metrics or MetricsRecorderClass.NullMetrics()
+        self.single_flight = single_flight or SingleFlightClass.get_default_single_flight()
+        self.__timeouts = {}
+        self.__executor = None
+        self.__executor_lock = threading.Lock()
+
+    def set_timeout(self, name, timeout):
+        """
+        Sets the timeout of a specific tool, overriding the default one.
+
+        Args:
+            name (str): Name of the tool.
+            timeout (float): Timeout in seconds (None waits forever).
+        """
+        self.__timeouts[name] = timeout
+
+    def get_timeout(self, name):
+        """
+        Returns the timeout applied to a tool.
+
+        Args:
+            name (str): Name of the tool.
+
+        Returns:
+            float: Timeout in seconds or None.
+        """
+        return self.__timeouts.get(name, self.timeout)
+
+    def __get_executor(self):
+        """
+        Returns the thread pool, creating it on first use.
+        """
+        if self.__executor is None:
+            with self.__executor_lock:
+                if self.__executor is None:
+                    self.__executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                         thread_name_prefix='mygpt-tool')
+        return self.__executor
+
+    def __build_phrase(self, tool_call, content):
+        """
+        Builds the tool phrase appended to the conversation.
+
+        Args:
+            tool_call: Tool call object returned by GPT.
+            content (str): Result of the tool.
+
+        Returns:
+            dict: Tool phrase.
+        """
+        return {
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": tool_call.function.name,
+            "content": content,
+        }
+
+    def __timeout_message(self, name, timeout):
+        return f"Tool {name} did not finish in {timeout} seconds"
+
+    def __get_cached(self, name, args):
+        if self.cache is None:
+            return None
+        content = self.cache.get_tool(name, args)
+        if content is not None:
+            self.metrics.increment('tool_cache_hits', tool=name)
+        return content
+
+    def __parse_arguments(self, tool_call, tools_pointers, validators):
+        """
+        Decodes and validates the arguments of a tool call.
+
+        Returns:
+            dict: Validated arguments.
+
+        Raises:
+            ToolArgumentError: If the tool is unknown or its arguments are not valid.
+        """
+        name = tool_call.function.name
+        if name not in tools_pointers:
+            raise ToolRegistryClass.ToolArgumentError(f'Tool {name} does not exist')
+        try:
+            function_args = json.loads(tool_call.function.arguments or '{}')
+        except ValueError as error:
+            raise ToolRegistryClass.ToolArgumentError(f'Invalid arguments for tool {name}: malformed JSON ({error})')
+        validator = (validators or {}).get(name)
+        if validator is None:
+            return function_args
+        try:
+            return validator(function_args)
+        except ToolRegistryClass.ToolArgumentError as error:
+            raise ToolRegistryClass.ToolArgumentError(f'Invalid arguments for tool {name}: {error}')
+
+    def __prepare_call(self, tool_call, tools_pointers, validators):
+        """
+        Returns the arguments of a tool call and its content when it needs no run: an error
+        message for invalid calls or a cached result.
+        """
+        try:
+            function_args = self.__parse_arguments(tool_call, tools_pointers, validators)
+        except ToolRegistryClass.ToolArgumentError as error:
+            self.metrics.increment('tool_argument_errors', tool=tool_call.function.name)
+            return None, str(error)
+        return function_args, self.__get_cached(tool_call.function.name, function_args)
+
+    def __flight_key(self, function_to_call, function_args):
+        """
+        Returns the key of a tool call in the single flight, or None when the tool is not hashable.
+        """
+        try:
+            hash(function_to_call)
+        except TypeError:
+            return None
+        return function_to_call, SingleFlightClass.request_key(function_args)
+
+    def __call_tool(self, name, function_to_call, function_args):
+        """
+        Runs a tool inside a span.
+        """
+        with self.metrics.span('tool', tool=name) as span:
+            content = ToolRegistryClass.to_tool_content(function_to_call(**function_args))
+            span.set(response_bytes=len(content))
+            return content
+
+    def __run_tool(self, name, function_to_call, function_args):
+        """
+        Runs a tool, or waits for the identical call in flight, and caches its result.
+        """
+        key = self.__flight_key(function_to_call, function_args)
+        if key is None:
+            content, shared = self.__call_tool(name, function_to_call, function_args), False
+        else:
+            content, shared = self.single_flight.do('tool', key, self.__call_tool, name, function_to_call,
+                                                    function_args)
+        if shared:
+            self.metrics.increment('tool_coalesced', tool=name)
+        else:
+            self.__set_cached(name, function_args, content)
+        return content
+
+    async def __async_run_tool(self, name, function_to_call, function_args):
+        """
+        Awaits a coroutine tool, or a regular tool run in the thread pool, inside a span.
+        """
+        if asyncio.iscoroutinefunction(function_to_call):
+            awaitable = function_to_call(**function_args)
+        else:
+            awaitable = asyncio.get_running_loop().run_in_executor(
+                self.__get_executor(), functools.partial(contextvars.copy_context().run, function_to_call,
+                                                         **function_args))
+        with self.metrics.span('tool', tool=name) as span:
+            content = ToolRegistryClass.to_tool_content(await awaitable)
+            span.set(response_bytes=len(content))
+            return content
+
+    async def __async_run_flight(self, name, function_to_call, function_args):
+        """
+        Awaits a tool, or the identical call in flight, and caches its result.
+        """
+        key = self.__flight_key(function_to_call, function_args)
+        if key is None:
+            content, shared = await self.__async_run_tool(name, function_to_call, function_args), False
+        else:
+            content, shared = await self.single_flight.async_do('tool', key, self.__async_run_tool, name,
+                                                                function_to_call, function_args)
+        if shared:
+            self.metrics.increment('tool_coalesced', tool=name)
+        else:
+            self.__set_cached(name, function_args, content)
+        return content
+
+    def __set_cached(self, name, args, content):
+        if self.cache is not None:
+            self.cache.set_tool(name, args, content)
+
+    def dispatch(self, tool_calls, tools_pointers, validators=None):
+        """
+        Runs all tool calls of a turn and returns their phrases.
+
+        Tools that exceed their timeout are answered with a timeout message so the model
+        can go on; the worker thread is left to finish in background. Exceptions raised by
+        the tools are propagated to the caller. Results found in the cache are reused.
+
+        Args:
+            tool_calls (list): Tool calls returned by GPT.
+            tools_pointers (dict): Mapping of tool names to their functions.
+            validators (dict, optional): Mapping of tool names to their argument validators.
+
+        Returns:
+            list: Tool phrases, in the same order as `tool_calls`.
+        """
+        calls = []
+        contents = []
+        for tool_call in tool_calls:
+            function_args, content = self.__prepare_call(tool_call, tools_pointers, validators)
+            calls.append((tool_call, tools_pointers.get(tool_call.function.name), function_args))
+            contents.append(content)
+        pending = [index for index, content in enumerate(contents) if content is None]
+        if len(pending) == 1 and self.get_timeout(calls[pending[0]][0].function.name) is None:
+            tool_call, function_to_call, function_args = calls[pending[0]]
+            contents[pending[0]] = self.__run_tool(tool_call.function.name, function_to_call, function_args)
+        elif pending:
+            executor = self.__get_executor()
+            started = time.monotonic()
+            # Each tool runs in a copy of the caller's context, keeping its output sink and priority
+            futures = {index: executor.submit(contextvars.copy_context().run, self.__run_tool,
+                                              calls[index][0].function.name, calls[index][1], calls[index][2])
+                       for index in pending}
+            for index, future in futures.items():
+                tool_call, _, function_args = calls[index]
+                timeout = self.get_timeout(tool_call.function.name)
+                remaining = None if timeout is None else max(0, started + timeout - time.monotonic())
+                try:
+                    contents[index] = future.result(timeout=remaining)
+                except FutureTimeoutError:
+                    future.cancel()
+                    self.metrics.increment('tool_timeouts', tool=tool_call.function.name)
+                    contents[index] = self.__timeout_message(tool_call.function.name, timeout)
+        return [self.__build_phrase(tool_call, content) for (tool_call, _, _), content in zip(calls, contents)]
+
+    def shutdown(self, wait=True):
+        """
+        Stops the thread pool. A new one is created if the dispatcher is used again.
+
+        Args:
+            wait (bool, optional): Whether to wait for running tools (default: True).
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=wait)
+            self.__executor = None
+
+    async def async_dispatch(self, tool_calls, tools_pointers, validators=None):
+        """
+        Runs all tool calls of a turn on the running event loop and returns their phrases.
+
+        Coroutine tools are awaited directly and regular functions are offloaded to the
+        dispatcher thread pool, so blocking tools do not stall the event loop.
+
+        Args:
+            tool_calls (list): Tool calls returned by GPT.
+            tools_pointers (dict): Mapping of tool names to their functions or coroutines.
+            validators (dict, optional): Mapping of tool names to their argument validators.
+
+        Returns:
+            list: Tool phrases, in the same order as `tool_calls`.
+        """
+        async def run(tool_call):
+            function_name = tool_call.function.name
+            function_to_call = tools_pointers.get(function_name)
+            function_args, content = self.__prepare_call(tool_call, tools_pointers, validators)
+            if content is not None:
+                return self.__build_phrase(tool_call, content)
+            timeout = self.get_timeout(function_name)
+            try:
+                content = await asyncio.wait_for(self.__async_run_flight(function_name, function_to_call,
+                                                                         function_args), timeout=timeout)
+            except asyncio.TimeoutError:
+                self.metrics.increment('tool_timeouts', tool=function_name)
+                content = self.__timeout_message(function_name, timeout)
+            return self.__build_phrase(tool_call, content)
+
+        return list(await asyncio.gather(*[run(tool_call) for tool_call in tool_calls]))
@@ -0,0 +1,487 @@
+import re
+import enum
+import json
+import typing
+import inspect
+import unicodedata
+
+JSON_TYPES = {str: 'string', int: 'integer', float: 'number', bool: 'boolean', list: 'array', tuple: 'array',
+              dict: 'object'}
+DOCSTRING_TYPES = {'str': 'string', 'int': 'integer', 'float': 'number', 'bool': 'boolean', 'list': 'array',
+                   'tuple': 'array', 'dict': 'object'}
+DOCSTRING_SECTIONS = ('Args:', 'Arguments:', 'Returns:', 'Yields:', 'Raises:', 'Attributes:', 'Examples:', 'Note:')
+
+class ToolArgumentError(ValueError):
+    """
+    Raised when the arguments of a tool call do not match the tool schema.
+    """
+
+def normalize_words(text):
+    """
+    Splits a text in lowercase words without accents, so 'Ações' matches 'acoes'.
+
+    Args:
+        text (str): Text to split.
+
+    Returns:
+        list: Words of the text.
+    """
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii')
+    return re.findall(r'\w+', text.lower())
+
+def compact_text(text):
+    """
+    Collapses the runs of whitespace of a description, left by line continuations in the source.
+
+    Args:
+        text (str): Description.
+
+    Returns:
+        str: Description with single spaces.
+    """
+    return ' '.join(text.split())
+
+def _compact_schema(schema):
+    """
+    Returns a copy of a JSON schema with compacted descriptions.
+    """
+    if isinstance(schema, dict):
+        return {key: compact_text(value) if key == 'description' and isinstance(value, str) else _compact_schema(value)
+                for key, value in schema.items()}
+    if isinstance(schema, list):
+        return [_compact_schema(value) for value in schema]
+    return schema
+
+def last_user_text(conversation):
+    """
+    Returns the text of the last user phrase of a conversation.
+
+    Args:
+        conversation (list): Conversation phrases.
+
+    Returns:
+        str: Text of the phrase, or None if there is no user phrase.
+    """
+    for message in reversed(conversation):
+        if message.get('role') == 'user':
+            content = message.get('content')
+            if isinstance(content, list):
+                return ' '.join(part['text'] for part in content if part.get('type') == 'text')
+            return content
+    return None
+
+def to_tool_content(result):
+    """
+    Converts the result of a tool to the string sent back to GPT.
+
+    Args:
+        result: Value returned by the tool.
+
+    Returns:
+        str: The result itself for strings, JSON for dicts and lists, '' for None and `str` otherwise.
+    """
+    if isinstance(result, str):
+        return result
+    if result is None:
+        return ''
+    if isinstance(result, (dict, list, tuple)):
+        return json.dumps(result, ensure_ascii=False, default=str)
+    return str(result)
+
+def _check_type(kind, value):
+    if kind == 'string':
+        return isinstance(value, str)
+    if kind == 'integer':
+        return isinstance(value, int) and not isinstance(value, bool)
+    if kind == 'number':
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == 'boolean':
+        return isinstance(value, bool)
+    if kind == 'array':
+        return isinstance(value, list)
+    if kind == 'object':
+        return isinstance(value, dict)
+    if kind == 'null':
+        return value is None
+    return True
+
+def _compile_check(schema):
+    """
+    Builds the function checking a value against a JSON schema.
+
+    Only the keywords used in tool schemas are supported: type, enum, items and properties.
+    """
+    kinds = schema.get('type')
+    kinds = (kinds,) if isinstance(kinds, str) else tuple(kinds or ())
+    enum_values = schema.get('enum')
+    items = _compile_check(schema['items']) if isinstance(schema.get('items'), dict) else None
+    properties = compile_validator(schema) if 'properties' in schema else None
+
+    def check(value, path):
+        if kinds and not any(_check_type(kind, value) for kind in kinds):
+            if 'integer' in kinds and isinstance(value, float) and value.is_integer():
+                value = int(value)
+            else:
+                raise ToolArgumentError(f'{path} must be of type {" or ".join(kinds)}, got {type(value).__name__}')
+        if enum_values is not None and value not in enum_values:
+            raise ToolArgumentError(f'{path} must be one of {", ".join(json.dumps(v) for v in enum_values)}')
+        if items is not None and isinstance(value, list):
+            value = [items(item, f'{path}[{index}]') for index, item in enumerate(value)]
+        if properties is not None and isinstance(value, dict):
+            value = properties(value, path)
+        return value
+    return check
+
+def compile_validator(parameters):
+    """
+    Builds the function validating the arguments of a tool, once per schema.
+
+    Missing required arguments, wrong types and values out of an enum are rejected.
+    Integral floats are accepted as integers. Arguments missing from the schema
+    properties are dropped.
+
+    Args:
+        parameters (dict): JSON schema of the tool parameters.
+
+    Returns:
+        function: Receives the decoded arguments (and optionally their path) and returns the
+            validated arguments, raising ToolArgumentError when they are not valid.
+    """
+    if not parameters or 'properties' not in parameters:
+        return lambda args, path='arguments': args
+    checks = {name: _compile_check(schema) for name, schema in parameters['properties'].items()}
+    required = tuple(parameters.get('required', ()))
+
+    def validate(args, path='arguments'):
+        if not isinstance(args, dict):
+            raise ToolArgumentError(f'{path} must be a JSON object')
+        missing = [name for name in required if name not in args]
+        if missing:
+            raise ToolArgumentError(f'missing required {path}: {", ".join(missing)}')
+        return {name: checks[name](value, name if path == 'arguments' else f'{path}.{name}')
+                for name, value in args.items() if name in checks}
+    return validate
+
+def parse_docstring(docstring):
+    """
+    Reads the summary and the argument descriptions of a Google style docstring.
+
+    Args:
+        docstring (str): Docstring of a function.
+
+    Returns:
+        tuple: Summary (first paragraph) and mapping of argument names to (type, description) pairs.
+    """
+    lines = inspect.cleandoc(docstring or '').splitlines()
+    summary = []
+    for line in lines:
+        if not line.strip() or line.strip() in DOCSTRING_SECTIONS:
+            break
+        summary.append(line.strip())
+    arguments = {}
+    current = None
+    in_args = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped in DOCSTRING_SECTIONS:
+            in_args = stripped in ('Args:', 'Arguments:')
+            current = None
+            continue
+        if not in_args or not stripped:
+            continue
+        match = re.match(r'^\*{0,2}(\w+)\s*(?:\(([^)]*)\))?\s*:\s*(.*)$', stripped)
+        if match and line.startswith(' ' * 4) and not line.startswith(' ' * 5):
+            current = match.group(1)
+            arguments[current] = [(match.group(2) or '').split(',')[0].strip(), match.group(3)]
+        elif current is not None:
+            arguments[current][1] = f'{arguments[current][1]} {stripped}'
+    return ' '.join(summary), {name: (kind, description) for name, (kind, description) in arguments.items()}
+
+def annotation_schema(annotation, docstring_type=''):
+    """
+    Converts a type hint to a JSON schema.
+
+    Args:
+        annotation: Type hint of a parameter, or `inspect.Parameter.empty`.
+        docstring_type (str, optional): Type written in the docstring, used when there is no hint.
+
+    Returns:
+        dict: JSON schema of the type.
+    """
+    if annotation is inspect.Parameter.empty:
+        kind = DOCSTRING_TYPES.get(docstring_type)
+        return {'type': kind} if kind else {}
+    origin = typing.get_origin(annotation)
+    arguments = typing.get_args(annotation)
+    if origin is typing.Literal:
+        schema = annotation_schema(type(arguments[0]))
+        schema['enum'] = list(arguments)
+        return schema
+    if origin is typing.Union:
+        options = [argument for argument in arguments if argument is not type(None)]
+        return annotation_schema(options[0]) if len(options) == 1 else {}
+    if origin in (list, tuple, set, frozenset):
+        schema = {'type': 'array'}
+        if arguments and arguments[0] is not Ellipsis:
+            schema['items'] = annotation_schema(arguments[0])
+        return schema
+    if origin is dict:
+        return {'type': 'object'}
+    if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+        values = [member.value for member in annotation]
+        schema = annotation_schema(type(values[0])) if values else {}
+        schema['enum'] = values
+        return schema
+    for python_type, kind in JSON_TYPES.items():
+        if annotation is python_type:
+            return {'type': kind}
+    return {}
+
+def schema_from_function(func, name=None, description=None):
+    """
+    Builds the registration schema of a tool from the signature and docstring of a function.
+
+    Parameters without a default value are required; `self`, `cls`, `*args` and
+    `**kwargs` are skipped. Types come from the hints, or from the docstring when a
+    parameter has none.
+
+    Args:
+        func (function): Function of the tool.
+        name (str, optional): Name of the tool (default: the function name).
+        description (str, optional): Description of the tool (default: the docstring summary).
+
+    Returns:
+        dict: Registration schema, as sent in the `tools` parameter.
+    """
+    summary, documented = parse_docstring(func.__doc__)
+    hints = typing.get_type_hints(func, include_extras=False)
+    properties = {}
+    required = []
+    for index, parameter in enumerate(inspect.signature(func).parameters.values()):
+        if index == 0 and parameter.name in ('self', 'cls'):
+            continue
+        if parameter.kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD):
+            continue
+        docstring_type, parameter_description = documented.get(parameter.name, ('', ''))
+        schema = annotation_schema(hints.get(parameter.name, inspect.Parameter.empty), docstring_type)
+        if parameter_description:
+            schema['description'] = compact_text(parameter_description)
+        properties[parameter.name] = schema
+        if parameter.default is inspect.Parameter.empty:
+            required.append(parameter.name)
+    parameters = {'type': 'object', 'properties': properties}
+    if required:
+        parameters['required'] = required
+    return {
+        'type': 'function',
+        'function': {
+            'name': name or func.__name__,
+            'description': compact_text(description or summary),
+            'parameters': parameters
+        }
+    }
+
+def tool(name=None, description=None, keywords=None, timeout=None):
+    """
+    Decorator turning a function into a tool, with its schema derived once from its signature.
+
+    The function is returned unchanged, with a `tool_info` attribute holding the
+    registration info accepted by `MyGPT.add_tool`, so it can be registered with
+    `MyGPT.add_tools`. Methods keep the attribute when bound.
+
+    Args:
+        name (str, optional): Name of the tool (default: the function name).
+        description (str, optional): Description of the tool (default: the docstring summary).
+        keywords (list, optional): Words that make the tool relevant to a phrase, for the tool routing.
+        timeout (float, optional): Timeout in seconds of the tool (default: the dispatcher timeout).
+
+    Returns:
+        function: Decorator.
+    """
+    def decorator(func):
+        schema = schema_from_function(func, name=name, description=description)
+        validate_schema(schema['function']['name'], schema)
+        func.tool_info = {'name': schema['function']['name'], 'registration_info': schema, 'keywords': keywords}
+        if timeout is not None:
+            func.tool_info['timeout'] = timeout
+        return func
+    return decorator
+
+def validate_schema(name, schema):
+    """
+    Checks the registration schema of a function tool.
+
+    Args:
+        name (str): Name the tool is registered with.
+        schema (dict): Registration schema, as sent in the `tools` parameter.
+
+    Raises:
+        ValueError: If the schema is not a valid function tool named `name`.
+    """
+    if not isinstance(schema, dict) or schema.get('type') != 'function' or not isinstance(schema.get('function'), dict):
+        raise ValueError(f'Tool {name} must be a dict with type "function" and a "function" object')
+    function = schema['function']
+    if function.get('name') != name:
+        raise ValueError(f'Tool {name} is registered with the function name {function.get("name")!r}')
+    if not re.fullmatch(r'[a-zA-Z0-9_-]{1,64}', name):
+        raise ValueError(f'Tool name {name!r} must have up to 64 letters, digits, "_" or "-"')
+    parameters = function.get('parameters', {})
+    if not isinstance(parameters, dict):
+        raise ValueError(f'Parameters of tool {name} must be a JSON schema object')
+    properties = parameters.get('properties', {})
+    if parameters and (parameters.get('type') != 'object' or not isinstance(properties, dict)):
+        raise ValueError(f'Parameters of tool {name} must be of type "object" with a "properties" object')
+    missing = set(parameters.get('required', [])) - set(properties)
+    if missing:
+        raise ValueError(f'Tool {name} requires undeclared parameters: {", ".join(sorted(missing))}')
+
+class ToolSelection:
+    """
+    Tools sent in a request, prepared once and reused by every request sending them.
+
+    Attributes:
+        names (tuple): Names of the tools.
+        schemas (list): Registration schemas of the tools, sent in the `tools` parameter.
+        encoded (str): JSON encoding of the schemas, used to count their tokens.
+    """
+    __slots__ = ('names', 'schemas', 'encoded')
+
+    def __init__(self, names, schemas):
+        self.names = names
+        self.schemas = schemas
+        self.encoded = json.dumps(schemas, ensure_ascii=False)
+
+class ToolRegistry:
+    """
+    Keeps the tools available to GPT, validated and serialized once.
+
+    Schemas are checked and their descriptions compacted when registered. The list of
+    schemas sent with each request and its JSON encoding are built once per set of
+    tools and then reused, instead of being rebuilt and re-encoded on every request.
+
+    With `routing`, only the tools relevant to the last user phrase are sent. A tool is
+    relevant when a word of the phrase starts with one of its keywords (the words of its
+    name are keywords too). Tools registered without keywords are always sent, and all
+    tools are sent when no keyword matches, so the model is never left without the tool
+    it needs.
+
+    Attributes:
+        routing (bool): Whether tools are selected by keyword on each turn.
+        max_tools (int): Maximum number of keyword-matched tools sent, best matches first (None sends all).
+        __schemas (dict): Mapping of tool names to their compacted schemas, in registration order.
+        __functions (dict): Mapping of tool names to their functions.
+        __keywords (dict): Mapping of tool names to their normalized keywords, None for tools always sent.
+        __validators (dict): Mapping of tool names to their compiled argument validators.
+        __selections (dict): Prepared ToolSelection of each set of tool names.
+    """
+
+    def __init__(self, routing=False, max_tools=None):
+        """
+        Initializes an instance of the ToolRegistry class.
+
+        Args:
+            routing (bool, optional): Whether tools are selected by keyword on each turn (default: False).
+            max_tools (int, optional): Maximum number of keyword-matched tools sent (default: None, all).
+        """
+        self.routing = routing
+        self.max_tools = max_tools
+        self.__schemas = {}
+        self.__functions = {}
+        self.__keywords = {}
+        self.__validators = {}
+        self.__selections = {}
+
+    def register(self, name, schema, func, keywords=None):
+        """
+        Validates and registers a tool, replacing any tool with the same name. The validator of
+        its arguments is compiled from the schema.
+
+        Args:
+            name (str): Name of the tool.
+            schema (dict): Registration schema, as sent in the `tools` parameter.
+            func (function): Function or coroutine function run for the tool calls.
+            keywords (list, optional): Words that make the tool relevant to a phrase. Without
+                keywords the tool is always sent.
+
+        Raises:
+            ValueError: If the schema is not valid.
+        """
+        validate_schema(name, schema)
+        self.__schemas[name] = _compact_schema(schema)
+        self.__functions[name] = func
+        self.__validators[name] = compile_validator(schema['function'].get('parameters'))
+        if keywords:
+            self.__keywords[name] = tuple({word for keyword in [name.replace('_', ' '), *keywords]
+                                           for word in normalize_words(keyword) if len(word) > 2})
+        else:
+            self.__keywords[name] = None
+        self.__selections.clear()
+
+    def get_functions(self):
+        """
+        Returns the functions of the tools, used by the tool dispatcher.
+
+        Returns:
+            dict: Mapping of tool names to their functions.
+        """
+        return self.__functions
+
+    def get_validators(self):
+        """
+        Returns the argument validators of the tools, used by the tool dispatcher.
+
+        Returns:
+            dict: Mapping of tool names to their validators.
+        """
+        return self.__validators
+
+    def get_names(self):
+        """
+        Returns the names of the registered tools.
+
+        Returns:
+            list: Tool names, in registration order.
+        """
+        return list(self.__schemas)
+
+    def get_selection(self, names=None):
+        """
+        Returns the prepared schemas of a set of tools.
+
+        Args:
+            names (tuple, optional): Names of the tools (default: all tools).
+
+        Returns:
+            ToolSelection: Prepared tools.
+        """
+        names = tuple(self.__schemas) if names is None else tuple(names)
+        selection = self.__selections.get(names)
+        if selection is None:
+            selection = ToolSelection(names, [self.__schemas[name] for name in names])
+            self.__selections[names] = selection
+        return selection
+
+    def select(self, text):
+        """
+        Returns the tools to send for a user phrase.
+
+        Args:
+            text (str): Last user phrase.
+
+        Returns:
+            ToolSelection: Prepared tools. All tools when routing is disabled or nothing matches.
+        """
+        if not self.routing or not text:
+            return self.get_selection()
+        words = set(normalize_words(text))
+        scores = {}
+        for name, keywords in self.__keywords.items():
+            if keywords is not None:
+                score = sum(1 for keyword in keywords if any(word.startswith(keyword) for word in words))
+                if score:
+                    scores[name] = score
+        if not scores:
+            return self.get_selection()
+        matched = sorted(scores, key=scores.get, reverse=True)[:self.max_tools]
+        return self.get_selection(name for name, keywords in self.__keywords.items()
+                                  if keywords is None or name in matched)
@@ -1,33 +1,120 @@
-import base64
-import yfinance as yf
+import json
 import os
+import threading
+from typing import Literal
 from termcolor import colored
 
+from MyGPT import ImagePipelineClass
+from MyGPT import ToolRegistryClass
+from MyGPT import OutputSinkClass
+
+StockPeriod = Literal['1d', '5d', '1mo', '6mo', '1y', '5y', '10y', 'ytd', 'max']
+STOCK_KEYWORDS = ['ação', 'ações', 'bolsa', 'cotação', 'preço', 'ticker', 'papel', 'papéis', 'stock']
+
+# Created on the first stock call, so pandas and yfinance are not loaded by chat-only processes
+_stock_data_source = None
+_stock_data_source_lock = threading.Lock()
+_image_pipeline = ImagePipelineClass.ImagePipeline()
+
 def print_assistant(text, end='\n'):
-    print(colored(text, 'blue'), end=end)
+    OutputSinkClass.get_current_sink().emit(OutputSinkClass.TOKEN if end == '' else OutputSinkClass.ASSISTANT, text)
 
 def print_warn(text, end='\n'):
-    print(colored(text, 'red'), end=end)
+    OutputSinkClass.get_current_sink().emit(OutputSinkClass.WARN, text)
 
 def input_user(text):
     return input(colored(text, 'green'))
 
 def encode_image(image_path):
-    print(colored(os.getcwd(), 'red'))
     with open(image_path, 'rb' ) as img:
-        return base64.b64encode(img.read()).decode('utf-8')
+        return ImagePipelineClass.encode_stream(img)
+
+def image_data_url(image_path):
+    return _image_pipeline.prepare(image_path)
+
+def set_image_pipeline(image_pipeline):
+    global _image_pipeline
+    _image_pipeline = image_pipeline
+
+def get_image_pipeline():
+    return _image_pipeline
     
 def get_file_extension(file_path):
     filename, file_extension = os.path.splitext(file_path)
     return file_extension[1:].lower()
     
-def get_stock_price(stock_name, period='1mo', **args):
+def load_assistant_ids(cache_path):
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def save_assistant_id(cache_path, key, assistant_id):
+    if not cache_path:
+        return
+    assistant_ids = load_assistant_ids(cache_path)
+    if assistant_id is None:
+        assistant_ids.pop(key, None)
+    else:
+        assistant_ids[key] = assistant_id
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as cache_file:
+        json.dump(assistant_ids, cache_file)
+    os.replace(temp_path, cache_path)
+
+def set_stock_data_source(data_source):
+    global _stock_data_source
+    with _stock_data_source_lock:
+        _stock_data_source = data_source
+
+def get_stock_data_source():
+    global _stock_data_source
+    with _stock_data_source_lock:
+        if _stock_data_source is None:
+            from MyGPT import StockDataSourceClass
+            _stock_data_source = StockDataSourceClass.CachedDataSource(StockDataSourceClass.YahooDataSource())
+        return _stock_data_source
+
+@ToolRegistryClass.tool(keywords=STOCK_KEYWORDS)
+def get_stock_price(stock_name: str, period: StockPeriod = '1mo', **args):
+    """
+    Retrieve current brazilian companies stock prices
+
+    Args:
+        stock_name (str): Company name
+        period (str, optional): Historical period that will be returned with historical data as "1mo" representing
+            a month, "1d" representing a day and "1y" representing a year (default: '1mo')
+    """
     print_warn(f"Redirecionando para a api de stock exchange do Yahoo")
-    ticker_obj = yf.Ticker(f'{stock_name}')
-    hist = ticker_obj.history(period=period)['Close']
+    from MyGPT import StockDataSourceClass
+    hist = get_stock_data_source().history([f'{stock_name}'], period=period)[f'{stock_name}'].dropna()
     hist.index = hist.index.strftime('%Y-%m-%d')
     hist = round(hist, 2)
-    if len(hist) > 30:
-        slice_size = int(len(hist) / 30)
-        hist = hist.iloc[::-slice_size][::-1]
-    return hist.to_json()
\ No newline at end of file
+    hist = StockDataSourceClass.downsample(hist)
+    return hist.to_json()
+
+@ToolRegistryClass.tool(keywords=STOCK_KEYWORDS + ['compare', 'comparar'])
+def get_stock_prices(stock_names: list[str], period: StockPeriod = '1mo', **args):
+    """
+    Retrieve current brazilian companies stock prices of several companies at once
+
+    Args:
+        stock_names (list): Companies names
+        period (str, optional): Historical period that will be returned with historical data as "1mo" representing
+            a month, "1d" representing a day and "1y" representing a year (default: '1mo')
+    """
+    print_warn(f"Redirecionando para a api de stock exchange do Yahoo")
+    from MyGPT import StockDataSourceClass
+    closes = get_stock_data_source().history(stock_names, period=period).dropna(how='all')
+    closes = StockDataSourceClass.downsample(closes.round(2))
+    # One shared list of dates and one list of closes per stock (null where there is no close)
+    values = closes.astype(object).where(closes.notna(), None)
+    prices = {
+        'dates': closes.index.strftime('%Y-%m-%d').tolist(),
+        'closes': {stock_name: values[stock_name].tolist() for stock_name in closes.columns}
+    }
+    return json.dumps(prices, separators=(',', ':'))
\ No newline at end of file
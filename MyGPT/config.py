@@ -0,0 +1,38 @@
+import os
+import threading
+
+_loaded = False
+_loaded_lock = threading.Lock()
+
+def load_config(dotenv_path=None, override=False):
+    """
+    Loads the settings of a .env file, as OPENAI_API_KEY, into the environment.
+
+    Importing MyGPT does not read any file; applications call this once at startup.
+    Without a path, the .env file is searched from the current directory up, then from
+    the package directory up.
+
+    Args:
+        dotenv_path (str, optional): Path of the .env file (default: None, searched).
+        override (bool, optional): Whether the file overrides the variables already set (default: False).
+
+    Returns:
+        bool: True if a file was found and loaded.
+    """
+    from dotenv import load_dotenv, find_dotenv
+
+    global _loaded
+    with _loaded_lock:
+        _loaded = True
+    path = dotenv_path or find_dotenv(usecwd=True) or find_dotenv()
+    return bool(path) and load_dotenv(path, override=override)
+
+def ensure_config():
+    """
+    Loads the .env file once when `load_config` was not called and no API key is set.
+
+    Called before the first OpenAI client is created, so applications that relied on
+    the .env file being read at import keep working.
+    """
+    if not _loaded and 'OPENAI_API_KEY' not in os.environ:
+        load_config()
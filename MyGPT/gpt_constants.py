@@ -1,3 +1,4 @@
+import os
 from typing import Final
 
 CODE_ASSISTANT_NAME: Final = 'Tudor de matemática da ChedidTech'
@@ -6,3 +7,35 @@ CODE_ASSISTANT_INSTRUCTIONS: Final = """ Você é um tutor pessoal de matemátic
     Caso o usuário seja um expert, responda descrevendo os passos utilizados para a resposta além do resultado final.
     Caso contrário, responda apenas o resultado final.
 """
+ASSISTANTS_CACHE_PATH: Final = os.path.join(os.path.expanduser('~'), '.mygpt', 'assistants.json')
+CONVERSATIONS_PATH: Final = os.path.join(os.path.expanduser('~'), '.mygpt', 'conversations')
+
+MODEL_CONTEXT_WINDOWS: Final = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4-0125': 128000,
+    'gpt-4-1106': 128000,
+    'gpt-4o': 128000,
+}
+DEFAULT_CONTEXT_WINDOW: Final = 4096
+IMAGE_PART_TOKENS: Final = 765
+ROUTER_MODELS: Final = ('gpt-3.5-turbo-0125', 'gpt-4o')
+
+SUMMARY_INSTRUCTIONS: Final = """ Resuma de forma concisa a conversa abaixo entre um usuário e um assistente.
+    Mantenha nomes, números, resultados de ferramentas e decisões importantes.
+    Responda apenas com o resumo.
+"""
+SUMMARY_PREFIX: Final = 'Resumo da conversa anterior: '
+
+VISION_MODEL: Final = 'gpt-4o'
+VISION_MAX_SIDE: Final = 2048
+VISION_SHORT_SIDE: Final = 768
+# Tokens counted per image by the rate limiter, as a 768x1024 image in high detail
+VISION_IMAGE_TOKENS: Final = 765
+
+EMBEDDING_MODEL: Final = 'text-embedding-3-small'
+# Seconds until the semantic cache answers built with each tool expire
+SEMANTIC_CACHE_TOOL_TTLS: Final = {'get_stock_price': 300, 'get_stock_prices': 300}
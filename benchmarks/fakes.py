@@ -0,0 +1,189 @@
+"""
+Local stand-ins for the OpenAI and Yahoo Finance APIs, with configurable latency.
+
+The fake client implements the subset of `openai.Client` used by MyGPT: chat
+completions (streamed or not, with tool calls) and the Assistants API (assistants,
+threads, messages and polled runs). Its responses are built with the SDK types, so
+MyGPT handles them exactly as real ones.
+"""
+import json
+import time
+import itertools
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+_ids = itertools.count()
+
+def count_tokens(text):
+    """
+    Rough token count used for the fake usage, about four characters per token.
+    """
+    return len(text) // 4 + 1
+
+def completion(content=None, tool_calls=None, prompt_tokens=0, model='gpt-3.5-turbo-0125'):
+    """
+    Builds a chat completion.
+
+    Args:
+        content (str, optional): Text of the answer.
+        tool_calls (list, optional): (name, arguments) pairs of the requested tools.
+        prompt_tokens (int, optional): Prompt tokens reported in the usage.
+        model (str, optional): Model reported in the response.
+
+    Returns:
+        ChatCompletion: Completion as returned by the SDK.
+    """
+    message = {'role': 'assistant', 'content': content}
+    if tool_calls:
+        message['tool_calls'] = [{'id': f'call_{next(_ids)}', 'type': 'function',
+                                  'function': {'name': name, 'arguments': json.dumps(arguments)}}
+                                 for name, arguments in tool_calls]
+    completion_tokens = count_tokens(content or json.dumps(tool_calls or []))
+    return ChatCompletion.model_validate({
+        'id': f'chatcmpl-{next(_ids)}', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+        'choices': [{'index': 0, 'finish_reason': 'tool_calls' if tool_calls else 'stop', 'message': message}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens}
+    })
+
+def completion_chunks(response):
+    """
+    Splits a completion in the chunks of a streamed response.
+
+    Args:
+        response (ChatCompletion): Complete response.
+
+    Returns:
+        list: ChatCompletionChunk objects, one per word and per piece of tool arguments.
+    """
+    def chunk(delta):
+        return ChatCompletionChunk.model_validate({'id': response.id, 'object': 'chat.completion.chunk',
+                                                   'created': response.created, 'model': response.model,
+                                                   'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})
+
+    message = response.choices[0].message
+    chunks = [chunk({'role': 'assistant'})]
+    for index, tool_call in enumerate(message.tool_calls or []):
+        chunks.append(chunk({'tool_calls': [{'index': index, 'id': tool_call.id, 'type': 'function',
+                                             'function': {'name': tool_call.function.name, 'arguments': ''}}]}))
+        arguments = tool_call.function.arguments
+        for start in range(0, len(arguments), 16):
+            chunks.append(chunk({'tool_calls': [{'index': index, 'function': {'arguments': arguments[start:start + 16]}}]}))
+    if message.content:
+        words = message.content.split(' ')
+        chunks.extend(chunk({'content': word if index == 0 else f' {word}'}) for index, word in enumerate(words))
+    return chunks
+
+class FakeOpenAIClient:
+    """
+    Fake `openai.Client` answering from a responder function after a simulated latency.
+
+    Attributes:
+        responder (function): Called with the request parameters, returns a ChatCompletion.
+        latency (float): Seconds before a response (or the first streamed chunk).
+        token_interval (float): Seconds between streamed chunks.
+        run_latency (float): Seconds an assistant run stays in progress.
+        api_key (str): Fake API key, used to scope the assistant IDs cache.
+        requests (int): Number of requests received.
+    """
+
+    def __init__(self, responder, latency=0.05, token_interval=0.002, run_latency=0.3):
+        self.responder = responder
+        self.latency = latency
+        self.token_interval = token_interval
+        self.run_latency = run_latency
+        self.api_key = 'sk-benchmark'
+        self.requests = 0
+        self.__lock = threading.Lock()
+        self.__runs = {}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.__create_completion))
+        self.beta = SimpleNamespace(
+            assistants=SimpleNamespace(list=self.__list_assistants, create=self.__create_object),
+            threads=SimpleNamespace(
+                create=self.__create_object,
+                delete=self.__delete_object,
+                messages=SimpleNamespace(create=self.__create_object, list=self.__list_messages),
+                runs=SimpleNamespace(create=self.__create_run, retrieve=self.__retrieve_run)
+            )
+        )
+
+    def __count_request(self):
+        with self.__lock:
+            self.requests += 1
+
+    def __create_completion(self, **params):
+        self.__count_request()
+        time.sleep(self.latency)
+        response = self.responder(params)
+        if not params.get('stream'):
+            return response
+        return self.__stream(completion_chunks(response))
+
+    def __stream(self, chunks):
+        for chunk in chunks:
+            yield chunk
+            time.sleep(self.token_interval)
+
+    def __list_assistants(self, **params):
+        self.__count_request()
+        time.sleep(self.latency)
+        return []
+
+    def __create_object(self, **params):
+        self.__count_request()
+        time.sleep(self.latency)
+        return SimpleNamespace(id=f'obj_{next(_ids)}')
+
+    def __delete_object(self, object_id, **params):
+        self.__count_request()
+        time.sleep(self.latency)
+        return SimpleNamespace(id=object_id, deleted=True)
+
+    def __create_run(self, **params):
+        run = self.__create_object(**params)
+        self.__runs[run.id] = time.monotonic() + self.run_latency
+        return run
+
+    def __retrieve_run(self, thread_id, run_id, **params):
+        self.__count_request()
+        time.sleep(self.latency)
+        status = 'completed' if time.monotonic() >= self.__runs.get(run_id, 0) else 'in_progress'
+        return SimpleNamespace(id=run_id, status=status)
+
+    def __list_messages(self, **params):
+        self.__count_request()
+        time.sleep(self.latency)
+        text = SimpleNamespace(value='A probabilidade é de aproximadamente 0,0112.')
+        return SimpleNamespace(data=[SimpleNamespace(content=[SimpleNamespace(text=text)])])
+
+class FakeStockSource:
+    """
+    Fake stock data source returning deterministic closes after a simulated latency.
+
+    Attributes:
+        latency (float): Seconds before each history is returned.
+        days (int): Number of business days of history available.
+        requests (int): Number of histories requested.
+    """
+
+    def __init__(self, latency=0.1, days=2600):
+        self.latency = latency
+        self.days = days
+        self.requests = 0
+
+    def history(self, tickers, period='1mo', start=None):
+        from MyGPT import StockDataSourceClass
+
+        self.requests += 1
+        time.sleep(self.latency)
+        tickers = list(tickers)
+        index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=self.days)
+        closes = pd.DataFrame({ticker: 20 + np.cumsum(np.sin(np.arange(self.days) / (7 + position)))
+                               for position, ticker in enumerate(tickers)}, index=index)
+        if start:
+            return closes.loc[pd.Timestamp(start):]
+        return StockDataSourceClass.slice_period(closes, period)
@@ -0,0 +1,77 @@
+"""
+Measures the time to import the MyGPT modules in fresh interpreters, and checks that
+the heavy dependencies are only loaded on first use.
+
+Usage, from the repository root:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --module MyGPT.SessionManagerClass --repeat 10 --budget-ms 200
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+MODULES = ['MyGPT.BotClass', 'MyGPT.AsyncMyGPTClass', 'MyGPT.SessionManagerClass']
+# Dependencies loaded on first use only: the OpenAI SDK with the first client, yfinance and
+# pandas with the first stock call, NumPy with the semantic cache, Pillow with the first local image
+LAZY_DEPENDENCIES = ['openai', 'httpx', 'pydantic', 'yfinance', 'pandas', 'numpy', 'PIL', 'dotenv', 'tiktoken']
+
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+def measure(module, repeat):
+    """
+    Imports a module in `repeat` fresh interpreters.
+
+    Args:
+        module (str): Module to import.
+        repeat (int): Number of interpreters.
+
+    Returns:
+        dict: Median and minimum import time in milliseconds, and the lazy dependencies loaded by the import.
+    """
+    samples, loaded = [], set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, lazy=LAZY_DEPENDENCIES)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        samples.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return {
+        'module': module,
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'min_ms': round(min(samples) * 1000, 1),
+        'eager_dependencies': sorted(loaded),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import time of the MyGPT modules.')
+    parser.add_argument('--module', action='append', help='Module to import, may be repeated (default: the entry points).')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per module (default: 5).')
+    parser.add_argument('--budget-ms', type=float,
+                        help='Fail when the median import time of a module is above this budget.')
+    parser.add_argument('--json', help='Path of a JSON file to write the results to.')
+    args = parser.parse_args(argv)
+
+    results = [measure(module, args.repeat) for module in args.module or MODULES]
+    for result in results:
+        print(f"{result['module']:<32} median {result['median_ms']:>7} ms  min {result['min_ms']:>7} ms  "
+              f"eager: {', '.join(result['eager_dependencies']) or '-'}")
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    failures = [result['module'] for result in results if result['eager_dependencies'] or
+                (args.budget_ms is not None and result['median_ms'] > args.budget_ms)]
+    if failures:
+        sys.exit(f"Import too slow or loading heavy dependencies: {', '.join(failures)}")
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Runs the benchmark scenarios offline and reports throughput, latency and memory.
+
+Usage, from the repository root:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenario multi_tool_turn --iterations 50 --concurrency 8 --latency 0.2
+    python -m benchmarks.run --json results.json
+"""
+import json
+import time
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from MyGPT import auxiliar_functions as af
+from MyGPT import MetricsRecorderClass
+from MyGPT import OutputSinkClass
+from benchmarks import scenarios
+
+def percentile(samples, quantile):
+    return MetricsRecorderClass.percentile(sorted(samples), quantile)
+
+def run_scenario(name, config):
+    """
+    Runs the iterations of a scenario, then a few more to measure memory.
+
+    Args:
+        name (str): Name of the scenario.
+        config: Benchmark configuration.
+
+    Returns:
+        dict: Iterations, throughput, latency percentiles in milliseconds and peak memory in KiB.
+    """
+    stock_source = af.get_stock_data_source()
+    image_pipeline = af.get_image_pipeline()
+    output = OutputSinkClass.get_default_sink()
+    # Bots print to the console, which would dominate the timings
+    OutputSinkClass.set_default_sink(OutputSinkClass.NullSink())
+    try:
+        run = scenarios.SCENARIOS[name](config)
+        latencies = []
+
+        def timed():
+            started = time.perf_counter()
+            run()
+            latencies.append(time.perf_counter() - started)
+
+        for _ in range(config.warmup):
+            run()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=config.concurrency) as executor:
+            for future in [executor.submit(timed) for _ in range(config.iterations)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        for _ in range(config.memory_iterations):
+            run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        af.set_stock_data_source(stock_source)
+        af.set_image_pipeline(image_pipeline)
+        OutputSinkClass.set_default_sink(output)
+
+    return {
+        'scenario': name,
+        'iterations': config.iterations,
+        'concurrency': config.concurrency,
+        'seconds': round(elapsed, 3),
+        'throughput': round(config.iterations / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'peak_memory_kib': round(peak / 1024, 1),
+    }
+
+def print_table(results):
+    columns = ['scenario', 'iterations', 'concurrency', 'throughput', 'p50_ms', 'p99_ms', 'peak_memory_kib']
+    widths = {column: max(len(column), *(len(str(result[column])) for result in results)) for column in columns}
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for result in results:
+        print('  '.join(str(result[column]).ljust(widths[column]) for column in columns))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of MyGPT and Bot.')
+    parser.add_argument('--scenario', action='append', choices=sorted(scenarios.SCENARIOS),
+                        help='Scenario to run, may be repeated (default: all).')
+    parser.add_argument('--iterations', type=int, default=20, help='Iterations per scenario (default: 20).')
+    parser.add_argument('--concurrency', type=int, default=1, help='Iterations run at once (default: 1).')
+    parser.add_argument('--warmup', type=int, default=1, help='Iterations run before timing (default: 1).')
+    parser.add_argument('--memory-iterations', type=int, default=2,
+                        help='Iterations traced to measure the peak memory (default: 2).')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds of each fake API response (default: 0.05).')
+    parser.add_argument('--token-interval', type=float, default=0.002,
+                        help='Seconds between streamed chunks (default: 0.002).')
+    parser.add_argument('--run-latency', type=float, default=0.3,
+                        help='Seconds an assistant run stays in progress (default: 0.3).')
+    parser.add_argument('--stock-latency', type=float, default=0.1,
+                        help='Seconds of each fake stock history download (default: 0.1).')
+    parser.add_argument('--turns', type=int, default=20, help='Turns of the long conversation (default: 20).')
+    parser.add_argument('--json', help='Path of a JSON file to write the results to.')
+    args = parser.parse_args(argv)
+
+    config = SimpleNamespace(**vars(args))
+    results = [run_scenario(name, config) for name in args.scenario or scenarios.SCENARIOS]
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Benchmark scenarios of the Bot, run against the fake OpenAI and Yahoo APIs.
+
+Each scenario is a function receiving the benchmark configuration and returning
+the function that runs one iteration.
+"""
+import os
+import time
+import tempfile
+import itertools
+
+import numpy as np
+from PIL import Image
+
+from MyGPT import auxiliar_functions as af
+from MyGPT import BotClass
+from MyGPT import ImagePipelineClass
+from MyGPT import ModelRouterClass
+from MyGPT import StockDataSourceClass
+from MyGPT import gpt_constants as c
+from benchmarks import fakes
+
+ANSWER = ('Claro! Aqui está um resumo do que encontrei: os papéis tiveram alta no período, com volatilidade '
+          'moderada e volume acima da média nas últimas semanas.')
+
+def last_message(params):
+    return params['messages'][-1]
+
+def text_responder(params):
+    """
+    Always answers with text.
+    """
+    return fakes.completion(ANSWER, prompt_tokens=sum(fakes.count_tokens(str(message.get('content')))
+                                                      for message in params['messages']))
+
+def tools_responder(params):
+    """
+    Asks for three tools on a user message and answers with text after their results.
+    """
+    if last_message(params)['role'] == 'user' and params.get('tool_choice') != 'none':
+        return fakes.completion(tool_calls=[
+            ('get_stock_price', {'stock_name': 'PETR4.SA', 'period': '1y'}),
+            ('get_stock_price', {'stock_name': 'VALE3.SA', 'period': '1y'}),
+            ('get_capabilities', {})
+        ])
+    return text_responder(params)
+
+def stock_tools_responder(params):
+    """
+    Asks for the histories of three different stocks on a user message, then answers with text.
+    """
+    if last_message(params)['role'] == 'user' and params.get('tool_choice') != 'none':
+        return fakes.completion(tool_calls=[('get_stock_price', {'stock_name': ticker, 'period': '1y'})
+                                            for ticker in ('PETR4.SA', 'VALE3.SA', 'ITUB4.SA')])
+    return text_responder(params)
+
+def slow_tail_responder(config):
+    """
+    Answers with text, the cheapest routed model taking ten times longer on every fifth request.
+    """
+    requests = itertools.count()
+
+    def respond(params):
+        if params['model'] == c.ROUTER_MODELS[0] and next(requests) % 5 == 0:
+            time.sleep(config.latency * 10)
+        return text_responder(params)
+    return respond
+
+def new_bot(config, responder, **gpt_options):
+    client = fakes.FakeOpenAIClient(responder, latency=config.latency, token_interval=config.token_interval,
+                                    run_latency=config.run_latency)
+    bot = BotClass.Bot(client=client, assistants_cache_path=None, **gpt_options)
+    bot.set_user('benchmark')
+    return bot
+
+def single_turn(config):
+    """
+    One question and its text answer, on a new bot.
+    """
+    def run():
+        new_bot(config, text_responder).answer('Olá, tudo bem?')
+    return run
+
+def streamed_turn(config):
+    """
+    One question answered through the streaming API, consuming all tokens.
+    """
+    def run():
+        bot = new_bot(config, text_responder)
+        bot.gpt.add_phrase(content='Olá, tudo bem?')
+        for _ in bot.gpt.stream_chat():
+            pass
+    return run
+
+def multi_tool_turn(config):
+    """
+    One question resolved with three concurrent tools, two of them stock histories.
+    """
+    af.set_stock_data_source(fakes.FakeStockSource(latency=config.stock_latency))
+
+    def run():
+        new_bot(config, tools_responder).answer('Como foram PETR4 e VALE3 no último ano?')
+    return run
+
+def cached_stock_turn(config):
+    """
+    Three stock histories fetched concurrently through the default CachedDataSource, whose
+    tails are downloaded again on every call from a slow source.
+    """
+    af.set_stock_data_source(StockDataSourceClass.CachedDataSource(
+        fakes.FakeStockSource(latency=config.stock_latency), cache_dir=tempfile.mkdtemp(prefix='mygpt-benchmark-'),
+        refresh_interval=0))
+
+    def run():
+        new_bot(config, stock_tools_responder).answer('Como foram PETR4, VALE3 e ITUB4 no último ano?')
+    return run
+
+def long_conversation(config):
+    """
+    A conversation of many turns, trimmed by the conversation memory.
+    """
+    def run():
+        bot = new_bot(config, text_responder)
+        for turn in range(config.turns):
+            bot.answer(f'Pergunta número {turn}: me conte mais sobre o mercado de ações brasileiro.')
+    return run
+
+def image_description(config):
+    """
+    Description of a large local photo, downscaled and encoded on every iteration.
+    """
+    directory = tempfile.mkdtemp(prefix='mygpt-benchmark-')
+    path = os.path.join(directory, 'photo.jpg')
+    pixels = (np.random.default_rng(0).random((1800, 2400, 3)) * 255).astype('uint8')
+    Image.fromarray(pixels).save(path, quality=92)
+    pipeline = ImagePipelineClass.ImagePipeline()
+    af.set_image_pipeline(pipeline)
+
+    def run():
+        pipeline.clear()
+        new_bot(config, text_responder).get_image_description('Descreva a imagem.', path)
+    return run
+
+def assistant_math(config):
+    """
+    A math question solved by the code interpreter assistant, with run polling.
+    """
+    def run():
+        new_bot(config, text_responder).call_math_assistent(
+            'Se eu jogar um dado honesto 1000 vezes, qual é a probabilidade de obter exatamente 150 vezes o número 6?')
+    return run
+
+def hedged_turn(config):
+    """
+    One question on a model with a slow tail, hedged to the next model after three times the usual latency.
+    """
+    responder = slow_tail_responder(config)
+    router = ModelRouterClass.ModelRouter(hedge_delay=config.latency * 3)
+
+    def run():
+        new_bot(config, responder, model_router=router).answer('Olá, tudo bem?')
+    return run
+
+SCENARIOS = {
+    'single_turn': single_turn,
+    'streamed_turn': streamed_turn,
+    'multi_tool_turn': multi_tool_turn,
+    'cached_stock_turn': cached_stock_turn,
+    'long_conversation': long_conversation,
+    'image_description': image_description,
+    'assistant_math': assistant_math,
+    'hedged_turn': hedged_turn,
+}